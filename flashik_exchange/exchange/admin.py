@@ -1,8 +1,214 @@
+"""
+Админка для больших таблиц.
+
+Таблицы ордеров, сделок и балансов содержат миллионы строк, поэтому
+списки в админке не делают полный COUNT(*) (EstimatedCountPaginator,
+show_full_result_count = False), связанные объекты подгружаются одним
+JOIN (list_select_related), а пользователь выбирается по id (raw_id_fields)
+вместо выпадающего списка из всех пользователей. Фильтры - только по
+полям с фиксированным набором значений и по тикеру из таблицы
+инструментов, без SELECT DISTINCT по большой таблице.
+
+Ордера, сделки и журнал балансов в админке только для чтения: их меняют
+сопоставление и фоновые процессы, правка в обход них нарушила бы
+согласованность балансов и журнала.
+"""
 from django.contrib import admin
-from .models import User, Instrument, Transaction, Order, Balance
+from django.contrib.admin.utils import get_fields_from_path
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import (
+    ArchivedOrder, Balance, DelistingJob, Instrument, LedgerEntry, Order,
+    Transaction, User
+)
+
+# Точный подсчёт строк выборки останавливается на этом числе
+COUNT_LIMIT = 10000
+
+
+def estimated_rows(model, using='default'):
+    """
+    Оценка числа строк таблицы без её сканирования: PostgreSQL - статистика
+    планировщика, SQLite - наибольший rowid (удаления не учитываются).
+    None, если оценка недоступна.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор без COUNT(*) по всей таблице: для списка без фильтров - оценка
+    по estimated_rows, для отфильтрованного - точное число, но не больше
+    COUNT_LIMIT (дальние страницы такой выборки недоступны, её нужно
+    сузить фильтром).
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class TickerFilter(admin.SimpleListFilter):
+    """Фильтр по тикеру: варианты берутся из таблицы инструментов"""
+
+    title = 'ticker'
+    parameter_name = 'ticker'
+
+    def lookups(self, request, model_admin):
+        return [(ticker, ticker) for ticker in Instrument.objects.values_list('ticker', flat=True)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(ticker=self.value())
+        return queryset
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск точным совпадением по search_fields. Стандартный поиск админки
+        строит для '=поле' iexact (LIKE), который не использует индекс, и
+        просматривает всю таблицу.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        condition = Q()
+        for path in self.search_fields:
+            path = path.lstrip('=')
+            field = get_fields_from_path(self.model, path)[-1]
+            try:
+                value = field.to_python(search_term)
+            except ValidationError:
+                continue
+            condition |= Q(**{path: value})
+        if not condition:
+            return queryset.none(), False
+        return queryset.filter(condition), False
+
+
+class ReadOnlyAdmin(LargeTableAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'role']
+    list_filter = ['role']
+    search_fields = ['=id', '=api_key']
+
+
+@admin.register(Instrument)
+class InstrumentAdmin(admin.ModelAdmin):
+    list_display = ['ticker', 'name', 'tick_size', 'scale', 'shard', 'status']
+    list_filter = ['status']
+    search_fields = ['ticker', 'name']
+    # Делистинг - через DELETE /admin/instrument/<ticker>: он отменяет
+    # ордера и конвертирует балансы (exchange.delisting)
+    readonly_fields = ['status']
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.readonly_fields
+        # Балансы, ордера и сделки хранятся в минимальных единицах scale,
+        # цены ордеров в стакане кратны tick_size, а ордера и лента сделок
+        # ссылаются на тикер строкой: у существующего инструмента они не
+        # меняются
+        return self.readonly_fields + ['ticker', 'scale', 'tick_size']
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class OrderFieldsAdmin(ReadOnlyAdmin):
+    list_display = [
+        'id', 'user', 'ticker', 'order_type', 'direction', 'price', 'qty',
+        'filled', 'status', 'created_at',
+    ]
+    list_select_related = ['user']
+    list_filter = ['status', 'order_type', 'direction', TickerFilter]
+    raw_id_fields = ['user']
+    # Ордер или все ордера пользователя по id; оба поиска идут по индексам
+    search_fields = ['=id', '=user__id']
+
+
+@admin.register(Order)
+class OrderAdmin(OrderFieldsAdmin):
+    pass
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(OrderFieldsAdmin):
+    list_display = OrderFieldsAdmin.list_display + ['archived_at']
+
+
+@admin.register(Transaction)
+class TransactionAdmin(ReadOnlyAdmin):
+    """Лента сделок (живая часть; архив - exchange.tape)"""
+
+    list_display = ['id', 'ticker', 'amount', 'price', 'timestamp']
+    list_filter = [TickerFilter]
+    # Порядок по id совпадает с порядком записи и не требует сортировки
+    ordering = ['-id']
+
+
+@admin.register(Balance)
+class BalanceAdmin(ReadOnlyAdmin):
+    """Балансы меняются через API и массовые операции (с записью в журнал)"""
+
+    list_display = ['id', 'user', 'instrument', 'amount']
+    list_select_related = ['user', 'instrument']
+    list_filter = ['instrument']
+    raw_id_fields = ['user']
+    search_fields = ['=user__id']
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(ReadOnlyAdmin):
+    list_display = ['id', 'user', 'instrument', 'kind', 'amount', 'trade_id', 'created_at']
+    list_select_related = ['user', 'instrument']
+    list_filter = ['kind', 'instrument']
+    raw_id_fields = ['user']
+    search_fields = ['=user__id']
+    ordering = ['-id']
+
 
-admin.site.register(User)
-admin.site.register(Instrument)
-admin.site.register(Transaction)
-admin.site.register(Order)
-admin.site.register(Balance)
+@admin.register(DelistingJob)
+class DelistingJobAdmin(ReadOnlyAdmin):
+    list_display = [
+        'id', 'instrument', 'stage', 'price', 'orders_cancelled',
+        'balances_converted', 'trades_archived', 'orders_archived', 'created_at',
+    ]
+    list_select_related = ['instrument']
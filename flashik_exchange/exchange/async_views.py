@@ -0,0 +1,179 @@
+"""
+Асинхронные версии публичных эндпоинтов чтения и баланса.
+
+Подключаются вместо синхронных APIView, когда проект запущен через
+asgi.py (EXCHANGE_ASYNC_READS). Запросы к БД и кэшу выполняются через
+асинхронный ORM и асинхронный API кэша, поэтому ожидающий ответа
+читатель не занимает поток воркера.
+"""
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import Throttled
+
+from .db_router import read_your_writes
+from . import auth, book_snapshot, tape, throttling, versions
+from .auth import get_api_key
+from .renderers import dumps
+from .models import User, Instrument, Balance, OrderBook
+from .serializers import (
+    InstrumentSerializer, TransactionHistoryQuerySerializer, transaction_rows
+)
+
+
+def json_response(data, status=200):
+    """JSON-ответ в том же формате, что и у DRF JSONRenderer"""
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+async def aget_authenticated_user(request):
+    """Асинхронная версия views.get_authenticated_user"""
+    api_key = get_api_key(request)
+    if api_key is None:
+        return None
+    try:
+        user = await User.objects.aget(api_key=api_key)
+    except User.DoesNotExist:
+        return None
+    auth.remember(api_key, user)
+    return user
+
+
+class ThrottledView(View):
+    """View с ограничением частоты запросов по throttle_scope, как у APIView"""
+
+    throttle_scope = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        rate_limit = throttling.check_request(request, self.throttle_scope)
+        if rate_limit is not None and not rate_limit.allowed:
+            # Текст ошибки - как у DRF
+            detail = Throttled(math.ceil(rate_limit.retry_after)).detail
+            return json_response({"detail": detail}, status=429)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def cached(key, producer):
+    """Читает значение из кэша или вычисляет и сохраняет его"""
+    timeout = settings.EXCHANGE_PUBLIC_CACHE_TIMEOUT
+    if not timeout:
+        return await producer()
+
+    value = await cache.aget(key)
+    if value is None:
+        value = await producer()
+        await cache.aset(key, value, timeout)
+    return value
+
+
+class AsyncInstrumentListView(ThrottledView):
+    """Публичный эндпоинт для получения списка доступных инструментов"""
+
+    throttle_scope = 'public'
+
+    # ETag: данные читаются из основной базы (см. versions.py)
+    @read_your_writes
+    async def get(self, request):
+        etag = await versions.ainstruments_etag()
+        not_modified = versions.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        async def produce():
+            instruments = [instrument async for instrument in Instrument.objects.filter(status='ACTIVE')]
+            return InstrumentSerializer(instruments, many=True).data
+
+        # Версия в ключе: изменение реестра сразу вытесняет кэш
+        data = await cached(f'public:instruments:{etag}', produce)
+        return versions.set_etag(json_response(data), etag)
+
+
+class AsyncOrderbookView(ThrottledView):
+    """Получение актуального ордербука по указанному инструменту"""
+
+    throttle_scope = 'public'
+
+    # ETag: данные читаются из основной базы (см. versions.py)
+    @read_your_writes
+    async def get(self, request, ticker):
+        if book_snapshot.enabled():
+            # Снимок из разделяемой памяти, без обращения к БД
+            snapshot = book_snapshot.read(ticker)
+            if snapshot is None and await Instrument.objects.filter(ticker=ticker).aexists():
+                await sync_to_async(book_snapshot.publish)(ticker)
+                snapshot = book_snapshot.read(ticker)
+            if snapshot is not None:
+                etag, data = snapshot
+                not_modified = versions.not_modified(request, etag)
+                if not_modified is not None:
+                    return not_modified
+                return versions.set_etag(json_response(data), etag)
+
+        etag = await versions.abook_etag(ticker)
+        not_modified = versions.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        if not await Instrument.objects.filter(ticker=ticker).aexists():
+            return json_response(
+                {"detail": "Instrument not found"},
+                status=404
+            )
+
+        async def produce():
+            return await OrderBook.aget_order_book(ticker)
+
+        data = await cached(f'public:orderbook:{ticker}:{etag}', produce)
+        return versions.set_etag(json_response(data), etag)
+
+
+class AsyncTransactionHistoryView(ThrottledView):
+    """История сделок по инструменту"""
+
+    throttle_scope = 'public'
+
+    async def get(self, request, ticker):
+        serializer = TransactionHistoryQuerySerializer(data=request.GET)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=422)
+        params = serializer.validated_data
+        since, until, limit = params.get('since'), params.get('until'), params['limit']
+
+        async def produce():
+            # Чтение архивных файлов блокирующее, выполняем его в потоке
+            transactions = await sync_to_async(tape.recent_trades)(ticker, since, until, limit)
+            return transaction_rows(transactions)
+
+        key = f'public:transactions:{ticker}:{since and since.isoformat()}:{until and until.isoformat()}:{limit}'
+        return json_response(await cached(key, produce))
+
+
+class AsyncBalanceView(ThrottledView):
+    """Получение баланса пользователя по всем активам"""
+
+    throttle_scope = 'balance'
+
+    @read_your_writes
+    async def get(self, request):
+        identity = auth.cached_identity(get_api_key(request))
+        if identity is not None:
+            not_modified = versions.not_modified(
+                request, await versions.abalance_etag(identity[0])
+            )
+            if not_modified is not None:
+                return not_modified
+
+        user = await aget_authenticated_user(request)
+        if user is None:
+            return json_response(
+                {"detail": "Неверный или отсутствующий API ключ"},
+                status=401
+            )
+
+        etag = await versions.abalance_etag(user.id)
+        balances = await Balance.aget_user_balances(user)
+        return versions.set_etag(json_response(balances), etag, private=True)
@@ -0,0 +1,40 @@
+"""
+API ключи и кэш известных ключей в памяти процесса.
+
+После успешной аутентификации ключ запоминается вместе с идентификатором
+и ролью пользователя. Этим пользуются проверки, которые должны выполняться
+до обращения к БД: ограничение частоты запросов (throttling.py) и ответ
+304 на неизменившийся баланс (BalanceView).
+"""
+from .lru import ExpiringLRU
+
+# Сколько секунд помнить ключ (смена роли или ключа видна не позже)
+API_KEY_TTL = 300
+MAX_API_KEYS = 100000
+
+_identities = ExpiringLRU(MAX_API_KEYS, API_KEY_TTL)
+
+
+def get_api_key(request):
+    """API ключ из заголовка Authorization формата TOKEN <api_key>"""
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith("TOKEN "):
+        parts = auth_header.split()
+        if len(parts) > 1:
+            return parts[1]
+    return None
+
+
+def remember(api_key, user):
+    _identities.set(api_key, (user.id, user.role))
+
+
+def forget(api_key):
+    _identities.pop(api_key)
+
+
+def cached_identity(api_key):
+    """(user_id, role) для уже встречавшегося ключа, иначе None"""
+    if not api_key:
+        return None
+    return _identities.get(api_key)
@@ -0,0 +1,342 @@
+"""
+Снимки стаканов в разделяемой памяти.
+
+При нескольких веб-воркерах каждый из них читал стакан из БД. Со снимками
+(EXCHANGE_BOOK_SNAPSHOT - имя сегмента) лучшие EXCHANGE_BOOK_SNAPSHOT_DEPTH
+уровней каждой стороны стакана лежат в сегменте multiprocessing.shared_memory,
+и OrderbookView любого воркера отдаёт их без обращения к БД.
+
+Публикует снимок процесс, изменивший стакан: после коммита транзакции, в
+которой вызывался versions.bump_book (шард сопоставления, воркер при
+сопоставлении в процессе воркера, отмена ордера, свипер, делистинг).
+Публикация читает уровни из БД под блокировкой слота тикера, поэтому
+последняя публикация всегда содержит состояние не старее любой
+зафиксированной до неё транзакции. Между коммитом и публикацией снимок
+отстаёт на время одного запроса к БД.
+
+Раскладка сегмента (little-endian):
+
+    заголовок: magic 8s, depth u32, slots u32, epoch u64
+    слот:      seq u64, version u64, ticker 16s, bids u32, asks u32,
+               depth пар (price i64, qty i64) покупок,
+               depth пар (price i64, qty i64) продаж
+
+Слот тикера ищется открытой адресацией от crc32 тикера. Запись в слот
+защищена seqlock: писатель делает seq нечётным, пишет уровни и делает seq
+чётным, а читатель повторяет чтение, если seq был нечётным или изменился.
+Писатели разных процессов исключают друг друга блокировкой байта слота
+в файле блокировки (fcntl.lockf), потоки одного процесса - threading.Lock.
+
+Сегмент переживает перезапуск процессов. При развёртывании его нужно
+пересоздать командой `python manage.py publish_book_snapshots`: пока
+снимки выключены, стаканы меняются без публикации.
+"""
+import fcntl
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+from django.conf import settings
+from django.db import transaction
+
+from .db_router import use_primary
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FLBOOK01'
+RETIRED = b'RETIRED0'
+
+_HEADER = struct.Struct('<8sIIQ')
+_SLOT = struct.Struct('<QQ16sII')
+_LEVEL_SIZE = 16
+
+# Повторов чтения, пока писатель обновляет слот
+READ_ATTEMPTS = 100
+
+
+def enabled():
+    return bool(settings.EXCHANGE_BOOK_SNAPSHOT)
+
+
+def _slot_size(depth):
+    return _SLOT.size + 2 * depth * _LEVEL_SIZE
+
+
+def _hash(ticker):
+    return zlib.crc32(ticker.encode())
+
+
+class Segment:
+    """Подключение процесса к сегменту снимков"""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.buf = shm.buf
+        _, self.depth, self.slots, self.epoch = _HEADER.unpack_from(self.buf, 0)
+        self.slot_size = _slot_size(self.depth)
+        # Уровни читаются и пишутся через представление int64 без копирования
+        self.words = self.buf.cast('q')
+        self.indexes = {}
+
+    def __del__(self):
+        # Иначе SharedMemory не сможет закрыть отображение
+        self.words.release()
+
+    @property
+    def alive(self):
+        return bytes(self.buf[:len(MAGIC)]) == MAGIC
+
+    def _offset(self, index):
+        return _HEADER.size + index * self.slot_size
+
+    def _ticker_at(self, index):
+        return _SLOT.unpack_from(self.buf, self._offset(index))[2].rstrip(b'\0')
+
+    def find(self, ticker, allocate=False):
+        """
+        Индекс слота тикера или None. С allocate занимает свободный слот
+        (вызывать под блокировкой выделения).
+        """
+        index = self.indexes.get(ticker)
+        if index is not None:
+            return index
+        name = ticker.encode()
+        start = _hash(ticker) % self.slots
+        for probe in range(self.slots):
+            index = (start + probe) % self.slots
+            current = self._ticker_at(index)
+            if current == name:
+                self.indexes[ticker] = index
+                return index
+            if not current:
+                if not allocate:
+                    return None
+                _SLOT.pack_into(self.buf, self._offset(index), 0, 0, name, 0, 0)
+                self.indexes[ticker] = index
+                return index
+        return None
+
+    def write(self, index, bids, asks):
+        """Записывает уровни в слот (под блокировкой слота)"""
+        offset = self._offset(index)
+        seq, version, name, _, _ = _SLOT.unpack_from(self.buf, offset)
+        _SLOT.pack_into(self.buf, offset, seq + 1, version, name, 0, 0)
+        start = (offset + _SLOT.size) // 8
+        for side, levels in enumerate((bids, asks)):
+            position = start + side * self.depth * 2
+            for price, qty in levels:
+                self.words[position] = price
+                self.words[position + 1] = qty
+                position += 2
+        _SLOT.pack_into(self.buf, offset, seq + 2, version + 1, name, len(bids), len(asks))
+
+    def read(self, index):
+        """(версия, уровни покупок, уровни продаж) или None, если слот занят писателем"""
+        offset = self._offset(index)
+        start = (offset + _SLOT.size) // 8
+        for _ in range(READ_ATTEMPTS):
+            seq, version, _, bids, asks = _SLOT.unpack_from(self.buf, offset)
+            if seq % 2:
+                continue
+            asks_start = start + self.depth * 2
+            bid_words = self.words[start:start + bids * 2].tolist()
+            ask_words = self.words[asks_start:asks_start + asks * 2].tolist()
+            if _SLOT.unpack_from(self.buf, offset)[0] == seq:
+                return version, bid_words, ask_words
+        return None
+
+
+_segment = None
+_segment_lock = threading.Lock()
+_slot_locks = {}
+_lock_file = None
+
+
+def _lock_path():
+    return os.path.join(
+        settings.EXCHANGE_SHARD_SOCKET_DIR, f'{settings.EXCHANGE_BOOK_SNAPSHOT}.lock'
+    )
+
+
+@contextmanager
+def _locked(byte):
+    """
+    Блокировка байта byte файла блокировки: 0 - создание сегмента и
+    выделение слотов, 1 + индекс - запись в слот
+    """
+    global _lock_file
+    with _slot_locks.setdefault(byte, threading.Lock()):
+        if _lock_file is None:
+            os.makedirs(settings.EXCHANGE_SHARD_SOCKET_DIR, exist_ok=True)
+            _lock_file = open(_lock_path(), 'a+b')
+        fcntl.lockf(_lock_file, fcntl.LOCK_EX, 1, byte)
+        try:
+            yield
+        finally:
+            fcntl.lockf(_lock_file, fcntl.LOCK_UN, 1, byte)
+
+
+def _open(create=False):
+    depth = settings.EXCHANGE_BOOK_SNAPSHOT_DEPTH
+    slots = settings.EXCHANGE_BOOK_SNAPSHOT_TICKERS
+    size = _HEADER.size + slots * _slot_size(depth)
+    shm = shared_memory.SharedMemory(settings.EXCHANGE_BOOK_SNAPSHOT, create=create, size=size)
+    # Иначе resource_tracker удалит сегмент при выходе процесса (Python < 3.13)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    if create:
+        _HEADER.pack_into(shm.buf, 0, MAGIC, depth, slots, time.time_ns())
+    return shm
+
+
+def _retire(shm):
+    """Помечает сегмент устаревшим (подключённые к нему читатели переподключатся) и удаляет его"""
+    shm.buf[:len(RETIRED)] = RETIRED
+    # unlink() снимает сегмент с учёта resource_tracker, а _open его уже снял
+    resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+def _attach(create):
+    """
+    Подключается к сегменту; с create создаёт его при отсутствии. None, если
+    сегмента нет или создатель ещё не записал заголовок.
+    """
+    try:
+        current = Segment(_open())
+    except FileNotFoundError:
+        if not create:
+            return None
+        with _locked(0):
+            try:
+                current = Segment(_open())
+            except FileNotFoundError:
+                current = Segment(_open(create=True))
+    return current if current.alive else None
+
+
+def segment(create=False):
+    """Сегмент снимков процесса или None, если его ещё никто не создал"""
+    global _segment
+    current = _segment
+    if current is not None and current.alive:
+        return current
+    with _segment_lock:
+        # Отображение устаревшего сегмента освободит сборщик мусора, когда
+        # его перестанут читать другие потоки
+        if _segment is None or not _segment.alive:
+            _segment = _attach(create)
+        return _segment
+
+
+def reset():
+    """Пересоздаёт сегмент с текущими настройками глубины и числа тикеров"""
+    global _segment
+    with _segment_lock, _locked(0):
+        try:
+            _retire(_open())
+        except FileNotFoundError:
+            pass
+        _segment = Segment(_open(create=True))
+
+
+def publish(ticker):
+    """
+    Читает лучшие уровни стакана тикера из БД и записывает их в сегмент.
+    False, если снимок не записан.
+    """
+    from .models import OrderBook
+
+    current = segment(create=True)
+    if current is None:
+        return False
+    index = current.find(ticker)
+    if index is None:
+        with _locked(0):
+            index = current.find(ticker, allocate=True)
+        if index is None:
+            logger.warning('Book snapshot segment is full, %s is not published', ticker)
+            return False
+    # Реплика может отставать: публикация читает основную базу
+    with _locked(1 + index), use_primary():
+        bids = OrderBook.top_levels(ticker, 'BUY', current.depth)
+        asks = OrderBook.top_levels(ticker, 'SELL', current.depth)
+        current.write(index, bids, asks)
+    return True
+
+
+def publish_all(tickers):
+    for ticker in tickers:
+        publish(ticker)
+
+
+class _Publish:
+    def __init__(self, ticker):
+        self.ticker = ticker
+
+    def __call__(self):
+        publish(self.ticker)
+
+
+def publish_on_commit(ticker):
+    """
+    Публикует стакан после коммита текущей транзакции; несколько изменений
+    стакана в одной транзакции публикуются один раз
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        active = set(connection.savepoint_ids)
+        for savepoints, callback, _ in connection.run_on_commit:
+            # Публикация, которую не отменит откат точки сохранения
+            if isinstance(callback, _Publish) and callback.ticker == ticker and set(savepoints) <= active:
+                return
+    # Ошибка публикации не должна ломать уже зафиксированный запрос:
+    # читатели тогда получат стакан из БД
+    transaction.on_commit(_Publish(ticker), robust=True)
+
+
+def read(ticker):
+    """
+    Снимок стакана тикера: (ETag, стакан в формате OrderBook.get_order_book)
+    или None, если тикер не опубликован
+    """
+    current = segment()
+    if current is None:
+        return None
+    index = current.find(ticker)
+    if index is None:
+        return None
+    snapshot = current.read(index)
+    if snapshot is None:
+        return None
+    version, bids, asks = snapshot
+    if not version:
+        return None
+    # Версия слота растёт с каждой публикацией; epoch отличает пересозданный сегмент
+    etag = f'"s{current.epoch}.{version}"'
+    return etag, {
+        'bid_levels': [{'price': bids[i], 'qty': bids[i + 1]} for i in range(0, len(bids), 2)],
+        'ask_levels': [{'price': asks[i], 'qty': asks[i + 1]} for i in range(0, len(asks), 2)],
+    }
+
+
+def read_many(tickers, depth):
+    """
+    Снимки стаканов нескольких тикеров, обрезанные до depth уровней:
+    {ticker: стакан}. None, если снимки не покрывают запрос: тикер не
+    опубликован или depth больше глубины сегмента.
+    """
+    current = segment()
+    if current is None or depth > current.depth:
+        return None
+    books = {}
+    for ticker in tickers:
+        snapshot = read(ticker)
+        if snapshot is None:
+            return None
+        books[ticker] = {side: levels[:depth] for side, levels in snapshot[1].items()}
+    return books
@@ -0,0 +1,179 @@
+"""
+Массовые начисления и списания балансов.
+
+Операции (user_id, ticker, amount) применяются порциями: на порцию -
+один запрос пользователей, один запрос текущих балансов, один upsert,
+прибавляющий изменения к балансам, и одна вставка в журнал балансов,
+всё в одной транзакции. Операции внутри порции применяются по порядку,
+поэтому списание после начисления того же пользователя видит
+начисление.
+Ошибочные строки (неизвестный пользователь или тикер, недостаточно
+средств) пропускаются и попадают в отчёт в порядке строк, остальные
+применяются.
+"""
+import uuid
+from itertools import islice
+from operator import itemgetter
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from . import settlement, versions
+from .models import Balance, Instrument, LedgerEntry, PendingSettlement, User
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# Балансов в одном upsert (ограничение числа параметров запроса)
+UPSERT_BATCH_SIZE = 1000
+
+
+class BulkResult:
+    def __init__(self):
+        self.applied = 0
+        self.failed = []
+
+    def fail(self, row, detail):
+        self.failed.append({'row': row, 'detail': detail})
+
+    def as_dict(self):
+        return {'applied': self.applied, 'failed': self.failed}
+
+
+def apply_balance_deltas(operations, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """
+    Применяет операции вида (user_id, ticker, amount), amount - в единицах API,
+    положительный для начисления и отрицательный для списания.
+    Номер строки в отчёте об ошибках считается с 1.
+    """
+    # Балансы делистингуемых инструментов конвертирует exchange.delisting
+    instruments = {
+        instrument.ticker: instrument
+        for instrument in Instrument.objects.filter(status='ACTIVE')
+    }
+    result = BulkResult()
+    operations = iter(operations)
+    row = 0
+
+    while True:
+        chunk = list(islice(operations, chunk_size))
+        if not chunk:
+            return result
+        _apply_chunk(chunk, row, instruments, result)
+        row += len(chunk)
+        if progress is not None:
+            progress(row, result)
+
+
+def _parse(chunk, first_row, instruments, result):
+    parsed = []
+    for offset, operation in enumerate(chunk):
+        row = first_row + offset + 1
+        try:
+            user_id, ticker, amount = operation
+            user_id = uuid.UUID(str(user_id))
+            instrument = instruments[ticker]
+            delta = instrument.to_minor(amount if isinstance(amount, int) else str(amount))
+        except KeyError:
+            result.fail(row, 'Invalid ticker')
+            continue
+        except (TypeError, ValueError, ArithmeticError):
+            result.fail(row, 'Invalid operation')
+            continue
+        except ValidationError as e:
+            result.fail(row, e.messages[0])
+            continue
+        parsed.append((row, user_id, instrument.id, delta))
+    return parsed
+
+
+def _apply_chunk(chunk, first_row, instruments, result):
+    first_failure = len(result.failed)
+    _apply_parsed(_parse(chunk, first_row, instruments, result), result)
+    # Ошибки разбора и ошибки применения - в порядке строк
+    result.failed[first_failure:] = sorted(result.failed[first_failure:], key=itemgetter('row'))
+
+
+def _apply_parsed(parsed, result):
+    if not parsed:
+        return
+
+    user_ids = {user_id for _, user_id, _, _ in parsed}
+    instrument_ids = {instrument_id for _, _, instrument_id, _ in parsed}
+
+    with transaction.atomic():
+        known_users = set(
+            User.objects.filter(id__in=user_ids).values_list('id', flat=True)
+        )
+        amounts = {
+            (user_id, instrument_id): amount
+            for user_id, instrument_id, amount in Balance.objects
+            .select_for_update()
+            .filter(user_id__in=known_users, instrument_id__in=instrument_ids)
+            .values_list('user_id', 'instrument_id', 'amount')
+        }
+
+        # Отложенный расчёт: списание проверяется по доступному балансу
+        pending = {}
+        if settlement.deferred_enabled():
+            pending = {
+                (user_id, instrument_id): total
+                for user_id, instrument_id, total in PendingSettlement.objects
+                .filter(user_id__in=known_users, instrument_id__in=instrument_ids)
+                .values_list('user_id', 'instrument_id')
+                .annotate(total=Sum('amount'))
+            }
+
+        deltas = {}
+        entries = []
+        for row, user_id, instrument_id, delta in parsed:
+            if user_id not in known_users:
+                result.fail(row, 'User not found')
+                continue
+            key = (user_id, instrument_id)
+            new_amount = amounts.get(key, 0) + delta
+            if new_amount + pending.get(key, 0) < 0:
+                result.fail(row, 'Insufficient balance')
+                continue
+            amounts[key] = new_amount
+            deltas[key] = deltas.get(key, 0) + delta
+            entries.append(LedgerEntry(
+                user_id=user_id, instrument_id=instrument_id, amount=delta, kind='ADJUSTMENT'
+            ))
+            result.applied += 1
+
+        increment_balances(deltas)
+        LedgerEntry.objects.bulk_create(entries)
+        # upsert и bulk_create не отправляют post_save
+        versions.bump_balances({user_id for user_id, _ in deltas})
+
+
+def increment_balances(deltas):
+    """
+    Прибавляет изменения {(user_id, instrument_id): delta} к балансам
+    одним upsert на UPSERT_BATCH_SIZE балансов: недостающий баланс
+    вставляется, существующий увеличивается на amount + excluded.amount.
+    Посчитанные суммы не записываются, поэтому изменения баланса из других
+    транзакций между чтением и записью не теряются.
+    """
+    quote = connection.ops.quote_name
+    table = quote(Balance._meta.db_table)
+    user_field = Balance._meta.get_field('user')
+    user, instrument, amount = (
+        quote(Balance._meta.get_field(name).column) for name in ('user', 'instrument', 'amount')
+    )
+    rows = [
+        (user_field.get_db_prep_value(user_id, connection), instrument_id, delta)
+        for (user_id, instrument_id), delta in deltas.items()
+        if delta
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {table} ({user}, {instrument}, {amount}) '
+                f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({user}, {instrument}) '
+                f'DO UPDATE SET {amount} = {table}.{amount} + excluded.{amount}',
+                [value for row in batch for value in row],
+            )
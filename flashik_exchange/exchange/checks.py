@@ -0,0 +1,44 @@
+import os
+
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии для ETag (versions.py) и ключи идемпотентности (idempotency.py)
+    должны быть общими для всех процессов: процесс, не видевший изменения,
+    отвечает 304 на устаревшие данные, а повтор запроса на другом воркере
+    исполняется ещё раз. Проверка только для check --deploy: тесты и
+    разработка работают в одном процессе
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if backend.endswith('LocMemCache'):
+        return [Warning(
+            'The default cache is process-local: ETag versions bumped in one '
+            'process (web worker, matching shard, settlement) are invisible to '
+            'the others, which keep answering 304 to stale data, and '
+            'Idempotency-Key retries reaching another worker run again.',
+            hint='Configure a shared cache backend in CACHES unless the API '
+                 'runs in a single process.',
+            id='exchange.W001',
+        )]
+    return []
+
+
+@register(deploy=True)
+def check_schema_generated(app_configs, **kwargs):
+    """
+    Схема OpenAPI строится при деплое (generate_schema), а не на запросе:
+    без файла SchemaView отвечает 503
+    """
+    path = str(settings.EXCHANGE_SCHEMA_PATH)
+    if not os.path.exists(path):
+        return [Warning(
+            f'The OpenAPI schema file {path} does not exist: the schema '
+            'endpoint answers 503.',
+            hint='Run `python manage.py generate_schema` as a deploy step.',
+            id='exchange.W002',
+        )]
+    return []
@@ -0,0 +1,76 @@
+"""
+Маршрутизация чтений на реплику.
+
+Если в DATABASES настроен алиас ``replica``, все чтения моделей exchange
+уходят на него, а запись - на ``default``. Эндпоинты, которым нужны только
+что записанные данные (баланс после депозита, свежий статус ордера),
+явно закрепляют чтения за основной базой декоратором ``read_your_writes``
+или контекстным менеджером ``use_primary``. Внутри транзакции на основной
+базе чтения тоже идут в неё, поэтому сопоставление ордеров всегда видит
+актуальный стакан.
+"""
+import asyncio
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+_primary_pinned = ContextVar('exchange_primary_pinned', default=False)
+
+
+@contextmanager
+def use_primary():
+    """Направляет все чтения внутри блока на основную базу"""
+    token = _primary_pinned.set(True)
+    try:
+        yield
+    finally:
+        _primary_pinned.reset(token)
+
+
+def read_your_writes(view_method):
+    """Декоратор метода view: чтения идут на основную базу"""
+    if asyncio.iscoroutinefunction(view_method):
+        @functools.wraps(view_method)
+        async def async_wrapper(*args, **kwargs):
+            with use_primary():
+                return await view_method(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view_method)
+    def wrapper(*args, **kwargs):
+        with use_primary():
+            return view_method(*args, **kwargs)
+    return wrapper
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in connections.databases
+
+
+class ReplicaRouter:
+    """Чтения моделей exchange - с реплики, запись - в основную базу"""
+
+    app_label = 'exchange'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label or not replica_configured():
+            return None
+        if _primary_pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != self.app_label:
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же данные, что и основная база
+        databases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
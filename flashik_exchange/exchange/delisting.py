@@ -0,0 +1,228 @@
+"""
+Делистинг инструмента в фоне.
+
+DELETE /admin/instrument/<ticker> только останавливает торги (статус
+HALTED: новые ордера, депозиты и выводы по тикеру отклоняются) и ставит
+задание DelistingJob. Процесс `python manage.py run_delistings` выполняет
+задание по этапам, каждый - порциями в коротких транзакциях, поэтому
+запись по другим тикерам не блокируется:
+
+1. отмена ордеров в стакане и ожидающих стопов;
+2. ожидание, пока run_settlement применит отложенные изменения балансов
+   по тикеру (при EXCHANGE_DEFERRED_SETTLEMENT);
+3. конвертация балансов в USD по цене задания, с записями DELISTING в
+   журнале балансов;
+4. архивация сделок тикера (exchange.tape) и ордеров (ArchivedOrder).
+
+После этого инструмент получает статус DELISTED. Строка инструмента не
+удаляется: на неё ссылаются журнал балансов и архив ордеров.
+Задание можно прервать и продолжить: этап и счётчики сохраняются вместе
+с каждой порцией. Временная ошибка БД (OperationalError: блокировка,
+обрыв соединения) не завершает задание: его продолжит следующий проход.
+
+Ордер, принятый одновременно с остановкой торгов или уже переданный
+шарду, может встать в стакан после этапа отмены, поэтому перед
+архивацией отмена и конвертация повторяются (обычно это пустые запросы),
+а шард отклоняет ордера по остановленному инструменту.
+"""
+import logging
+import time
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import OperationalError, transaction
+from django.utils import timezone
+
+from . import tape, versions
+from .bulk_balance import increment_balances
+from .models import (
+    ACTIVE_ORDER_STATUSES, Balance, DelistingJob, Instrument, LedgerEntry,
+    Order, PendingSettlement, Transaction
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_POLL_INTERVAL = 1.0
+
+UNFINISHED_STAGES = ('CANCEL_ORDERS', 'AWAIT_SETTLEMENT', 'CONVERT_BALANCES',
+                     'ARCHIVE_TRADES', 'ARCHIVE_ORDERS')
+
+
+def last_price(ticker):
+    """Цена последней сделки тикера или None"""
+    return (
+        Transaction.objects.filter(ticker=ticker)
+        .order_by('-timestamp', '-id')
+        .values_list('price', flat=True)
+        .first()
+    )
+
+
+def start(instrument, price):
+    """Останавливает торги инструментом и ставит задание делистинга"""
+    with transaction.atomic():
+        instrument.status = 'HALTED'
+        instrument.save(update_fields=['status'])
+        return DelistingJob.objects.create(instrument=instrument, price=price)
+
+
+def _cancel_orders(job, chunk_size):
+    ticker = job.instrument.ticker
+    for orders in (Order.objects.resting(), Order.objects.pending_stops()):
+        orders = orders.filter(ticker=ticker)
+        while True:
+            with transaction.atomic():
+                ids = list(orders.values_list('id', flat=True)[:chunk_size])
+                if not ids:
+                    break
+                cancelled = Order.objects.filter(
+                    id__in=ids, status__in=ACTIVE_ORDER_STATUSES
+                ).update(status='CANCELLED', updated_at=timezone.now())
+                # UPDATE не вызывает сигналы
+                versions.bump_book(ticker)
+                versions.bump_stops(ticker)
+                job.orders_cancelled += cancelled
+                job.save(update_fields=['orders_cancelled', 'updated_at'])
+            _report(job)
+    return True
+
+
+def _await_settlement(job, chunk_size):
+    # Новых сделок нет, так что очередь по тикеру только убывает
+    return not PendingSettlement.objects.filter(instrument=job.instrument).exists()
+
+
+def _convert_balances(job, chunk_size):
+    instrument = job.instrument
+    usd = Instrument.objects.get(ticker='USD')
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Balance.objects.filter(instrument=instrument)
+                .order_by('id')
+                .values_list('id', 'user_id', 'amount')[:chunk_size]
+            )
+            if not rows:
+                return True
+
+            # amount / unit единиц по цене price, в минимальных единицах USD
+            credits = {
+                user_id: amount * job.price * usd.unit // instrument.unit
+                for _, user_id, amount in rows if amount
+            }
+            # Приращение, а не сумма: USD-баланс мог измениться после чтения
+            increment_balances({(user_id, usd.id): credit for user_id, credit in credits.items()})
+            LedgerEntry.objects.bulk_create(
+                [
+                    LedgerEntry(user_id=user_id, instrument=instrument,
+                                amount=-amount, kind='DELISTING')
+                    for _, user_id, amount in rows if amount
+                ] + [
+                    LedgerEntry(user_id=user_id, instrument=usd,
+                                amount=credit, kind='DELISTING')
+                    for user_id, credit in credits.items() if credit
+                ]
+            )
+            Balance.objects.filter(id__in=[row[0] for row in rows]).delete()
+            # upsert, bulk_create и delete не отправляют post_save
+            versions.bump_balances({user_id for _, user_id, _ in rows})
+            job.balances_converted += len(rows)
+            job.save(update_fields=['balances_converted', 'updated_at'])
+        _report(job)
+
+
+def _archive_trades(job, chunk_size):
+    # Ордер, принятый до остановки торгов, но зафиксированный после этапа
+    # отмены, мог встать в стакан или дать сделки после конвертации
+    _cancel_orders(job, chunk_size)
+    if not _await_settlement(job, chunk_size):
+        return False
+    _convert_balances(job, chunk_size)
+
+    # Торги остановлены: архивируем и сегодняшний день
+    tomorrow = timezone.now().astimezone(dt_timezone.utc).date() + timedelta(days=1)
+
+    def progress(day, moved):
+        job.trades_archived = archived + moved
+        job.save(update_fields=['trades_archived', 'updated_at'])
+        _report(job)
+
+    archived = job.trades_archived
+    tape.archive_transactions(
+        before=tomorrow, ticker=job.instrument.ticker,
+        chunk_size=chunk_size, progress=progress,
+    )
+    return True
+
+
+def _archive_orders(job, chunk_size):
+    orders = Order.objects.terminal().filter(ticker=job.instrument.ticker)
+    while moved := orders.archive_chunk(chunk_size):
+        job.orders_archived += moved
+        job.save(update_fields=['orders_archived', 'updated_at'])
+        _report(job)
+    return True
+
+
+# Этап -> (обработчик, следующий этап). Обработчик возвращает False, если
+# этап пока не может завершиться и задание нужно повторить позже
+STAGES = {
+    'CANCEL_ORDERS': (_cancel_orders, 'AWAIT_SETTLEMENT'),
+    'AWAIT_SETTLEMENT': (_await_settlement, 'CONVERT_BALANCES'),
+    'CONVERT_BALANCES': (_convert_balances, 'ARCHIVE_TRADES'),
+    'ARCHIVE_TRADES': (_archive_trades, 'ARCHIVE_ORDERS'),
+    'ARCHIVE_ORDERS': (_archive_orders, 'DONE'),
+}
+
+
+def _report(job):
+    logger.info(
+        'Delisting %s: %s, orders cancelled %d, balances converted %d, '
+        'trades archived %d, orders archived %d',
+        job.instrument.ticker, job.stage, job.orders_cancelled,
+        job.balances_converted, job.trades_archived, job.orders_archived
+    )
+
+
+def run_job(job, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Выполняет задание с сохранённого этапа. Возвращает True, если задание
+    завершено (DONE или FAILED), False - если его нужно повторить позже
+    (ожидание расчёта или временная ошибка БД).
+    """
+    try:
+        while job.stage in STAGES:
+            handler, next_stage = STAGES[job.stage]
+            if not handler(job, chunk_size):
+                return False
+            job.stage = next_stage
+            with transaction.atomic():
+                if next_stage == 'DONE':
+                    job.finished_at = timezone.now()
+                    job.instrument.status = 'DELISTED'
+                    job.instrument.save(update_fields=['status'])
+                job.save(update_fields=['stage', 'finished_at', 'updated_at'])
+            _report(job)
+    except OperationalError as e:
+        # Этап и счётчики сохранены с последней порцией: продолжаем позже
+        logger.warning('Delisting %s interrupted, will retry: %s', job.instrument.ticker, e)
+        return False
+    except Exception as e:
+        logger.exception('Delisting %s failed', job.instrument.ticker)
+        job.stage = 'FAILED'
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['stage', 'error', 'finished_at', 'updated_at'])
+    return True
+
+
+def run(chunk_size=DEFAULT_CHUNK_SIZE, poll_interval=DEFAULT_POLL_INTERVAL, stop=lambda: False):
+    """Основной цикл: выполняет незавершённые задания, пока stop() возвращает False"""
+    while not stop():
+        jobs = DelistingJob.objects.filter(stage__in=UNFINISHED_STAGES).select_related('instrument')
+        waiting = False
+        for job in jobs.order_by('created_at'):
+            if not run_job(job, chunk_size):
+                waiting = True
+        if waiting or not jobs.exists():
+            time.sleep(poll_interval)
@@ -0,0 +1,156 @@
+"""
+Истечение ордеров с ограниченным сроком действия (expires_at).
+
+Процесс `python manage.py run_expiry_sweeper` держит в min-куче сроки
+активных ордеров, истекающих в ближайшие LOOKAHEAD: при запуске загружает
+их, а затем раз в poll_interval догружает по частичному индексу на
+expires_at ордера, чей срок вошёл в это окно, и снимает с вершины кучи
+истёкшие. Истёкшие ордера отменяются порциями условным UPDATE по
+первичному ключу, без просмотра всей таблицы Order, после чего
+увеличиваются версии стаканов затронутых тикеров (ETag и кэши ответов).
+
+Выборки идут по сроку, а не по времени создания: ордер, чья транзакция
+зафиксирована позже, чем его окно было просмотрено, находит выборка
+истёкших активных ордеров (после отмены порций в ней остаются только
+такие ордера), с задержкой не больше poll_interval.
+
+Пока свипер не отменил истёкший ордер, он не участвует в сопоставлении и
+не показывается в стакане: active_limit() отбрасывает ордера с прошедшим
+сроком.
+"""
+import heapq
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import versions
+from .models import ACTIVE_ORDER_STATUSES, Order
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_POLL_INTERVAL = 0.2
+
+# Ордера, истекающие не позже чем через LOOKAHEAD, держатся в куче
+LOOKAHEAD = timedelta(seconds=60)
+
+
+class ExpiryQueue:
+    """Min-куча сроков: (timestamp, uuid.int, ticker)"""
+
+    def __init__(self):
+        self.heap = []
+        # Ордера со сроком не позже horizon уже загружены в кучу
+        self.horizon = None
+        self._tickers = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def _entry(self, expires_at, order_id, ticker):
+        ticker = self._tickers.setdefault(ticker, ticker)
+        return expires_at.timestamp(), order_id.int, ticker
+
+    def _push(self, rows):
+        added = 0
+        for expires_at, order_id, ticker in rows:
+            heapq.heappush(self.heap, self._entry(expires_at, order_id, ticker))
+            added += 1
+        return added
+
+    def load(self):
+        """Загружает активные ордера, истекающие в ближайшие LOOKAHEAD"""
+        self.horizon = timezone.now() + LOOKAHEAD
+        rows = Order.objects.timed().filter(expires_at__lte=self.horizon)
+        self.heap = [
+            self._entry(expires_at, order_id, ticker)
+            for expires_at, order_id, ticker in rows.values_list(
+                'expires_at', 'id', 'ticker'
+            ).iterator(chunk_size=10000)
+        ]
+        heapq.heapify(self.heap)
+        return len(self.heap)
+
+    def poll(self):
+        """
+        Добавляет ордера, чей срок вошёл в окно LOOKAHEAD, и истёкшие
+        активные ордера, которых нет в куче: зафиксированные позже, чем их
+        окно было просмотрено, или созданные уже внутри окна. Вызывается,
+        когда истёкшие записи кучи сняты и отменены, иначе они вернутся в
+        кучу повторно (повторная отмена ничего не меняет).
+        """
+        now = timezone.now()
+        horizon = now + LOOKAHEAD
+        timed = Order.objects.timed()
+        added = self._push(
+            timed.filter(expires_at__gt=self.horizon, expires_at__lte=horizon)
+            .values_list('expires_at', 'id', 'ticker')
+        )
+        self.horizon = horizon
+        return added + self._push(
+            timed.filter(expires_at__lte=now).values_list('expires_at', 'id', 'ticker')
+        )
+
+    def pop_due(self, now, limit):
+        """Снимает не более limit истёкших к моменту now записей"""
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < limit:
+            due.append(heapq.heappop(self.heap))
+        return due
+
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else None
+
+
+def cancel_expired(entries):
+    """Отменяет истёкшие ордера одной транзакцией; возвращает число отменённых"""
+    now = timezone.now()
+    with transaction.atomic():
+        cancelled = Order.objects.filter(
+            id__in=[uuid.UUID(int=order_id) for _, order_id, _ in entries],
+            status__in=ACTIVE_ORDER_STATUSES,
+            expires_at__lte=now,
+        ).update(status='CANCELLED', updated_at=now)
+        # UPDATE не вызывает сигналы: сбрасываем версии стаканов сами
+        for ticker in {ticker for _, _, ticker in entries}:
+            versions.bump_book(ticker)
+    return cancelled
+
+
+def run(batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL,
+        log=print, stop=lambda: False):
+    """Основной цикл свипера; работает, пока stop() возвращает False"""
+    queue = ExpiryQueue()
+    started = time.monotonic()
+    loaded = queue.load()
+    log(f'Загружено ордеров со сроком: {loaded} за {time.monotonic() - started:.1f} с')
+    next_poll = time.monotonic() + poll_interval
+
+    while not stop():
+        now = time.time()
+        due = queue.pop_due(now, batch_size)
+        if due:
+            cancelled = cancel_expired(due)
+            logger.info(
+                'Expired %d orders (%d cancelled), lag %.3f s',
+                len(due), cancelled, now - due[0][0]
+            )
+            # Ещё могут быть истёкшие: следующая порция без паузы
+            continue
+
+        # Истёкшие записи кучи отменены: выборка истёкших найдёт только новые
+        if time.monotonic() >= next_poll:
+            queue.poll()
+            next_poll = time.monotonic() + poll_interval
+            continue
+
+        deadline = queue.next_deadline()
+        pause = next_poll - time.monotonic()
+        if deadline is not None:
+            pause = min(pause, deadline - time.time())
+        if pause > 0:
+            time.sleep(pause)
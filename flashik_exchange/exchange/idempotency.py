@@ -0,0 +1,120 @@
+"""
+Идемпотентные POST-запросы по заголовку Idempotency-Key.
+
+Первый запрос с ключом выполняется, его ответ (статус и тело) запоминается
+на EXCHANGE_IDEMPOTENCY_TTL секунд. Повтор с тем же ключом получает
+сохранённый ответ с заголовком Idempotent-Replayed: true, не выполняя view.
+Повтор, пришедший пока первый запрос ещё выполняется, ждёт его результата,
+поэтому ордер не сопоставляется дважды. Ключ с другим телом запроса -
+ошибка 422. Ответы 5xx не запоминаются: такой запрос можно повторить.
+
+Ключи хранятся в кэше default: запрос занимает ключ атомарным cache.add,
+так что повторы, попавшие на разные воркеры, тоже выполняются один раз -
+если кэш общий для всех процессов (см. exchange.W001). Занятый ключ без
+результата живёт IN_PROGRESS_TIMEOUT секунд: если воркер упал посреди
+запроса, после этого срока повтор выполнится заново.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from .auth import get_api_key
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Сколько секунд повтор ждёт завершения исходного запроса
+WAIT_TIMEOUT = 30
+
+# Сколько секунд ключ занят выполняющимся запросом
+IN_PROGRESS_TIMEOUT = 2 * WAIT_TIMEOUT
+
+# Интервал опроса кэша ожидающим повтором, секунды
+POLL_INTERVAL = 0.05
+
+_PREFIX = 'exchange:idempotency:'
+
+
+def _cache_key(api_key, path, idempotency_key):
+    # Ключ произвольной длины и с любыми символами: в кэш - только хэш
+    raw = '\n'.join((api_key or '', path, idempotency_key))
+    return _PREFIX + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _replay(result):
+    status_code, data = result
+    response = Response(data, status=status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait(key, fingerprint):
+    """
+    Ждёт результата запроса, занявшего ключ. Возвращает сохранённую запись,
+    None, если ключ освободился (запрос завершился ошибкой или истёк), или
+    'timeout', если результата нет дольше WAIT_TIMEOUT.
+    """
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        stored = cache.get(key)
+        if stored is None or stored['fingerprint'] != fingerprint or stored['result'] is not None:
+            return stored
+        if time.monotonic() >= deadline:
+            return 'timeout'
+        time.sleep(POLL_INTERVAL)
+
+
+def idempotent(view_method):
+    """Декоратор POST-метода APIView: поддержка заголовка Idempotency-Key"""
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get(HEADER)
+        if not idempotency_key:
+            return view_method(self, request, *args, **kwargs)
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return Response(
+                {"detail": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+
+        key = _cache_key(get_api_key(request), request.path, idempotency_key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+
+        while not cache.add(key, {'fingerprint': fingerprint, 'result': None}, IN_PROGRESS_TIMEOUT):
+            stored = _wait(key, fingerprint)
+            if stored is None:
+                # Исходный запрос завершился ошибкой: выполняем заново
+                continue
+            if stored == 'timeout':
+                return Response(
+                    {"detail": f"A request with this {HEADER} is still in progress"},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if stored['fingerprint'] != fingerprint:
+                return Response(
+                    {"detail": f"{HEADER} was already used with a different request"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            return _replay(stored['result'])
+
+        result = None
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code < 500:
+                result = (response.status_code, response.data)
+                cache.set(
+                    key, {'fingerprint': fingerprint, 'result': result},
+                    settings.EXCHANGE_IDEMPOTENCY_TTL
+                )
+        finally:
+            if result is None:
+                cache.delete(key)
+        return response
+
+    return wrapper
@@ -0,0 +1,227 @@
+"""
+Журнал балансов: история изменений и баланс на момент времени.
+
+Каждое применённое изменение Balance (депозит, вывод, сторона сделки,
+массовая операция) записывается в LedgerEntry; начальные балансы на
+момент введения журнала - записи OPENING. Поэтому баланс на любой момент
+равен сумме записей до него, но суммировать весь журнал пользователя
+долго. Команда `python manage.py checkpoint_ledger` (по расписанию)
+сохраняет контрольные точки BalanceCheckpoint - баланс после очередной
+записи, - и запрос баланса на момент складывает ближайшую точку с
+хвостом записей после неё, размер которого ограничен интервалом между
+точками.
+
+Порядок журнала - по id. created_at присваивается при создании объекта
+записи, до INSERT, поэтому у параллельных писателей может идти не по
+порядку id: выборки хвоста после точки и страницы выписки идут только по
+id, а created_at лишь фильтрует записи по моменту. Предполагается, что
+транзакция с записью фиксируется не позже MAX_INSERT_LAG после получения
+created_at (объект создаётся в той же транзакции прямо перед INSERT).
+
+id выдаются при INSERT, а видны записи после фиксации, и в PostgreSQL
+запись с меньшим id может стать видимой позже записи с большим. Точка,
+поставленная после записи с большим id, пропустила бы такую запись
+навсегда, поэтому checkpoint_ledger доходит только до записей старше
+CHECKPOINT_LAG: все записи с меньшими id к этому моменту зафиксированы.
+В SQLite записи видны в порядке id, и отступ лишь откладывает точки.
+"""
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import BalanceCheckpoint, Instrument, LedgerEntry
+
+DEFAULT_HISTORY_LIMIT = 100
+
+# Контрольная точка ставится после каждых EVERY записей пользователя по
+# инструменту и в конце каждого запуска checkpoint_ledger
+DEFAULT_CHECKPOINT_EVERY = 1000
+
+# Записей журнала на один запрос при расстановке точек
+CHECKPOINT_CHUNK_SIZE = 10000
+
+# Наибольшая задержка между created_at записи и фиксацией её транзакции
+MAX_INSERT_LAG = timedelta(minutes=5)
+
+# Точки ставятся только по записям старше этого отступа. Запись с меньшим
+# id получила id раньше, то есть created_at не позже чем через
+# MAX_INSERT_LAG после такой записи, и зафиксирована ещё через
+# MAX_INSERT_LAG
+CHECKPOINT_LAG = 2 * MAX_INSERT_LAG
+
+
+def _balance_after(user_id, instrument_id, last_id):
+    """Баланс после записи last_id: сумма записей с id <= last_id"""
+    checkpoint = (
+        BalanceCheckpoint.objects
+        .filter(user_id=user_id, instrument_id=instrument_id, entry_id__lte=last_id)
+        .order_by('-entry_id')
+        .first()
+    )
+    entries = LedgerEntry.objects.filter(
+        user_id=user_id, instrument_id=instrument_id, id__lte=last_id
+    )
+    amount = 0
+    if checkpoint is not None:
+        amount = checkpoint.amount
+        entries = entries.filter(id__gt=checkpoint.entry_id)
+    return amount + (entries.aggregate(total=Sum('amount'))['total'] or 0)
+
+
+def _balance_at(user_id, instrument_id, until):
+    """Баланс на момент until: сумма записей с created_at <= until"""
+    checkpoints = BalanceCheckpoint.objects.filter(user_id=user_id, instrument_id=instrument_id)
+    # created_at точки - наибольший created_at вошедших в неё записей, так
+    # что в точку до until входят только записи до until
+    checkpoint = checkpoints.filter(created_at__lte=until).order_by('-created_at', '-entry_id').first()
+    entries = LedgerEntry.objects.filter(
+        user_id=user_id, instrument_id=instrument_id, created_at__lte=until
+    )
+    amount = 0
+    if checkpoint is not None:
+        amount = checkpoint.amount
+        entries = entries.filter(id__gt=checkpoint.entry_id)
+    # Записи после точки, вставленной позже until + MAX_INSERT_LAG, получили
+    # created_at позже until: хвост ограничен сверху по id
+    bound = (
+        checkpoints.filter(created_at__gt=until + MAX_INSERT_LAG)
+        .order_by('created_at', 'entry_id')
+        .values_list('entry_id', flat=True)
+        .first()
+    )
+    if bound is not None:
+        entries = entries.filter(id__lte=bound)
+    return amount + (entries.aggregate(total=Sum('amount'))['total'] or 0)
+
+
+def balance_at(user, ticker, ts):
+    """
+    Баланс пользователя по тикеру на момент ts в минимальных единицах
+    (как User.get_balance). При отложенном расчёте - применённый баланс.
+    """
+    instrument = Instrument.objects.get(ticker=ticker)
+    return _balance_at(user.pk, instrument.id, ts)
+
+
+def history(user, ticker=None, until=None, before=None, limit=DEFAULT_HISTORY_LIMIT):
+    """
+    Записи журнала пользователя от новых к старым, с балансом после каждой
+    записи. until - не позже момента, before - id последней записи
+    предыдущей страницы.
+    """
+    entries = LedgerEntry.objects.filter(user=user).select_related('instrument')
+    if ticker is not None:
+        entries = entries.filter(instrument__ticker=ticker)
+    if until is not None:
+        entries = entries.filter(created_at__lte=until)
+    if before is not None:
+        entries = entries.filter(id__lt=before)
+    entries = list(entries.order_by('-id')[:limit])
+
+    # Баланс считается один раз на инструмент - после самой новой записи
+    # страницы, - а для более старых записей вычитаются изменения
+    balances = {}
+    result = []
+    for entry in entries:
+        instrument = entry.instrument
+        balance = balances.get(instrument.id)
+        if balance is None:
+            balance = _balance_after(user.pk, instrument.id, entry.id)
+        balances[instrument.id] = balance - entry.amount
+        result.append({
+            'id': entry.id,
+            'ticker': instrument.ticker,
+            'kind': entry.kind,
+            'amount': instrument.from_minor(entry.amount),
+            'balance': instrument.from_minor(balance),
+            'trade_id': entry.trade_id,
+            'timestamp': entry.created_at,
+        })
+    return result
+
+
+def _last_checkpoints(keys):
+    """Последние точки пар (user_id, instrument_id): {key: (баланс, created_at)}"""
+    last = (
+        BalanceCheckpoint.objects
+        .filter(
+            user_id__in={user_id for user_id, _ in keys},
+            instrument_id__in={instrument_id for _, instrument_id in keys},
+        )
+        .values('user_id', 'instrument_id')
+        .annotate(last=Max('entry_id'))
+        .values_list('last', flat=True)
+    )
+    return {
+        (user_id, instrument_id): (amount, created_at)
+        for user_id, instrument_id, amount, created_at in BalanceCheckpoint.objects
+        .filter(entry_id__in=list(last))
+        .values_list('user_id', 'instrument_id', 'amount', 'created_at')
+        if (user_id, instrument_id) in keys
+    }
+
+
+def create_checkpoints(every=DEFAULT_CHECKPOINT_EVERY):
+    """
+    Ставит контрольные точки по записям после предыдущего запуска: после
+    каждых every записей пары (пользователь, инструмент) и после последней
+    её записи. Запуск останавливается на первой (по id) записи моложе
+    CHECKPOINT_LAG: следующие войдут в точки следующего запуска.
+    Возвращает число новых точек.
+    """
+    watermark = BalanceCheckpoint.objects.aggregate(last=Max('entry_id'))['last'] or 0
+    last_id = LedgerEntry.objects.aggregate(last=Max('id'))['last']
+    if last_id is None or last_id <= watermark:
+        return 0
+
+    # (user_id, instrument_id) -> [баланс, записей после точки, id, created_at]
+    state = {}
+    checkpoints = []
+
+    def checkpoint(key, current):
+        amount, _, entry_id, created_at = current
+        checkpoints.append(BalanceCheckpoint(
+            user_id=key[0], instrument_id=key[1],
+            entry_id=entry_id, amount=amount, created_at=created_at,
+        ))
+        current[1] = 0
+
+    entries = LedgerEntry.objects.filter(id__gt=watermark, id__lte=last_id).order_by('id')
+    rows = entries.values_list('id', 'user_id', 'instrument_id', 'amount', 'created_at').iterator(
+        chunk_size=CHECKPOINT_CHUNK_SIZE
+    )
+    cutoff = timezone.now() - CHECKPOINT_LAG
+    while chunk := list(islice(rows, CHECKPOINT_CHUNK_SIZE)):
+        # Записи с меньшими id, чем у слишком свежей, могут быть ещё не видны
+        fresh = next((i for i, row in enumerate(chunk) if row[4] > cutoff), None)
+        if fresh is not None:
+            chunk = chunk[:fresh]
+
+        # Баланс новых в этом запуске пар - из их последней точки
+        new_keys = {(row[1], row[2]) for row in chunk} - state.keys()
+        previous = _last_checkpoints(new_keys) if watermark and new_keys else {}
+        for key in new_keys:
+            amount, created_at = previous.get(key, (0, None))
+            state[key] = [amount, 0, None, created_at]
+
+        for entry_id, user_id, instrument_id, amount, created_at in chunk:
+            current = state[user_id, instrument_id]
+            current[0] += amount
+            current[1] += 1
+            current[2] = entry_id
+            # Время точки не меньше времени любой вошедшей в неё записи
+            current[3] = created_at if current[3] is None else max(current[3], created_at)
+            if current[1] >= every:
+                checkpoint((user_id, instrument_id), current)
+        if fresh is not None:
+            break
+
+    for key, current in state.items():
+        if current[1]:
+            checkpoint(key, current)
+    with transaction.atomic():
+        BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=10000)
+    return len(checkpoints)
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ExpiringLRU:
+    """
+    Потокобезопасный словарь в памяти процесса с ограничением размера
+    (вытесняются давно не использованные ключи) и временем жизни записей.
+    ttl=None - записи не устаревают.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self._set(key, value)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def get_or_create(self, key, factory):
+        """Значение по ключу; при отсутствии создаёт его под блокировкой"""
+        with self.lock:
+            value = self._get(key, None)
+            if value is None:
+                value = factory()
+                self._set(key, value)
+            return value
+
+    def _get(self, key, default):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
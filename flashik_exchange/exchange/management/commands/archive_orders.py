@@ -0,0 +1,46 @@
+"""
+Переносит исполненные и отменённые ордера из Order в ArchivedOrder.
+
+Ордера переносятся порциями, каждая - в своей короткой транзакции, поэтому
+запись в таблицу ордеров не блокируется надолго. Команду можно прервать и
+запустить снова: уже перенесённые строки пропускаются. Предназначена для
+запуска по расписанию (cron, systemd timer).
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from exchange.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Архивирует завершённые ордера порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-hours', type=float, default=24,
+            help='Архивировать ордера, завершённые раньше указанного числа часов назад'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Пауза между порциями в секундах, чтобы пропускать запись ордеров'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['older_than_hours'])
+        orders = Order.objects.terminal().filter(updated_at__lt=cutoff)
+        moved = 0
+
+        while True:
+            chunk = orders.archive_chunk(options['chunk_size'])
+            if not chunk:
+                break
+            moved += chunk
+            self.stdout.write(f'Перенесено ордеров: {moved}')
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f'Архивация завершена, всего перенесено: {moved}'))
@@ -0,0 +1,42 @@
+"""
+Выгружает сделки закрытых дней из Transaction в сжатый архив (exchange.tape).
+
+    python manage.py archive_transactions
+    python manage.py archive_transactions --before 2025-03-01 --ticker AAPL
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exchange.tape import archive_transactions
+
+
+class Command(BaseCommand):
+    help = 'Архивирует сделки закрытых дней в сжатые NDJSON-файлы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            help='Первый неархивируемый день YYYY-MM-DD (по умолчанию сегодня, UTC)'
+        )
+        parser.add_argument('--ticker', help='Архивировать только указанный тикер')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        before = None
+        if options['before']:
+            try:
+                before = date.fromisoformat(options['before'])
+            except ValueError:
+                raise CommandError('Дата должна быть в формате YYYY-MM-DD')
+
+        def progress(day, moved):
+            self.stdout.write(f'{day}: всего перенесено сделок {moved}')
+
+        moved = archive_transactions(
+            before=before,
+            ticker=options['ticker'],
+            chunk_size=options['chunk_size'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Архивация завершена, перенесено сделок: {moved}'))
@@ -0,0 +1,189 @@
+"""
+Бенчмарк публичных эндпоинтов чтения под WSGI и ASGI.
+
+Для каждого числа одновременных соединений запускается отдельный процесс:
+WSGI-режим обслуживает соединения фиксированным пулом потоков (как
+gunicorn --threads), ASGI-режим - задачами asyncio поверх асинхронных view.
+Каждое соединение работает в замкнутом цикле «запрос - ответ - запрос».
+
+    python manage.py bench_reads --ticker AAPL --connections 10,100,1000
+"""
+import asyncio
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _summary(mode, connections, latencies, elapsed, max_in_flight, errors):
+    return {
+        'mode': mode,
+        'connections': connections,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'max_in_flight': max_in_flight,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность эндпоинтов чтения под WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticker', required=True)
+        parser.add_argument(
+            '--connections', default='10,100,1000',
+            help='Список чисел одновременных соединений через запятую'
+        )
+        parser.add_argument('--duration', type=float, default=5.0)
+        parser.add_argument(
+            '--wsgi-threads', type=int, default=8,
+            help='Размер пула потоков WSGI-воркера'
+        )
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Эндпоинт для опроса (по умолчанию стакан и список инструментов)'
+        )
+        parser.add_argument('--worker', choices=['wsgi', 'asgi'], help='Внутренний режим')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [
+            f"/api/v1/public/orderbook/{options['ticker']}",
+            '/api/v1/public/instrument',
+        ]
+        connections = [int(value) for value in options['connections'].split(',')]
+
+        if options['worker']:
+            # Тестовые клиенты обращаются к хосту testserver
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+            run = self._run_wsgi if options['worker'] == 'wsgi' else self._run_asgi
+            result = run(paths, connections[0], options)
+            self.stdout.write(json.dumps(result))
+            return
+
+        header = f"{'mode':<6}{'conns':>7}{'requests':>10}{'errors':>8}{'rps':>10}" \
+                 f"{'p50 ms':>10}{'p99 ms':>10}{'in-flight':>11}"
+        self.stdout.write(header)
+        for count in connections:
+            for mode in ('wsgi', 'asgi'):
+                result = self._spawn(mode, count, paths, options)
+                self.stdout.write(
+                    f"{result['mode']:<6}{result['connections']:>7}{result['requests']:>10}"
+                    f"{result['errors']:>8}{result['rps']:>10}{result['p50_ms']:>10}"
+                    f"{result['p99_ms']:>10}{result['max_in_flight']:>11}"
+                )
+
+    def _spawn(self, mode, count, paths, options):
+        """Запускает замер в отдельном процессе с нужным набором view"""
+        env = dict(os.environ, EXCHANGE_ASYNC_READS='1' if mode == 'asgi' else '0')
+        command = [
+            sys.executable, sys.argv[0], 'bench_reads',
+            '--worker', mode,
+            '--ticker', options['ticker'],
+            '--connections', str(count),
+            '--duration', str(options['duration']),
+            '--wsgi-threads', str(options['wsgi_threads']),
+        ]
+        for path in paths:
+            command += ['--path', path]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(completed.stderr)
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _run_wsgi(self, paths, count, options):
+        from django.test import Client
+
+        deadline = time.perf_counter() + options['duration']
+        pending = queue.Queue()
+        latencies = []
+        errors = 0
+        in_flight = 0
+        max_in_flight = 0
+        lock = threading.Lock()
+
+        # Каждое соединение держит ровно один запрос в очереди к пулу потоков
+        for connection_id in range(count):
+            pending.put((connection_id, time.perf_counter()))
+
+        def worker():
+            nonlocal errors, in_flight, max_in_flight
+            client = Client()
+            while True:
+                try:
+                    connection_id, queued_at = pending.get(timeout=0.1)
+                except queue.Empty:
+                    if time.perf_counter() >= deadline:
+                        return
+                    continue
+                if time.perf_counter() >= deadline:
+                    return
+                with lock:
+                    in_flight += 1
+                    max_in_flight = max(max_in_flight, in_flight)
+                response = client.get(paths[connection_id % len(paths)])
+                finished = time.perf_counter()
+                with lock:
+                    in_flight -= 1
+                    latencies.append(finished - queued_at)
+                    if response.status_code != 200:
+                        errors += 1
+                pending.put((connection_id, finished))
+
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker)
+            for _ in range(min(count, options['wsgi_threads']))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return _summary('wsgi', count, latencies, elapsed, max_in_flight, errors)
+
+    def _run_asgi(self, paths, count, options):
+        from django.test import AsyncClient
+
+        latencies = []
+        errors = 0
+        in_flight = 0
+        max_in_flight = 0
+
+        async def connection(connection_id, deadline):
+            nonlocal errors, in_flight, max_in_flight
+            client = AsyncClient()
+            path = paths[connection_id % len(paths)]
+            while time.perf_counter() < deadline:
+                sent_at = time.perf_counter()
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                response = await client.get(path)
+                in_flight -= 1
+                latencies.append(time.perf_counter() - sent_at)
+                if response.status_code != 200:
+                    errors += 1
+
+        async def main():
+            deadline = time.perf_counter() + options['duration']
+            await asyncio.gather(*(connection(i, deadline) for i in range(count)))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        elapsed = time.perf_counter() - started
+        return _summary('asgi', count, latencies, elapsed, max_in_flight, errors)
@@ -0,0 +1,99 @@
+"""
+Бенчмарк рендеринга больших ответов API.
+
+Сравнивает стандартный путь DRF (сериализатор + JSONRenderer) с
+FastJSONRenderer на синтетических стакане и ленте сделок, а также
+показывает размер и время сжатия gzip. База данных не используется.
+
+    python manage.py bench_render --levels 5000 --trades 100000
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+
+from exchange import renderers
+from exchange.renderers import FastJSONRenderer
+from exchange.serializers import TransactionSerializer
+
+
+def _order_book(levels, rng):
+    def side(start, step):
+        return [
+            {'price': start + step * level, 'qty': rng.randint(1, 10000)}
+            for level in range(levels)
+        ]
+    return {'bid_levels': side(100000, -1), 'ask_levels': side(100001, 1)}
+
+
+def _trades(count, rng):
+    start = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+    return [
+        {
+            'ticker': 'AAPL',
+            'amount': rng.randint(1, 1000),
+            'price': rng.randint(90000, 110000),
+            'timestamp': start + timedelta(microseconds=index * 1500),
+        }
+        for index in range(count)
+    ]
+
+
+def _timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость рендеринга JSON на больших стакане и ленте сделок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--levels', type=int, default=5000, help='Уровней на сторону стакана')
+        parser.add_argument('--trades', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        repeat = options['repeat']
+        book = _order_book(options['levels'], rng)
+        trades = _trades(options['trades'], rng)
+
+        cases = [
+            ('orderbook', 'drf', lambda: JSONRenderer().render(book)),
+            ('orderbook', 'fast', lambda: FastJSONRenderer().render(book)),
+            ('trades', 'drf', lambda: JSONRenderer().render(
+                TransactionSerializer(trades, many=True).data
+            )),
+            ('trades', 'fast', lambda: FastJSONRenderer().render(
+                [{field: trade[field] for field in TransactionSerializer.Meta.fields}
+                 for trade in trades]
+            )),
+        ]
+
+        backend = 'orjson' if renderers.orjson is not None else 'json'
+        self.stdout.write(f'Быстрый рендерер: {backend}, лучший из {repeat} прогонов')
+        self.stdout.write(
+            f"{'payload':<11}{'path':<6}{'render ms':>11}{'bytes':>12}"
+            f"{'gzip ms':>10}{'gzip bytes':>12}"
+        )
+        baseline = {}
+        for payload, path, render in cases:
+            content, render_time = _timed(render, repeat)
+            compressed, gzip_time = _timed(lambda: compress_string(content), repeat)
+            if path == 'drf':
+                baseline[payload] = content
+            elif baseline.get(payload) != content:
+                self.stderr.write(f'{payload}: ответы drf и fast различаются')
+            self.stdout.write(
+                f'{payload:<11}{path:<6}{render_time * 1000:>11.1f}{len(content):>12}'
+                f'{gzip_time * 1000:>10.1f}{len(compressed):>12}'
+            )
@@ -0,0 +1,69 @@
+"""
+Массовое начисление и списание балансов из файла.
+
+Поддерживаются CSV с заголовком user_id,ticker,amount и NDJSON с теми же
+полями. Файл читается потоково, операции применяются порциями
+(см. exchange.bulk_balance). Ошибочные строки выводятся в конце или
+записываются в файл --errors.
+
+    python manage.py bulk_balance airdrop.csv --chunk-size 20000
+"""
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exchange.bulk_balance import DEFAULT_CHUNK_SIZE, apply_balance_deltas
+
+
+def _read_csv(path):
+    with open(path, newline='') as source:
+        for record in csv.DictReader(source):
+            yield record['user_id'], record['ticker'], record['amount']
+
+
+def _read_ndjson(path):
+    with open(path) as source:
+        for line in source:
+            if line.strip():
+                record = json.loads(line)
+                yield record['user_id'], record['ticker'], record['amount']
+
+
+class Command(BaseCommand):
+    help = 'Массово начисляет и списывает балансы из CSV или NDJSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'])
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--errors', help='Файл для отчёта об ошибочных строках (NDJSON)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        reader = _read_ndjson if file_format == 'ndjson' else _read_csv
+
+        def progress(rows, result):
+            self.stdout.write(
+                f'Обработано строк: {rows}, применено: {result.applied}, ошибок: {len(result.failed)}'
+            )
+
+        try:
+            result = apply_balance_deltas(
+                reader(path), chunk_size=options['chunk_size'], progress=progress
+            )
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f'Не удалось прочитать файл: {e}')
+
+        if options['errors']:
+            with open(options['errors'], 'w') as errors:
+                for failure in result.failed:
+                    errors.write(json.dumps(failure) + '\n')
+        else:
+            for failure in result.failed:
+                self.stdout.write(f"Строка {failure['row']}: {failure['detail']}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: применено {result.applied}, ошибок {len(result.failed)}'
+        ))
@@ -0,0 +1,24 @@
+"""
+Ставит контрольные точки журнала балансов (exchange.ledger) по записям,
+появившимся после предыдущего запуска. Запускается по расписанию: чем
+чаще, тем короче хвост, который суммирует запрос баланса на момент.
+
+    python manage.py checkpoint_ledger --every 1000
+"""
+from django.core.management.base import BaseCommand
+
+from exchange.ledger import DEFAULT_CHECKPOINT_EVERY, create_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет контрольные точки журнала балансов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type=int, default=DEFAULT_CHECKPOINT_EVERY,
+            help='Точка после каждых N записей пользователя по инструменту'
+        )
+
+    def handle(self, *args, **options):
+        created = create_checkpoints(every=options['every'])
+        self.stdout.write(self.style.SUCCESS(f'Создано контрольных точек: {created}'))
@@ -0,0 +1,22 @@
+"""
+Генерирует OpenAPI-схему API в файл EXCHANGE_SCHEMA_PATH.
+
+Запускается при сборке или деплое, чтобы воркеры отдавали готовый файл
+и не строили схему на запросах:
+
+    python manage.py generate_schema
+"""
+from django.core.management.base import BaseCommand
+
+from exchange.schema import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Генерирует OpenAPI-схему API в файл'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Путь к файлу (по умолчанию EXCHANGE_SCHEMA_PATH)')
+
+    def handle(self, *args, **options):
+        path, size = write_schema(options['output'])
+        self.stdout.write(f'Схема записана в {path} ({size} байт)')
@@ -0,0 +1,30 @@
+"""
+Пересоздаёт сегмент снимков стаканов (exchange.book_snapshot) и публикует
+стаканы всех инструментов. Запускается при развёртывании до веб-воркеров и
+шардов, а также после изменения EXCHANGE_BOOK_SNAPSHOT_DEPTH или
+EXCHANGE_BOOK_SNAPSHOT_TICKERS.
+
+    EXCHANGE_BOOK_SNAPSHOT=flashik_books python manage.py publish_book_snapshots
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from exchange import book_snapshot
+from exchange.models import Instrument
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт снимки стаканов в разделяемой памяти'
+
+    def handle(self, *args, **options):
+        if not book_snapshot.enabled():
+            raise CommandError('Снимки стаканов выключены: задайте EXCHANGE_BOOK_SNAPSHOT')
+
+        started = time.monotonic()
+        book_snapshot.reset()
+        tickers = list(Instrument.objects.values_list('ticker', flat=True))
+        book_snapshot.publish_all(tickers)
+        self.stdout.write(self.style.SUCCESS(
+            f'Опубликовано стаканов: {len(tickers)} за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,57 @@
+"""
+Запускает воркер делистинга: выполняет задания, поставленные
+DELETE /admin/instrument/<ticker>, порциями, см. exchange.delisting.
+
+    python manage.py run_delistings --chunk-size 1000
+    python manage.py run_delistings --once
+"""
+import logging
+import signal
+import sys
+
+from django.core.management.base import BaseCommand
+
+from exchange import delisting
+from exchange.models import DelistingJob
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задания делистинга инструментов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=delisting.DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            '--poll-interval', type=float, default=delisting.DEFAULT_POLL_INTERVAL,
+            help='Как часто (секунды) проверять новые задания'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить поставленные задания и выйти'
+        )
+
+    def handle(self, *args, **options):
+        if options['verbosity'] > 1:
+            # Строка на каждую порцию
+            logger = logging.getLogger('exchange.delisting')
+            logger.addHandler(logging.StreamHandler(self.stdout))
+            logger.setLevel(logging.INFO)
+
+        if options['once']:
+            jobs = DelistingJob.objects.filter(
+                stage__in=delisting.UNFINISHED_STAGES
+            ).select_related('instrument').order_by('created_at')
+            for job in jobs:
+                finished = delisting.run_job(job, options['chunk_size'])
+                waiting = '' if finished else ' (будет продолжено)'
+                self.stdout.write(f'{job.instrument.ticker}: {job.stage}{waiting}')
+            return
+
+        signal.signal(signal.SIGTERM, _stop)
+        delisting.run(
+            chunk_size=options['chunk_size'],
+            poll_interval=options['poll_interval'],
+        )
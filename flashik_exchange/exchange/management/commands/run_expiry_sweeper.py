@@ -0,0 +1,43 @@
+"""
+Запускает свипер, отменяющий ордера с истёкшим сроком действия (expires_at).
+
+Работает постоянно (под супервизором, в одном экземпляре): сроки держит в
+min-куче в памяти и отменяет истёкшие ордера порциями, см. exchange.expiry.
+
+    python manage.py run_expiry_sweeper --batch-size 1000 --poll-interval 0.2
+"""
+import logging
+import signal
+import sys
+
+from django.core.management.base import BaseCommand
+
+from exchange import expiry
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+class Command(BaseCommand):
+    help = 'Отменяет ордера с истёкшим сроком действия'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=expiry.DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--poll-interval', type=float, default=expiry.DEFAULT_POLL_INTERVAL,
+            help='Как часто (секунды) догружать новые ордера со сроком'
+        )
+
+    def handle(self, *args, **options):
+        if options['verbosity'] > 1:
+            # Строка на каждую отменённую порцию
+            logger = logging.getLogger('exchange.expiry')
+            logger.addHandler(logging.StreamHandler(self.stdout))
+            logger.setLevel(logging.INFO)
+        signal.signal(signal.SIGTERM, _stop)
+        expiry.run(
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            log=self.stdout.write,
+        )
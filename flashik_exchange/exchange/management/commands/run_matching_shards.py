@@ -0,0 +1,66 @@
+"""
+Запускает процессы-шарды сопоставления ордеров.
+
+Без --shard поднимает все EXCHANGE_MATCHING_SHARDS шардов дочерними
+процессами; с --shard запускает один шард (для запуска под супервизором).
+"""
+import multiprocessing
+import signal
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from exchange.sharding import ShardServer, socket_path
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+def _serve(shard):
+    connections.close_all()
+    server = ShardServer(shard)
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class Command(BaseCommand):
+    help = 'Запускает процессы-шарды сопоставления ордеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', type=int, help='Номер единственного запускаемого шарда')
+
+    def handle(self, *args, **options):
+        shards = settings.EXCHANGE_MATCHING_SHARDS
+        if shards <= 0:
+            raise CommandError('Шардирование выключено: задайте EXCHANGE_MATCHING_SHARDS')
+
+        if options['shard'] is not None:
+            if not 0 <= options['shard'] < shards:
+                raise CommandError(f'Номер шарда должен быть от 0 до {shards - 1}')
+            self.stdout.write(f"Шард {options['shard']}: {socket_path(options['shard'])}")
+            _serve(options['shard'])
+            return
+
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=_serve, args=(shard,), name=f'shard-{shard}')
+            for shard in range(shards)
+        ]
+        for shard, process in enumerate(processes):
+            process.start()
+            self.stdout.write(f'Шард {shard}: {socket_path(shard)} (pid {process.pid})')
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
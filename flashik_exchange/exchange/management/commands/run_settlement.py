@@ -0,0 +1,44 @@
+"""
+Запускает воркер отложенного расчёта сделок (EXCHANGE_DEFERRED_SETTLEMENT):
+применяет накопленные изменения балансов порциями, суммируя их по
+пользователю и инструменту, см. exchange.settlement.
+
+    python manage.py run_settlement --batch-size 1000 --max-delay 0.05
+"""
+import logging
+import signal
+import sys
+
+from django.core.management.base import BaseCommand
+
+from exchange import settlement
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+class Command(BaseCommand):
+    help = 'Применяет отложенные изменения балансов от сделок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settlement.DEFAULT_BATCH_SIZE,
+            help='Максимум изменений балансов в одной транзакции (4 на сделку)'
+        )
+        parser.add_argument(
+            '--max-delay', type=float, default=settlement.DEFAULT_MAX_DELAY,
+            help='Пауза (секунды) перед неполной порцией'
+        )
+
+    def handle(self, *args, **options):
+        if options['verbosity'] > 1:
+            # Строка на каждую применённую порцию
+            logger = logging.getLogger('exchange.settlement')
+            logger.addHandler(logging.StreamHandler(self.stdout))
+            logger.setLevel(logging.INFO)
+        signal.signal(signal.SIGTERM, _stop)
+        settlement.run(
+            batch_size=options['batch_size'],
+            max_delay=options['max_delay'],
+        )
@@ -0,0 +1,409 @@
+"""
+Генерирует синтетический набор данных для нагрузочного тестирования:
+инструменты, пользователей, балансы (с записями OPENING журнала балансов),
+стакан из активных лимитных ордеров и ленту сделок.
+
+Генерация воспроизводима: одинаковые параметры и --seed дают одинаковые
+данные. Распределения настраиваются:
+
+- популярность тикеров и активность пользователей - степенные (--ticker-skew,
+  --user-skew; 0 - равномерно): немногие тикеры и пользователи получают
+  большую часть ордеров;
+- цены ордеров - уровни вокруг --mid-price, глубина уровня от середины
+  распределена экспоненциально со средним --level-spread тиков;
+- размеры ордеров и сделок - логнормальные с медианой --median-qty.
+
+Строки вставляются напрямую через executemany порциями по --batch-size в
+отдельных транзакциях, минуя модели и сигналы, поэтому версии ETag
+сбрасываются в конце явно. На SQLite на время генерации отключается fsync,
+увеличивается кэш страниц, а вторичные индексы строятся после загрузки
+таблицы (--keep-indexes отключает это).
+
+    python manage.py seed_dataset --users 1000000 --orders 2000000 --trades 5000000
+"""
+import bisect
+import math
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from exchange import sharding, versions
+from exchange.models import Balance, Instrument, LedgerEntry, Order, Transaction, User
+
+DEFAULT_BATCH_SIZE = 50000
+
+# Кэш страниц SQLite на время генерации, КиБ
+SQLITE_CACHE_KIB = 512 * 1024
+
+# Балансы пользователя: USD и несколько случайных тикеров
+TICKERS_PER_USER = 3
+
+
+def _ticker_name(index):
+    """0 -> SAAA, 1 -> SAAB, ...: синтетические тикеры, проходящие validate_ticker"""
+    letters = []
+    for _ in range(3):
+        index, letter = divmod(index, 26)
+        letters.append(chr(ord('A') + letter))
+    return 'S' + ''.join(reversed(letters))
+
+
+def _power_law_picker(rng, size, skew):
+    """Индекс 0..size-1; при skew > 0 малые индексы выбираются чаще (закон Ципфа)"""
+    if skew <= 0:
+        return lambda: int(rng.random() * size)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += rank ** -skew
+        cumulative.append(total)
+    return lambda: min(bisect.bisect(cumulative, rng.random() * total), size - 1)
+
+
+class Command(BaseCommand):
+    help = 'Генерирует воспроизводимый синтетический набор данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument(
+            '--tickers', type=int, default=10,
+            help='Число синтетических тикеров (SAAA, SAAB, ...)'
+        )
+        parser.add_argument('--orders', type=int, default=500000, help='Активных лимитных ордеров')
+        parser.add_argument('--trades', type=int, default=1000000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--mid-price', type=int, default=10000)
+        parser.add_argument(
+            '--level-spread', type=float, default=20,
+            help='Средняя глубина ценового уровня от середины, в тиках'
+        )
+        parser.add_argument('--median-qty', type=int, default=10)
+        parser.add_argument(
+            '--ticker-skew', type=float, default=1.0,
+            help='Показатель степенного распределения популярности тикеров'
+        )
+        parser.add_argument(
+            '--user-skew', type=float, default=1.0,
+            help='Показатель степенного распределения активности пользователей'
+        )
+        parser.add_argument(
+            '--days', type=float, default=7,
+            help='За сколько последних дней распределить ордера и сделки'
+        )
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            '--keep-indexes', action='store_true',
+            help='Не пересоздавать вторичные индексы SQLite после загрузки '
+                 '(быстрее, если таблицы уже большие)'
+        )
+
+    def handle(self, *args, **options):
+        if options['tickers'] < 1 or options['tickers'] > 26 ** 3:
+            raise CommandError(f'--tickers должен быть от 1 до {26 ** 3}')
+        if options['orders'] and options['users'] < 1:
+            raise CommandError('Для ордеров нужен хотя бы один пользователь')
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.started = time.monotonic()
+        self.total_rows = 0
+
+        instruments = self._seed_instruments()
+        try:
+            with self._fast_writes():
+                user_ids = self._seed_users()
+                self._seed_balances(user_ids, instruments)
+                self._open_ledger()
+                self._seed_orders(user_ids, instruments)
+                self._seed_trades(instruments)
+        except IntegrityError as e:
+            # Тот же --seed даёт те же идентификаторы пользователей и ордеров
+            raise CommandError(
+                f'Данные для --seed {options["seed"]} уже загружены, укажите другой --seed: {e}'
+            )
+
+        # Вставки мимо моделей не вызывают сигналы: сбрасываем кэши ответов
+        versions.bump_instruments()
+        for instrument in instruments:
+            versions.bump_book(instrument.ticker)
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {self.total_rows} строк за {elapsed:.1f} с '
+            f'({self.total_rows / elapsed:.0f} строк/с)'
+        ))
+
+    @contextmanager
+    def _fast_writes(self):
+        """
+        Настройки SQLite на время генерации: без fsync, журнал в памяти (если
+        база не в режиме WAL) и большой кэш страниц, чтобы вставки в индексы
+        не упирались в диск. Действуют только для текущего соединения.
+        Внутри транзакции (например, в тестах) SQLite не даёт их менять.
+        """
+        if connection.vendor != 'sqlite' or connection.in_atomic_block:
+            yield
+            return
+        pragmas = {
+            'synchronous': 'OFF',
+            'cache_size': str(-SQLITE_CACHE_KIB),
+            'journal_mode': 'MEMORY',
+        }
+        with connection.cursor() as cursor:
+            saved = {}
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}')
+                saved[name] = cursor.fetchone()[0]
+                if name == 'journal_mode' and saved[name].lower() == 'wal':
+                    continue
+                cursor.execute(f'PRAGMA {name} = {value}')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                for name, value in saved.items():
+                    cursor.execute(f'PRAGMA {name} = {value}')
+
+    def _uuid_factory(self):
+        """Функция, возвращающая воспроизводимый случайный UUID в формате для БД"""
+        getrandbits = self.rng.getrandbits
+        if connection.features.has_native_uuid_field:
+            return lambda: uuid.UUID(int=getrandbits(128))
+        # UUIDField на остальных базах хранится как 32 hex-символа
+        return lambda: f'{getrandbits(128):032x}'
+
+    def _datetime_factory(self):
+        """
+        (точка отсчёта, функция приведения datetime к значению для БД).
+        Для SQLite повторяет adapt_datetimefield_value без проверок на каждой строке.
+        """
+        if connection.vendor != 'sqlite':
+            return self.now, lambda value: value
+        now = self.now
+        if settings.USE_TZ:
+            now = timezone.make_naive(now, connection.timezone)
+        return now, str
+
+    @contextmanager
+    def _deferred_indexes(self, model, expected):
+        """
+        На SQLite удаляет вторичные индексы таблицы на время загрузки и
+        создаёт их заново после неё: построить индекс по готовой таблице в
+        несколько раз быстрее, чем вставлять в него строки в случайном
+        порядке. Уникальные индексы не трогаются: они проверяют данные.
+        Если в таблице уже больше строк, чем будет вставлено, индексы
+        остаются на месте.
+        """
+        if (connection.vendor != 'sqlite' or self.options['keep_indexes']
+                or model.objects.count() > expected):
+            yield
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL "
+                "AND sql NOT LIKE 'CREATE UNIQUE%%'",
+                [model._meta.db_table]
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        try:
+            yield
+        finally:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for _, sql in indexes:
+                    cursor.execute(sql)
+
+    def _insert(self, model, fields, rows, expected):
+        """
+        Вставляет строки порциями executemany. rows - итератор кортежей,
+        expected - сколько строк он выдаст.
+        """
+        columns = [model._meta.get_field(name).column for name in fields]
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(column) for column in columns),
+            ', '.join(['%s'] * len(columns)),
+        )
+        inserted = 0
+        batch = []
+        started = time.monotonic()
+
+        def flush():
+            # Порция по первичному ключу: вставки в индекс идут подряд
+            batch.sort()
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+
+        with self._deferred_indexes(model, expected):
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    flush()
+                    inserted += len(batch)
+                    batch = []
+            if batch:
+                flush()
+                inserted += len(batch)
+
+        elapsed = time.monotonic() - started
+        rate = inserted / elapsed if elapsed else 0
+        self.stdout.write(f'{model.__name__}: {inserted} строк ({rate:.0f} строк/с)')
+        self.total_rows += inserted
+        return inserted
+
+    def _timestamps(self):
+        """Функция, возвращающая случайный момент за последние --days дней"""
+        span = self.options['days'] * 86400
+        now, adapt = self._datetime_factory()
+        rng = self.rng
+        return lambda: adapt(now - timedelta(seconds=rng.random() * span))
+
+    def _qty(self):
+        """Логнормальный размер с медианой --median-qty, не меньше 1"""
+        median = max(self.options['median_qty'], 1)
+        # gauss заметно быстрее lognormvariate (кэширует второе значение пары)
+        gauss, exp = self.rng.gauss, math.exp
+        return lambda: max(1, int(median * exp(gauss(0.0, 1.0))))
+
+    def _seed_instruments(self):
+        tickers = [_ticker_name(index) for index in range(self.options['tickers'])]
+        Instrument.objects.bulk_create(
+            [
+                Instrument(
+                    ticker=ticker,
+                    name=f'Synthetic {ticker}',
+                    shard=sharding.ring_shard(ticker) if sharding.sharding_enabled() else None,
+                )
+                for ticker in tickers
+            ],
+            ignore_conflicts=True
+        )
+        by_ticker = Instrument.objects.in_bulk(tickers, field_name='ticker')
+        return [by_ticker[ticker] for ticker in tickers]
+
+    def _seed_users(self):
+        rng = self.rng
+        new_uuid = self._uuid_factory()
+        # Балансы вставляются по порядку пользователей, то есть по индексу
+        user_ids = sorted(new_uuid() for _ in range(self.options['users']))
+
+        def rows():
+            for index, user_id in enumerate(user_ids):
+                yield user_id, f'user-{index}', 'USER', f'key-{rng.getrandbits(128):032x}'
+
+        self._insert(User, ['id', 'name', 'role', 'api_key'], rows(), len(user_ids))
+        return user_ids
+
+    def _seed_balances(self, user_ids, instruments):
+        rng = self.rng
+        usd, _ = Instrument.objects.get_or_create(ticker='USD', defaults={'name': 'US Dollar'})
+        median_qty = self.options['median_qty']
+        # Достаточно средств, чтобы пользователь мог торговать
+        usd_amount = self.options['mid_price'] * median_qty * 100 * usd.unit
+        count = min(TICKERS_PER_USER, len(instruments))
+
+        def rows():
+            for user_id in user_ids:
+                yield user_id, usd.id, usd_amount
+                for instrument in rng.sample(instruments, count):
+                    yield user_id, instrument.id, rng.randint(1, median_qty * 100) * instrument.unit
+
+        self._insert(Balance, ['user', 'instrument', 'amount'], rows(), len(user_ids) * (count + 1))
+
+    def _open_ledger(self):
+        """Записи OPENING журнала для балансов, у которых записей ещё нет"""
+        started = time.monotonic()
+        now, adapt = self._datetime_factory()
+        quote = connection.ops.quote_name
+        ledger, balance = quote(LedgerEntry._meta.db_table), quote(Balance._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {ledger} (user_id, instrument_id, amount, kind, created_at) "
+                f"SELECT b.user_id, b.instrument_id, b.amount, 'OPENING', %s FROM {balance} b "
+                f"WHERE b.amount <> 0 AND NOT EXISTS (SELECT 1 FROM {ledger} l "
+                f"WHERE l.user_id = b.user_id AND l.instrument_id = b.instrument_id)",
+                [adapt(now)]
+            )
+            inserted = cursor.rowcount
+        elapsed = time.monotonic() - started
+        rate = inserted / elapsed if elapsed else 0
+        self.stdout.write(f'LedgerEntry: {inserted} строк ({rate:.0f} строк/с)')
+        self.total_rows += inserted
+
+    def _seed_orders(self, user_ids, instruments):
+        if not self.options['orders']:
+            return
+        rng = self.rng
+        pick_ticker = _power_law_picker(rng, len(instruments), self.options['ticker_skew'])
+        pick_user = _power_law_picker(rng, len(user_ids), self.options['user_skew'])
+        timestamp = self._timestamps()
+        qty = self._qty()
+        new_uuid = self._uuid_factory()
+        mid = self.options['mid_price']
+        level_rate = 1 / max(self.options['level_spread'], 1e-9)
+        books = [
+            (instrument.ticker, instrument.tick_size, mid // instrument.tick_size)
+            for instrument in instruments
+        ]
+
+        def rows():
+            for _ in range(self.options['orders']):
+                ticker, tick, mid_tick = books[pick_ticker()]
+                # Покупки ниже середины, продажи выше: стакан не пересекается
+                depth = 1 + int(rng.expovariate(level_rate))
+                if rng.random() < 0.5:
+                    direction, price = 'BUY', max(mid_tick - depth, 1) * tick
+                else:
+                    direction, price = 'SELL', (mid_tick + depth) * tick
+                created = timestamp()
+                yield (
+                    new_uuid(), user_ids[pick_user()], ticker, 'LIMIT',
+                    direction, price, qty(), 0, 'NEW', created, created,
+                )
+
+        self._insert(Order, [
+            'id', 'user', 'ticker', 'order_type', 'direction', 'price', 'qty',
+            'filled', 'status', 'created_at', 'updated_at',
+        ], rows(), self.options['orders'])
+
+    def _seed_trades(self, instruments):
+        if not self.options['trades']:
+            return
+        rng = self.rng
+        pick_ticker = _power_law_picker(rng, len(instruments), self.options['ticker_skew'])
+        qty = self._qty()
+        mid = self.options['mid_price']
+        spread = self.options['level_spread']
+        span = self.options['days'] * 86400
+        count = self.options['trades']
+        now, adapt = self._datetime_factory()
+        start = now - timedelta(seconds=span)
+        step = timedelta(seconds=span / count)
+        books = [
+            (instrument.ticker, instrument.tick_size, mid // instrument.tick_size)
+            for instrument in instruments
+        ]
+
+        # Явный id сохраняет порядок сделок при сортировке порции
+        first_id = (Transaction.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+        def rows():
+            # Сделки идут по времени, цена - около середины
+            for index in range(count):
+                ticker, tick, mid_tick = books[pick_ticker()]
+                price = max(mid_tick + int(rng.gauss(0, spread)), 1) * tick
+                yield first_id + index, ticker, qty(), price, adapt(start + step * index)
+
+        self._insert(Transaction, ['id', 'ticker', 'amount', 'price', 'timestamp'], rows(), count)
@@ -0,0 +1,63 @@
+"""
+Копирует основную SQLite-базу в реплику.
+
+Копия делается через backup API SQLite во временный файл, который затем
+атомарно подменяет файл реплики, поэтому читатели никогда не видят
+частично записанную базу. С --interval команда работает непрерывно.
+
+    EXCHANGE_REPLICA_DB=db.replica.sqlite3 python manage.py sync_replica --interval 1
+"""
+import os
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from exchange.db_router import REPLICA_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = 'Синхронизирует SQLite-реплику с основной базой'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Период повторной синхронизации в секундах (0 - однократно)'
+        )
+
+    def handle(self, *args, **options):
+        if REPLICA_DB_ALIAS not in connections.databases:
+            raise CommandError(
+                'Реплика не настроена: задайте переменную окружения EXCHANGE_REPLICA_DB'
+            )
+
+        source = connections.databases[DEFAULT_DB_ALIAS]
+        target = connections.databases[REPLICA_DB_ALIAS]
+        for database in (source, target):
+            if database['ENGINE'] != 'django.db.backends.sqlite3':
+                raise CommandError(
+                    'Команда поддерживает только SQLite, для других СУБД '
+                    'используйте встроенную репликацию'
+                )
+
+        while True:
+            started = time.perf_counter()
+            self._copy(str(source['NAME']), str(target['NAME']))
+            self.stdout.write(
+                f'Реплика обновлена за {(time.perf_counter() - started) * 1000:.1f} мс'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def _copy(self, source_path, target_path):
+        temporary_path = f'{target_path}.tmp'
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(temporary_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        os.replace(temporary_path, target_path)
@@ -0,0 +1,66 @@
+"""
+Аналитика ленты сделок тикера (exchange.analytics) из командной строки:
+VWAP, профиль объёма, реализованная волатильность и PnL пользователей.
+Результат печатается в JSON, время расчёта - в stderr.
+
+    python manage.py trade_analytics AAPL --since 2025-03-01 --until 2025-03-08 --pnl-users 20
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from exchange import analytics, renderers
+from exchange.models import Instrument
+
+
+def _datetime(value):
+    parsed = parse_datetime(value if 'T' in value or ' ' in value else f'{value}T00:00:00+00:00')
+    if parsed is None:
+        raise CommandError(f'Неверная дата: {value}')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = 'Считает аналитику ленты сделок тикера за период'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ticker')
+        parser.add_argument('--since', type=_datetime, help='Начало периода (ISO 8601)')
+        parser.add_argument('--until', type=_datetime, help='Конец периода, не включая (ISO 8601)')
+        parser.add_argument(
+            '--interval', type=int, default=analytics.DEFAULT_INTERVAL,
+            help='Интервал реализованной волатильности, секунды'
+        )
+        parser.add_argument(
+            '--price-step', type=int, default=analytics.DEFAULT_PRICE_STEP,
+            help='Ширина ценового уровня профиля объёма'
+        )
+        parser.add_argument(
+            '--pnl-users', type=int,
+            help='Посчитать PnL и вывести столько пользователей с наибольшим PnL'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=analytics.DEFAULT_CHUNK_SIZE,
+            help='Строк на одно чтение из БД'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            result = analytics.analyze(
+                options['ticker'],
+                since=options['since'],
+                until=options['until'],
+                interval=options['interval'],
+                price_step=options['price_step'],
+                pnl_users=options['pnl_users'],
+                chunk_size=options['chunk_size'],
+            )
+        except Instrument.DoesNotExist:
+            raise CommandError(f"Инструмент {options['ticker']} не найден")
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(renderers.dumps(result).decode())
+        backend = 'numpy' if analytics.np is not None else 'python'
+        self.stderr.write(f"Сделок: {result['trades']} за {elapsed:.2f} с ({backend})")
@@ -0,0 +1,241 @@
+"""
+Метрики движка сопоставления.
+
+Гистограммы живут в памяти процесса и отдаются в текстовом
+формате Prometheus через эндпоинт /metrics. Гейджи стакана не хранятся,
+а вычисляются в момент сбора одним агрегирующим запросом, поэтому не
+добавляют работы в горячий путь сопоставления.
+
+Гистограммы - на процесс: /metrics веб-воркера отдаёт только его
+наблюдения, поэтому Prometheus опрашивает каждый воркер, а по воркерам
+суммирует запрос (sum by ticker). Процессы-шарды /metrics не отдают:
+профили сопоставления приходят в ответе шарда, и веб-воркер, отправивший
+ордер, записывает их в свои гистограммы (observe). Профиль ордера, ответ
+на который потерян, не учитывается.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Границы корзин для длительностей (секунды)
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+# Границы корзин для количественных величин (сделки, уровни)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            snapshot = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+
+        for labelvalues, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                labels = _format_labels(self.labelnames, labelvalues, ('le', le))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._collectors = []
+
+    def register(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for collector in self._collectors:
+            lines.extend(collector.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+MATCH_PHASE_SECONDS = REGISTRY.register(Histogram(
+    'exchange_match_phase_seconds',
+    'Time spent in each phase of order matching',
+    labelnames=('ticker', 'phase'),
+))
+
+MATCH_FILLS = REGISTRY.register(Histogram(
+    'exchange_match_fills_per_order',
+    'Number of fills produced by a single taker order',
+    labelnames=('ticker',),
+    buckets=COUNT_BUCKETS,
+))
+
+MATCH_LEVELS_SWEPT = REGISTRY.register(Histogram(
+    'exchange_match_levels_swept',
+    'Number of distinct price levels consumed by a single taker order',
+    labelnames=('ticker',),
+    buckets=COUNT_BUCKETS,
+))
+
+
+# Профили сопоставления, собранные в рамках текущего запроса
+_active_reports = ContextVar('exchange_match_reports', default=None)
+
+
+class MatchProfile:
+    """Накапливает длительности фаз сопоставления одного тейкер-ордера"""
+
+    PHASES = ('find', 'persist', 'settle', 'triggers')
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.fills = 0
+        self.levels = 0
+        self._started = time.perf_counter()
+        self.total = 0.0
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def finish(self):
+        """Фиксирует профиль в гистограммах и в отчёте текущего запроса"""
+        self.total = time.perf_counter() - self._started
+        for name, seconds in self.phases.items():
+            MATCH_PHASE_SECONDS.observe(seconds, self.ticker, name)
+        MATCH_PHASE_SECONDS.observe(self.total, self.ticker, 'total')
+        MATCH_FILLS.observe(self.fills, self.ticker)
+        MATCH_LEVELS_SWEPT.observe(self.levels, self.ticker)
+
+        reports = _active_reports.get()
+        if reports is not None:
+            reports.append(self)
+
+    def as_dict(self):
+        return {
+            'ticker': self.ticker,
+            'fills': self.fills,
+            'levels_swept': self.levels,
+            'phases_ms': {
+                name: round(seconds * 1000, 3)
+                for name, seconds in {**self.phases, 'total': self.total}.items()
+            },
+        }
+
+
+def observe(profile):
+    """Записывает в гистограммы профиль из ответа шарда (MatchProfile.as_dict)"""
+    ticker = profile['ticker']
+    for name, milliseconds in profile['phases_ms'].items():
+        MATCH_PHASE_SECONDS.observe(milliseconds / 1000, ticker, name)
+    MATCH_FILLS.observe(profile['fills'], ticker)
+    MATCH_LEVELS_SWEPT.observe(profile['levels_swept'], ticker)
+
+
+@contextmanager
+def profiling():
+    """Собирает профили всех сопоставлений внутри блока"""
+    reports = []
+    token = _active_reports.set(reports)
+    try:
+        yield reports
+    finally:
+        _active_reports.reset(token)
+
+
+def server_timing(profiles):
+    """Формирует значение заголовка Server-Timing по профилям (MatchProfile.as_dict)"""
+    totals = {}
+    for profile in profiles:
+        for name, milliseconds in profile['phases_ms'].items():
+            totals[name] = totals.get(name, 0.0) + milliseconds
+    return ', '.join(
+        f'match-{name};dur={milliseconds:.3f}' for name, milliseconds in totals.items()
+    )
+
+
+class BookDepthCollector:
+    """Гейджи стакана по тикерам: число заявок и суммарный остаток"""
+
+    def collect(self):
+        from django.db.models import Count, F, Sum
+        from .models import Order
+
+        rows = list(
+            Order.objects.active_limit()
+            .values('ticker', 'direction')
+            .annotate(orders=Count('id'), depth=Sum(F('qty') - F('filled')))
+            .order_by('ticker', 'direction')
+        )
+        gauges = (
+            ('exchange_book_resting_orders',
+             'Number of resting limit orders per ticker and side', 'orders'),
+            ('exchange_book_depth',
+             'Total remaining quantity of resting limit orders per ticker and side', 'depth'),
+        )
+        lines = []
+        for name, documentation, field in gauges:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            for row in rows:
+                labels = _format_labels(('ticker', 'side'), (row['ticker'], row['direction']))
+                lines.append(f'{name}{labels} {row[field] or 0}')
+        return lines
+
+
+REGISTRY.register(BookDepthCollector())
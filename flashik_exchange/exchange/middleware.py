@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+
+class ThresholdGZipMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware, сжимающий только ответы не короче
+    EXCHANGE_GZIP_MIN_LENGTH байт: на коротких ответах сжатие
+    тратит процессор и почти не уменьшает размер.
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.EXCHANGE_GZIP_MIN_LENGTH:
+            return response
+        return super().process_response(request, response)
+
+
+class RateLimitHeadersMiddleware:
+    """Добавляет заголовки X-RateLimit-* по результату проверки лимита (throttling.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            rate_limit.apply_headers(response)
+        return response
@@ -0,0 +1,207 @@
+"""
+Инструменты для тяжёлых миграций данных.
+
+process_in_chunks() обходит таблицу порциями по первичному ключу и
+обрабатывает каждую порцию в отдельной транзакции (bulk_create/bulk_update
+внутри обработчика), сохраняя позицию в таблице контрольных точек в той же
+транзакции. Прерванная миграция при повторном запуске продолжает с
+последней сохранённой порции.
+
+Чтобы порции действительно фиксировались по отдельности, миграция должна
+быть неатомарной (atomic = False), а её операции схемы - обёрнуты в RunOnce:
+иначе повторный запуск упадёт на уже применённом AddField. Последней
+операцией миграции ставится ClearCheckpoints(prefix), первой -
+ClearCheckpoints(prefix, backwards=True) для отката. Пример - миграция
+0004_convert_balance_to_relations.
+"""
+import json
+import sys
+import time
+
+from django.db import transaction
+from django.db.migrations.operations.base import Operation
+
+CHECKPOINT_TABLE = 'exchange_migration_checkpoint'
+DEFAULT_CHUNK_SIZE = 1000
+
+# Как часто (секунды) печатать прогресс по умолчанию
+PROGRESS_INTERVAL = 5
+
+
+def _ensure_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ('
+            'name varchar(200) NOT NULL PRIMARY KEY, state text NOT NULL)'
+        )
+
+
+def get_checkpoint(connection, name):
+    _ensure_table(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT state FROM {CHECKPOINT_TABLE} WHERE name = %s', [name])
+        row = cursor.fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def set_checkpoint(connection, name, state):
+    _ensure_table(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {CHECKPOINT_TABLE} WHERE name = %s', [name])
+        cursor.execute(
+            f'INSERT INTO {CHECKPOINT_TABLE} (name, state) VALUES (%s, %s)',
+            [name, json.dumps(state)]
+        )
+
+
+def clear_checkpoints(connection, prefix):
+    _ensure_table(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {CHECKPOINT_TABLE} WHERE name LIKE %s', [f'{prefix}%'])
+
+
+def print_progress(name, initial=0):
+    """
+    Обработчик прогресса по умолчанию: строка в stdout не чаще раза в
+    PROGRESS_INTERVAL. initial - строки, обработанные прошлыми запусками.
+    """
+    started = time.monotonic()
+    last_report = [started]
+
+    def report(processed, total, finished=False):
+        now = time.monotonic()
+        if not processed or not finished and now - last_report[0] < PROGRESS_INTERVAL:
+            return
+        last_report[0] = now
+        rate = (processed - initial) / (now - started) if now > started else 0
+        total_text = f'/{total}' if total is not None else ''
+        sys.stdout.write(f'\n    {name}: {processed}{total_text} rows ({rate:.0f} rows/s)')
+        sys.stdout.flush()
+
+    return report
+
+
+def process_in_chunks(queryset, handle_chunk, name, chunk_size=DEFAULT_CHUNK_SIZE,
+                      progress=None):
+    """
+    Вызывает handle_chunk(rows) для строк queryset порциями по chunk_size
+    в порядке первичного ключа. Каждая порция и сохранение позиции
+    выполняются в одной транзакции. name - уникальное имя контрольной
+    точки, например 'exchange.0004.convert'. progress(processed, total)
+    вызывается после каждой порции (по умолчанию - print_progress).
+    Возвращает число обработанных строк с учётом прошлых запусков.
+    """
+    connection = transaction.get_connection(queryset.db)
+    state = get_checkpoint(connection, name) or {'last_pk': None, 'processed': 0, 'done': False}
+    if state['done']:
+        return state['processed']
+    if progress is None:
+        progress = print_progress(name, state['processed'])
+
+    pk_name = queryset.model._meta.pk.attname
+    remaining = queryset
+    if state['last_pk'] is not None:
+        remaining = queryset.filter(pk__gt=state['last_pk'])
+    total = state['processed'] + remaining.count()
+
+    while True:
+        chunk = queryset.order_by('pk')
+        if state['last_pk'] is not None:
+            chunk = chunk.filter(pk__gt=state['last_pk'])
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            break
+        with transaction.atomic(using=queryset.db):
+            handle_chunk(rows)
+            last_pk = getattr(rows[-1], pk_name)
+            state = {
+                'last_pk': last_pk if isinstance(last_pk, int) else str(last_pk),
+                'processed': state['processed'] + len(rows),
+                'done': False,
+            }
+            set_checkpoint(connection, name, state)
+        progress(state['processed'], total)
+
+    state['done'] = True
+    set_checkpoint(connection, name, state)
+    progress(state['processed'], total, finished=True)
+    return state['processed']
+
+
+class RunOnce(Operation):
+    """
+    Операция схемы, которая при повторном запуске прерванной неатомарной
+    миграции (или её отката) не выполняется второй раз. Операция и отметка
+    о ней фиксируются в одной транзакции (на SQLite и PostgreSQL DDL
+    транзакционен).
+    """
+
+    atomic = True
+    reversible = True
+
+    def __init__(self, name, operation):
+        self.name = name
+        self.operation = operation
+
+    def deconstruct(self):
+        return self.__class__.__name__, [self.name, self.operation], {}
+
+    def state_forwards(self, app_label, state):
+        self.operation.state_forwards(app_label, state)
+
+    def _run_once(self, name, method, schema_editor, *args):
+        connection = schema_editor.connection
+        if get_checkpoint(connection, name):
+            return
+        method(*args)
+        # Отложенные команды (индексы, внешние ключи) - в той же транзакции
+        while schema_editor.deferred_sql:
+            schema_editor.execute(schema_editor.deferred_sql.pop(0))
+        set_checkpoint(connection, name, {'done': True})
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._run_once(
+            self.name, self.operation.database_forwards, schema_editor,
+            app_label, schema_editor, from_state, to_state
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._run_once(
+            f'{self.name}.backwards', self.operation.database_backwards, schema_editor,
+            app_label, schema_editor, from_state, to_state
+        )
+
+    def describe(self):
+        return self.operation.describe()
+
+
+class ClearCheckpoints(Operation):
+    """
+    Удаляет контрольные точки миграции после её завершения: при применении
+    (последняя операция) или, с backwards=True, при откате (первая операция).
+    """
+
+    reduces_to_sql = False
+    reversible = True
+
+    def __init__(self, prefix, backwards=False):
+        self.prefix = prefix
+        self.backwards = backwards
+
+    def deconstruct(self):
+        kwargs = {'backwards': True} if self.backwards else {}
+        return self.__class__.__name__, [self.prefix], kwargs
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not self.backwards:
+            clear_checkpoints(schema_editor.connection, self.prefix)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if self.backwards:
+            clear_checkpoints(schema_editor.connection, self.prefix)
+
+    def describe(self):
+        return f'Clear migration checkpoints {self.prefix}*'
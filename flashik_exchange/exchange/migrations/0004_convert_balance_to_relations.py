@@ -1,89 +1,121 @@
 from django.db import migrations, models
 import django.db.models.deletion
 
+from exchange.migration_utils import ClearCheckpoints, RunOnce, process_in_chunks
+
+
+CHUNK_SIZE = 1000
+
 
 def convert_balances_forward(apps, schema_editor):
     """Конвертирует старые JSON балансы в новую структуру"""
     Balance = apps.get_model('exchange', 'Balance')
-    User = apps.get_model('exchange', 'User')
     Instrument = apps.get_model('exchange', 'Instrument')
     
     # Создаем USD инструмент, если его нет
-    usd_instrument, _ = Instrument.objects.get_or_create(
+    Instrument.objects.get_or_create(
         ticker='USD',
         defaults={'name': 'US Dollar', 'tick_size': 0.01}
     )
-    
-    # Сохраняем старые балансы во временную структуру
-    old_balances = []
-    for balance in Balance.objects.select_related('user'):
-        if balance.balances:
-            old_balances.append((balance.user, balance.balances))
-    
-    # Удаляем все старые записи
-    Balance.objects.all().delete()
-    
-    # Создаем новые записи
-    for user, balances in old_balances:
-        for ticker, amount in balances.items():
-            instrument, _ = Instrument.objects.get_or_create(
-                ticker=ticker,
-                defaults={'name': ticker, 'tick_size': 0.01}
+    instrument_ids = dict(Instrument.objects.values_list('ticker', 'id'))
+
+    def convert(old_balances):
+        # Недостающие инструменты создаём одним запросом на порцию
+        tickers = {
+            ticker
+            for balance in old_balances
+            for ticker in balance.balances or {}
+        }
+        missing = tickers - instrument_ids.keys()
+        if missing:
+            Instrument.objects.bulk_create(
+                [Instrument(ticker=ticker, name=ticker, tick_size=0.01) for ticker in missing],
+                ignore_conflicts=True
             )
-            Balance.objects.create(
-                user=user,
-                instrument=instrument,
+            instrument_ids.update(
+                Instrument.objects.filter(ticker__in=missing).values_list('ticker', 'id')
+            )
+
+        Balance.objects.bulk_create([
+            Balance(
+                user_id=balance.user_id,
+                instrument_id=instrument_ids[ticker],
                 amount=amount
             )
+            for balance in old_balances
+            for ticker, amount in (balance.balances or {}).items()
+        ])
+        Balance.objects.filter(pk__in=[balance.pk for balance in old_balances]).delete()
+
+    # Старые записи - без инструмента; каждая порция заменяется новыми
+    # записями в своей транзакции
+    process_in_chunks(
+        Balance.objects.filter(instrument__isnull=True).only('id', 'user_id', 'balances'),
+        convert,
+        name='exchange.0004.convert',
+        chunk_size=CHUNK_SIZE,
+    )
 
 
 def convert_balances_backward(apps, schema_editor):
     """Конвертирует балансы обратно в JSON формат"""
     Balance = apps.get_model('exchange', 'Balance')
     User = apps.get_model('exchange', 'User')
-    
-    # Группируем балансы по пользователям
-    user_balances = {}
-    for balance in Balance.objects.select_related('user', 'instrument'):
-        if balance.user_id not in user_balances:
-            user_balances[balance.user_id] = {}
-        user_balances[balance.user_id][balance.instrument.ticker] = float(balance.amount)
-    
-    # Удаляем все текущие записи
-    Balance.objects.all().delete()
-    
-    # Создаем старый формат балансов
-    for user_id, balances in user_balances.items():
-        Balance.objects.create(
-            user_id=user_id,
-            balances=balances
-        )
+
+    def restore(users):
+        # Группируем балансы по пользователям
+        user_balances = {}
+        new_balances = Balance.objects.filter(
+            user__in=users, instrument__isnull=False
+        ).select_related('instrument')
+        for balance in new_balances:
+            user_balances.setdefault(balance.user_id, {})[balance.instrument.ticker] = float(balance.amount)
+
+        # Создаем старый формат балансов и удаляем текущие записи
+        Balance.objects.bulk_create([
+            Balance(user_id=user_id, balances=balances)
+            for user_id, balances in user_balances.items()
+        ])
+        Balance.objects.filter(user__in=users, instrument__isnull=False).delete()
+
+    process_in_chunks(
+        User.objects.only('id'),
+        restore,
+        name='exchange.0004.restore',
+        chunk_size=CHUNK_SIZE,
+    )
 
 
 class Migration(migrations.Migration):
+    # Конвертация фиксируется порциями и продолжается после прерывания,
+    # поэтому миграция неатомарная, а операции схемы обёрнуты в RunOnce
+    atomic = False
 
     dependencies = [
         ('exchange', '0003_remove_instrument_max_quantity_and_more'),  # 
     ]
 
     operations = [
+        # Откат завершён, контрольные точки больше не нужны
+        ClearCheckpoints('exchange.0004.', backwards=True),
+
         # 1. Изменяем тип связи с OneToOne на ForeignKey
-        migrations.AlterField(
+        RunOnce('exchange.0004.alter_user', migrations.AlterField(
             model_name='balance',
             name='user',
             field=models.ForeignKey(
                 on_delete=django.db.models.deletion.CASCADE,
                 to='exchange.user'
             ),
-        ),
+        )),
         
         # 2. Создаем новые поля
-        migrations.AddField(
+        RunOnce('exchange.0004.add_amount', migrations.AddField(
             model_name='balance',
             name='amount',
             field=models.DecimalField(decimal_places=8, default=0, max_digits=20),
-        ),
-        migrations.AddField(
+        )),
+        RunOnce('exchange.0004.add_instrument', migrations.AddField(
             model_name='balance',
             name='instrument',
             field=models.ForeignKey(
@@ -92,22 +124,23 @@ class Migration(migrations.Migration):
                 related_name='balances',
                 to='exchange.instrument'
             ),
-        ),
+        )),
         
-        # 3. Конвертируем данные
+        # 3. Конвертируем данные (порциями, каждая в своей транзакции)
         migrations.RunPython(
             convert_balances_forward,
             convert_balances_backward,
+            atomic=False,
         ),
         
         # 4. Удаляем старое поле balances
-        migrations.RemoveField(
+        RunOnce('exchange.0004.remove_balances', migrations.RemoveField(
             model_name='balance',
             name='balances',
-        ),
+        )),
         
         # 5. Делаем новые поля обязательными
-        migrations.AlterField(
+        RunOnce('exchange.0004.require_instrument', migrations.AlterField(
             model_name='balance',
             name='instrument',
             field=models.ForeignKey(
@@ -115,18 +148,21 @@ class Migration(migrations.Migration):
                 related_name='balances',
                 to='exchange.instrument'
             ),
-        ),
+        )),
         
         # 6. Добавляем индекс и ограничение уникальности
-        migrations.AlterUniqueTogether(
+        RunOnce('exchange.0004.unique_user_instrument', migrations.AlterUniqueTogether(
             name='balance',
             unique_together={('user', 'instrument')},
-        ),
-        migrations.AddIndex(
+        )),
+        RunOnce('exchange.0004.add_index', migrations.AddIndex(
             model_name='balance',
             index=models.Index(
                 fields=['user', 'instrument'],
                 name='exchange_ba_user_id_e4c0ac_idx'
             ),
-        ),
-    ] 
\ No newline at end of file
+        )),
+
+        # 7. Миграция применена, контрольные точки больше не нужны
+        ClearCheckpoints('exchange.0004.'),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0004_convert_balance_to_relations'),
+    ]
+
+    operations = [
+        migrations.RenameIndex(
+            model_name='balance',
+            new_name='exchange_ba_user_id_35f814_idx',
+            old_name='exchange_ba_user_id_e4c0ac_idx',
+        ),
+        migrations.AddField(
+            model_name='instrument',
+            name='shard',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='balance',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='exchange.user'),
+        ),
+    ]
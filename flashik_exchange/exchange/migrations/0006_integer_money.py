@@ -0,0 +1,96 @@
+from decimal import ROUND_DOWN, Decimal
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def to_integer_units(apps, schema_editor):
+    """Переводит шаг цены и балансы в целые минимальные единицы"""
+    Instrument = apps.get_model('exchange', 'Instrument')
+    Balance = apps.get_model('exchange', 'Balance')
+
+    # Цены ордеров целые, поэтому дробный шаг цены эквивалентен шагу 1
+    instruments = list(Instrument.objects.all())
+    for instrument in instruments:
+        instrument.tick_size_minor = max(1, int(instrument.tick_size or 0))
+    Instrument.objects.bulk_update(instruments, ['tick_size_minor'], batch_size=BATCH_SIZE)
+
+    # Существующие инструменты получают scale = 0: 1 единица = 1 минимальная
+    scales = {instrument.id: instrument.scale for instrument in instruments}
+    batch = []
+    for balance in Balance.objects.only('id', 'instrument_id', 'amount').iterator(chunk_size=BATCH_SIZE):
+        unit = Decimal(10) ** scales[balance.instrument_id]
+        balance.amount_minor = int((Decimal(balance.amount) * unit).to_integral_value(ROUND_DOWN))
+        batch.append(balance)
+        if len(batch) >= BATCH_SIZE:
+            Balance.objects.bulk_update(batch, ['amount_minor'])
+            batch = []
+    if batch:
+        Balance.objects.bulk_update(batch, ['amount_minor'])
+
+
+def to_decimal_units(apps, schema_editor):
+    """Возвращает шаг цены и балансы в десятичное представление"""
+    Instrument = apps.get_model('exchange', 'Instrument')
+    Balance = apps.get_model('exchange', 'Balance')
+
+    instruments = list(Instrument.objects.all())
+    for instrument in instruments:
+        instrument.tick_size = Decimal(instrument.tick_size_minor)
+    Instrument.objects.bulk_update(instruments, ['tick_size'], batch_size=BATCH_SIZE)
+
+    scales = {instrument.id: instrument.scale for instrument in instruments}
+    batch = []
+    for balance in Balance.objects.only('id', 'instrument_id', 'amount_minor').iterator(chunk_size=BATCH_SIZE):
+        balance.amount = Decimal(balance.amount_minor).scaleb(-scales[balance.instrument_id])
+        batch.append(balance)
+        if len(batch) >= BATCH_SIZE:
+            Balance.objects.bulk_update(batch, ['amount'])
+            batch = []
+    if batch:
+        Balance.objects.bulk_update(batch, ['amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0005_instrument_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instrument',
+            name='scale',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='instrument',
+            name='tick_size_minor',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='balance',
+            name='amount_minor',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(to_integer_units, to_decimal_units),
+        migrations.RemoveField(
+            model_name='instrument',
+            name='tick_size',
+        ),
+        migrations.RemoveField(
+            model_name='balance',
+            name='amount',
+        ),
+        migrations.RenameField(
+            model_name='instrument',
+            old_name='tick_size_minor',
+            new_name='tick_size',
+        ),
+        migrations.RenameField(
+            model_name='balance',
+            old_name='amount_minor',
+            new_name='amount',
+        ),
+    ]
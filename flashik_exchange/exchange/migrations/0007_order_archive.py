@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-19 08:47
+
+import django.db.models.deletion
+import exchange.models
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0006_integer_money'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('ticker', models.CharField(max_length=10, validators=[exchange.models.validate_ticker])),
+                ('order_type', models.CharField(choices=[('MARKET', 'Market'), ('LIMIT', 'Limit')], max_length=10)),
+                ('direction', models.CharField(choices=[('BUY', 'Buy'), ('SELL', 'Sell')], max_length=4)),
+                ('price', models.IntegerField(null=True)),
+                ('qty', models.IntegerField()),
+                ('filled', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('NEW', 'New'), ('EXECUTED', 'Executed'), ('PARTIALLY_EXECUTED', 'Partially Executed'), ('CANCELLED', 'Cancelled')], default='NEW', max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='exchange_or_ticker_6ca0f6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('order_type', 'LIMIT'), ('status__in', ('NEW', 'PARTIALLY_EXECUTED'))), fields=['ticker', 'direction', 'price', 'created_at'], name='exchange_order_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status__in', ('EXECUTED', 'CANCELLED'))), fields=['updated_at'], name='exchange_order_terminal_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='exchange.user'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'created_at'], name='exchange_ar_user_id_d16092_idx'),
+        ),
+    ]
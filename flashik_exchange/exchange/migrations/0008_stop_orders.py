@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0007_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='trigger_price',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='trigger_price',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='order_type',
+            field=models.CharField(choices=[('MARKET', 'Market'), ('LIMIT', 'Limit'), ('STOP_MARKET', 'Stop Market'), ('STOP_LIMIT', 'Stop Limit')], max_length=11),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_type',
+            field=models.CharField(choices=[('MARKET', 'Market'), ('LIMIT', 'Limit'), ('STOP_MARKET', 'Stop Market'), ('STOP_LIMIT', 'Stop Limit')], max_length=11),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('order_type__in', ['STOP_MARKET', 'STOP_LIMIT']), ('status', 'NEW')), fields=['ticker', 'trigger_price'], name='exchange_order_stop_idx'),
+        ),
+    ]
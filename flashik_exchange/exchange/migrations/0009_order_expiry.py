@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0008_stop_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False), ('status__in', ('NEW', 'PARTIALLY_EXECUTED'))), fields=['created_at'], name='exchange_order_expiry_idx'),
+        ),
+    ]
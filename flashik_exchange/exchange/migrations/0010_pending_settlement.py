@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0009_order_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingSettlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.instrument')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'instrument', 'amount'], name='exchange_pe_user_id_717092_idx')],
+            },
+        ),
+    ]
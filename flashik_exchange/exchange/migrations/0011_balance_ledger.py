@@ -0,0 +1,83 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+from exchange.migration_utils import ClearCheckpoints, RunOnce, process_in_chunks
+
+
+def open_ledger(apps, schema_editor):
+    """Записи OPENING: текущие балансы становятся началом журнала"""
+    Balance = apps.get_model('exchange', 'Balance')
+    LedgerEntry = apps.get_model('exchange', 'LedgerEntry')
+    now = django.utils.timezone.now()
+
+    def open_balances(balances):
+        LedgerEntry.objects.bulk_create([
+            LedgerEntry(
+                user_id=balance.user_id,
+                instrument_id=balance.instrument_id,
+                amount=balance.amount,
+                kind='OPENING',
+                created_at=now,
+            )
+            for balance in balances
+            if balance.amount
+        ])
+
+    process_in_chunks(
+        Balance.objects.only('id', 'user_id', 'instrument_id', 'amount'),
+        open_balances,
+        name='exchange.0011.open',
+        chunk_size=10000,
+    )
+
+
+class Migration(migrations.Migration):
+    # Записи OPENING создаются порциями (см. 0004_convert_balance_to_relations)
+    atomic = False
+
+    dependencies = [
+        ('exchange', '0010_pending_settlement'),
+    ]
+
+    operations = [
+        ClearCheckpoints('exchange.0011.', backwards=True),
+        RunOnce('exchange.0011.add_trade_id', migrations.AddField(
+            model_name='pendingsettlement',
+            name='trade_id',
+            field=models.BigIntegerField(null=True),
+        )),
+        RunOnce('exchange.0011.create_checkpoint', migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_id', models.BigIntegerField()),
+                ('amount', models.BigIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.instrument')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'instrument', 'created_at'], name='exchange_ba_user_id_39246a_idx'), models.Index(fields=['entry_id'], name='exchange_ba_entry_i_8b3276_idx')],
+            },
+        )),
+        RunOnce('exchange.0011.create_ledger', migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening balance'), ('DEPOSIT', 'Deposit'), ('WITHDRAWAL', 'Withdrawal'), ('FILL', 'Fill'), ('ADJUSTMENT', 'Adjustment')], max_length=10)),
+                ('trade_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.instrument')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'instrument', 'created_at'], name='exchange_le_user_id_3f2144_idx'), models.Index(fields=['user', 'created_at'], name='exchange_le_user_id_a0d5f6_idx')],
+            },
+        )),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop, atomic=False),
+        ClearCheckpoints('exchange.0011.'),
+    ]
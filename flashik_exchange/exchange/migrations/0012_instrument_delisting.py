@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0011_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instrument',
+            name='status',
+            field=models.CharField(choices=[('ACTIVE', 'Active'), ('HALTED', 'Halted'), ('DELISTED', 'Delisted')], default='ACTIVE', max_length=8),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='kind',
+            field=models.CharField(choices=[('OPENING', 'Opening balance'), ('DEPOSIT', 'Deposit'), ('WITHDRAWAL', 'Withdrawal'), ('FILL', 'Fill'), ('ADJUSTMENT', 'Adjustment'), ('DELISTING', 'Delisting')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='DelistingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.PositiveIntegerField()),
+                ('stage', models.CharField(choices=[('CANCEL_ORDERS', 'Cancel orders'), ('AWAIT_SETTLEMENT', 'Await settlement'), ('CONVERT_BALANCES', 'Convert balances'), ('ARCHIVE_TRADES', 'Archive trades'), ('ARCHIVE_ORDERS', 'Archive orders'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='CANCEL_ORDERS', max_length=16)),
+                ('orders_cancelled', models.PositiveIntegerField(default=0)),
+                ('balances_converted', models.PositiveIntegerField(default=0)),
+                ('trades_archived', models.PositiveIntegerField(default=0)),
+                ('orders_archived', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='exchange.instrument')),
+            ],
+        ),
+    ]
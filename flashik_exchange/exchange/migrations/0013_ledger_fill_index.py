@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0012_instrument_delisting'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(condition=models.Q(('kind', 'FILL')), fields=['instrument', 'trade_id'], name='exchange_ledger_fill_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0013_ledger_fill_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ledgerentry',
+            name='exchange_le_user_id_3f2144_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ledgerentry',
+            name='exchange_le_user_id_a0d5f6_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'instrument', 'id'], name='exchange_le_user_id_12d1e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['user', 'id'], name='exchange_le_user_id_ee5723_idx'),
+        ),
+    ]
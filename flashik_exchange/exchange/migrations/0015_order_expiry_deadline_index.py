@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange', '0014_ledger_id_order_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='exchange_order_expiry_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False), ('status__in', ('NEW', 'PARTIALLY_EXECUTED'))), fields=['expires_at'], name='exchange_order_expiry_idx'),
+        ),
+    ]
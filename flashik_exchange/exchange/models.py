@@ -1,10 +1,15 @@
 import uuid
 import secrets
-from django.db import models
+from collections import deque
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from decimal import Decimal
 from django.core.exceptions import ValidationError
 import re
 
+from . import metrics, settlement, sharding, triggers, versions
+
 
 def generate_api_key():
     return f"key-{secrets.token_hex(16)}"
@@ -31,35 +36,94 @@ class User(models.Model):
         return self.name
 
     def get_balance(self, ticker):
-        """Получает баланс пользователя по тикеру"""
+        """
+        Получает доступный баланс пользователя по тикеру в минимальных
+        единицах: при отложенном расчёте - вместе с ожидающими изменениями
+        """
         try:
-            return self.balances.get(instrument__ticker=ticker).amount
+            amount = self.balances.get(instrument__ticker=ticker).amount
         except Balance.DoesNotExist:
-            return 0
-
-    def update_balance(self, ticker, amount_delta):
-        """Изменяет баланс пользователя по тикеру"""
-        instrument = Instrument.objects.get(ticker=ticker)
+            amount = 0
+        if settlement.deferred_enabled():
+            amount += PendingSettlement.pending(user=self, instrument__ticker=ticker)
+        return amount
+
+    def update_balance(self, instrument, amount_delta, kind='ADJUSTMENT'):
+        """
+        Изменяет баланс пользователя по инструменту (объект или тикер).
+        amount_delta задаётся в минимальных единицах инструмента.
+        Изменение записывается в журнал (LedgerEntry) с типом kind;
+        kind=None - без записи, журнал пишет вызывающий.
+        """
+        if not isinstance(instrument, Instrument):
+            instrument = Instrument.objects.get(ticker=instrument)
         balance, created = self.balances.get_or_create(
             instrument=instrument,
             defaults={'amount': 0}
         )
         new_amount = balance.amount + amount_delta
-        if new_amount < 0:
+        available = new_amount
+        if amount_delta < 0 and settlement.deferred_enabled():
+            # Списание не должно задеть средства, уже ушедшие в сделки
+            available += PendingSettlement.pending(user=self, instrument=instrument)
+        if available < 0:
             raise ValidationError("Insufficient balance")
         balance.amount = new_amount
         balance.save()
+        if kind is not None:
+            LedgerEntry.objects.create(
+                user=self, instrument=instrument, amount=amount_delta, kind=kind
+            )
         return balance
 
 
 class Instrument(models.Model):
+    STATUS_CHOICES = [
+        ('ACTIVE', 'Active'),
+        # Торги остановлены, идёт делистинг (exchange.delisting)
+        ('HALTED', 'Halted'),
+        ('DELISTED', 'Delisted'),
+    ]
+
     ticker = models.CharField(max_length=10, unique=True, validators=[validate_ticker])
     name = models.CharField(max_length=100)
-    tick_size = models.DecimalField(max_digits=10, decimal_places=2, default=0.01)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default='ACTIVE')
+    # Шаг цены в целых единицах цены ордера
+    tick_size = models.PositiveIntegerField(default=1)
+    # Число знаков после запятой у количества инструмента:
+    # балансы хранятся в минимальных единицах, 1 единица = 10 ** scale
+    scale = models.PositiveSmallIntegerField(default=0)
+    # Шард сопоставления, которому принадлежит тикер (см. exchange.sharding)
+    shard = models.PositiveSmallIntegerField(null=True, blank=True)
     
     def __str__(self):
         return self.ticker
 
+    def save(self, *args, **kwargs):
+        if self.shard is None and sharding.sharding_enabled():
+            self.shard = sharding.ring_shard(self.ticker)
+        super().save(*args, **kwargs)
+
+    @property
+    def unit(self):
+        """Число минимальных единиц в одной единице инструмента"""
+        return 10 ** self.scale
+
+    def to_minor(self, amount):
+        """Переводит количество из единиц API в минимальные единицы"""
+        if isinstance(amount, int):
+            return amount * self.unit
+        minor = Decimal(amount).scaleb(self.scale)
+        if minor != minor.to_integral_value():
+            raise ValidationError(f"Amount must have at most {self.scale} decimal places")
+        return int(minor)
+
+    def from_minor(self, amount):
+        """Переводит количество из минимальных единиц в единицы API"""
+        if self.scale == 0:
+            return amount
+        return Decimal(amount).scaleb(-self.scale)
+
     def validate_price(self, price):
         if price % self.tick_size != 0:
             raise ValidationError(f"Price must be multiple of tick size {self.tick_size}")
@@ -81,7 +145,85 @@ class Transaction(models.Model):
         return f"{self.amount}@{self.price}"
 
 
-class Order(models.Model):
+ACTIVE_ORDER_STATUSES = ('NEW', 'PARTIALLY_EXECUTED')
+TERMINAL_ORDER_STATUSES = ('EXECUTED', 'CANCELLED')
+
+# Типы стоп-ордеров и тип, который ордер получает при активации
+STOP_ORDER_TYPES = {'STOP_MARKET': 'MARKET', 'STOP_LIMIT': 'LIMIT'}
+
+
+class OrderQuerySet(models.QuerySet):
+    """
+    Выборки, обслуживаемые частичными индексами Order.
+
+    Условия подставляются в SQL литералом: с параметрами запроса SQLite не
+    может доказать совпадение с условием частичного индекса и не использует
+    его.
+    """
+
+    def _with_statuses(self, statuses, extra=''):
+        table = self.model._meta.db_table
+        values = ', '.join(f"'{value}'" for value in statuses)
+        return self.extra(where=[f'"{table}"."status" IN ({values}){extra}'])
+
+    def active_limit(self):
+        """
+        Активные лимитные ордера (то, что лежит в стакане). Ордера с
+        истёкшим сроком, которые ещё не отменил свипер (exchange.expiry),
+        отбрасываются.
+        """
+        return self.resting().not_expired()
+
+    def resting(self):
+        """Активные лимитные ордера, включая ещё не отменённые истёкшие"""
+        table = self.model._meta.db_table
+        return self._with_statuses(
+            ACTIVE_ORDER_STATUSES, f' AND "{table}"."order_type" = \'LIMIT\''
+        )
+
+    def not_expired(self):
+        return self.filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now())
+        )
+
+    def timed(self):
+        """Активные ордера со сроком действия"""
+        table = self.model._meta.db_table
+        return self._with_statuses(ACTIVE_ORDER_STATUSES, f' AND "{table}"."expires_at" IS NOT NULL')
+
+    def terminal(self):
+        """Исполненные и отменённые ордера"""
+        return self._with_statuses(TERMINAL_ORDER_STATUSES)
+
+    def pending_stops(self):
+        """Стоп-ордера, ожидающие активации"""
+        table = self.model._meta.db_table
+        types = ', '.join(f"'{order_type}'" for order_type in STOP_ORDER_TYPES)
+        return self._with_statuses(('NEW',), f' AND "{table}"."order_type" IN ({types})')
+
+    def archive_chunk(self, chunk_size):
+        """
+        Переносит до chunk_size ордеров выборки (самые давно изменённые) в
+        ArchivedOrder одной транзакцией; возвращает число перенесённых
+        """
+        fields = [
+            field.attname for field in ArchivedOrder._meta.concrete_fields
+            if field.attname != 'archived_at'
+        ]
+        with transaction.atomic():
+            rows = list(self.order_by('updated_at').values(*fields)[:chunk_size])
+            if rows:
+                ArchivedOrder.objects.bulk_create(
+                    [ArchivedOrder(**row) for row in rows],
+                    ignore_conflicts=True
+                )
+                Order.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        return len(rows)
+
+
+class OrderFields(models.Model):
+    """Общие поля активных и архивных ордеров"""
+
     ORDER_STATUS_CHOICES = [
         ('NEW', 'New'),
         ('EXECUTED', 'Executed'),
@@ -91,7 +233,9 @@ class Order(models.Model):
 
     ORDER_TYPE_CHOICES = [
         ('MARKET', 'Market'),
-        ('LIMIT', 'Limit')
+        ('LIMIT', 'Limit'),
+        ('STOP_MARKET', 'Stop Market'),
+        ('STOP_LIMIT', 'Stop Limit')
     ]
 
     DIRECTION_CHOICES = [
@@ -102,9 +246,14 @@ class Order(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     ticker = models.CharField(max_length=10, validators=[validate_ticker])
-    order_type = models.CharField(max_length=10, choices=ORDER_TYPE_CHOICES)
+    order_type = models.CharField(max_length=11, choices=ORDER_TYPE_CHOICES)
     direction = models.CharField(max_length=4, choices=DIRECTION_CHOICES)
     price = models.IntegerField(null=True)
+    # Цена активации стоп-ордера; после активации ордер становится
+    # рыночным или лимитным, а поле сохраняется
+    trigger_price = models.IntegerField(null=True, blank=True)
+    # Срок действия: после него ордер отменяется (exchange.expiry)
+    expires_at = models.DateTimeField(null=True, blank=True)
     qty = models.IntegerField()
     filled = models.IntegerField(default=0)
     status = models.CharField(
@@ -112,13 +261,55 @@ class Order(models.Model):
         choices=ORDER_STATUS_CHOICES,
         default='NEW'
     )
+
+    class Meta:
+        abstract = True
+
+    @property
+    def remaining_quantity(self):
+        return self.qty - self.filled
+
+    def __str__(self):
+        return f"{self.direction} {self.qty}@{self.price or 'MARKET'} {self.status}"
+
+
+class Order(OrderFields):
+    """Активные и недавно завершённые ордера (горячая таблица)"""
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         indexes = [
-            models.Index(fields=['ticker', 'status', 'direction', 'price']),
+            # Стакан: только активные лимитные ордера
+            models.Index(
+                fields=['ticker', 'direction', 'price', 'created_at'],
+                condition=models.Q(
+                    status__in=ACTIVE_ORDER_STATUSES, order_type='LIMIT'
+                ),
+                name='exchange_order_book_idx',
+            ),
             models.Index(fields=['user', 'status']),
+            # Выборка завершённых ордеров для архивации
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(status__in=TERMINAL_ORDER_STATUSES),
+                name='exchange_order_terminal_idx',
+            ),
+            # Ожидающие стоп-ордера для книги стопов (exchange.triggers)
+            models.Index(
+                fields=['ticker', 'trigger_price'],
+                condition=models.Q(status='NEW', order_type__in=list(STOP_ORDER_TYPES)),
+                name='exchange_order_stop_idx',
+            ),
+            # Ордера со сроком действия для свипера (exchange.expiry)
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(status__in=ACTIVE_ORDER_STATUSES, expires_at__isnull=False),
+                name='exchange_order_expiry_idx',
+            ),
         ]
 
     def save(self, *args, **kwargs):
@@ -136,12 +327,18 @@ class Order(models.Model):
 
         super().save(*args, **kwargs)
 
-    @property
-    def remaining_quantity(self):
-        return self.qty - self.filled
 
-    def __str__(self):
-        return f"{self.direction} {self.qty}@{self.price or 'MARKET'} {self.status}"
+class ArchivedOrder(OrderFields):
+    """Завершённые ордера, перенесённые из Order командой archive_orders"""
+
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+        ]
 
 
 class Balance(models.Model):
@@ -155,7 +352,8 @@ class Balance(models.Model):
         on_delete=models.CASCADE,
         related_name='balances'
     )
-    amount = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    # Сумма в минимальных единицах инструмента (см. Instrument.scale)
+    amount = models.BigIntegerField(default=0)
 
     class Meta:
         unique_together = ['user', 'instrument']
@@ -169,11 +367,48 @@ class Balance(models.Model):
     @classmethod
     def get_user_balances(cls, user):
         """Получает все балансы пользователя в формате {ticker: amount}"""
+        if settlement.deferred_enabled():
+            return {
+                instrument.ticker: instrument.from_minor(instrument.available)
+                for instrument in cls._available_instruments(user)
+            }
         balances = {}
         for balance in cls.objects.filter(user=user).select_related('instrument'):
-            balances[balance.instrument.ticker] = float(balance.amount)
+            balances[balance.instrument.ticker] = balance.instrument.from_minor(balance.amount)
+        return balances
+
+    @classmethod
+    async def aget_user_balances(cls, user):
+        """Асинхронная версия get_user_balances"""
+        balances = {}
+        if settlement.deferred_enabled():
+            async for instrument in cls._available_instruments(user):
+                balances[instrument.ticker] = instrument.from_minor(instrument.available)
+            return balances
+        async for balance in cls.objects.filter(user=user).select_related('instrument'):
+            balances[balance.instrument.ticker] = balance.instrument.from_minor(balance.amount)
         return balances
 
+    @classmethod
+    def _available_instruments(cls, user):
+        """
+        Инструменты, по которым у пользователя есть баланс или ожидающие
+        изменения, с доступной суммой в поле available (один запрос)
+        """
+        settled = cls.objects.filter(user=user, instrument=models.OuterRef('pk')).values('amount')
+        pending = (
+            PendingSettlement.objects.filter(user=user, instrument=models.OuterRef('pk'))
+            .values('instrument')
+            .annotate(total=models.Sum('amount'))
+            .values('total')
+        )
+        return (
+            Instrument.objects
+            .annotate(settled=models.Subquery(settled), pending=models.Subquery(pending))
+            .filter(models.Q(settled__isnull=False) | models.Q(pending__isnull=False))
+            .annotate(available=Coalesce('settled', 0) + Coalesce('pending', 0))
+        )
+
     def has_sufficient_balance(self, amount):
         """Проверяет достаточно ли средств"""
         return self.amount >= amount
@@ -186,62 +421,357 @@ class Balance(models.Model):
         self.save()
 
 
+class PendingSettlement(models.Model):
+    """
+    Изменение баланса от сделки, ещё не применённое к Balance (режим
+    EXCHANGE_DEFERRED_SETTLEMENT, см. exchange.settlement). Доступный
+    баланс - Balance.amount плюс сумма таких записей.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+')
+    # В минимальных единицах инструмента, со знаком
+    amount = models.BigIntegerField()
+    # Сделка (Transaction.id) для записи в журнал при применении
+    trade_id = models.BigIntegerField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'instrument', 'amount']),
+        ]
+
+    @classmethod
+    def pending(cls, **filters):
+        """Сумма ожидающих изменений, выбранных filters"""
+        return cls.objects.filter(**filters).aggregate(total=models.Sum('amount'))['total'] or 0
+
+
+class DeferredSettlement:
+    """
+    Расчёт сделок одного сопоставления при отложенном расчёте: вместо
+    обновления Balance изменения записываются в PendingSettlement.
+    Списания проверяются по доступному балансу так же, как в
+    User.update_balance; прочитанные балансы кэшируются на время
+    сопоставления, поэтому запросы к БД нужны только для новых пар
+    (пользователь, инструмент).
+    """
+
+    def __init__(self):
+        # (user_id, instrument_id) -> доступный баланс до сопоставления
+        self.available = {}
+        # (user_id, instrument_id) -> изменения, записанные в этом сопоставлении
+        self.deltas = {}
+
+    def _balance(self, key):
+        if key not in self.available:
+            user_id, instrument_id = key
+            settled = Balance.objects.filter(
+                user_id=user_id, instrument_id=instrument_id
+            ).values_list('amount', flat=True).first() or 0
+            self.available[key] = settled + PendingSettlement.pending(
+                user_id=user_id, instrument_id=instrument_id
+            )
+        return self.available[key] + self.deltas.get(key, 0)
+
+    def settle(self, legs, trade_id):
+        """Записывает изменения сделки целиком (одним INSERT) или ни одного"""
+        # Изменения применяются по порядку, как в User.update_balance
+        changes = {}
+        for user, instrument, amount in legs:
+            key = (user.id, instrument.id)
+            if amount < 0 and self._balance(key) + changes.get(key, 0) + amount < 0:
+                raise ValidationError("Insufficient balance")
+            changes[key] = changes.get(key, 0) + amount
+        for key, amount in changes.items():
+            self.deltas[key] = self.deltas.get(key, 0) + amount
+        PendingSettlement.objects.bulk_create([
+            PendingSettlement(user=user, instrument=instrument, amount=amount, trade_id=trade_id)
+            for user, instrument, amount in legs
+        ])
+        # bulk_create не отправляет post_save
+        versions.bump_balances({user.id for user, _, _ in legs})
+
+
+class LedgerEntry(models.Model):
+    """
+    Запись журнала балансов: каждое применённое изменение Balance.
+    Журнал только дополняется; сумма записей пользователя по инструменту
+    равна Balance.amount. История и баланс на момент времени - exchange.ledger.
+    """
+
+    KIND_CHOICES = [
+        ('OPENING', 'Opening balance'),
+        ('DEPOSIT', 'Deposit'),
+        ('WITHDRAWAL', 'Withdrawal'),
+        ('FILL', 'Fill'),
+        ('ADJUSTMENT', 'Adjustment'),
+        # Конвертация баланса делистингуемого инструмента в USD
+        ('DELISTING', 'Delisting'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+')
+    # В минимальных единицах инструмента, со знаком
+    amount = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Сделка (Transaction.id) для записей FILL; не внешний ключ, так как
+    # сделки архивируются (archive_transactions)
+    trade_id = models.BigIntegerField(null=True, blank=True)
+    # Время применения к балансу (при отложенном расчёте - время работы
+    # run_settlement, а не сделки). Присваивается до INSERT, поэтому у
+    # параллельных писателей может не совпадать с порядком id
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Хвост записей после контрольной точки (порядок журнала - id)
+            models.Index(fields=['user', 'instrument', 'id']),
+            # Выписка пользователя
+            models.Index(fields=['user', 'id']),
+            # Стороны сделок инструмента по диапазону trade_id (exchange.analytics)
+            models.Index(
+                fields=['instrument', 'trade_id'],
+                condition=models.Q(kind='FILL'),
+                name='exchange_ledger_fill_idx',
+            ),
+        ]
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Контрольная точка журнала: баланс пользователя по инструменту после
+    записи entry_id (команда checkpoint_ledger)
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+')
+    entry_id = models.BigIntegerField()
+    amount = models.BigIntegerField()
+    # created_at записи entry_id
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'instrument', 'created_at']),
+            models.Index(fields=['entry_id']),
+        ]
+
+
+class DelistingJob(models.Model):
+    """
+    Фоновый делистинг инструмента (exchange.delisting). Счётчики
+    обновляются после каждой порции и показывают прогресс.
+    """
+
+    STAGE_CHOICES = [
+        ('CANCEL_ORDERS', 'Cancel orders'),
+        ('AWAIT_SETTLEMENT', 'Await settlement'),
+        ('CONVERT_BALANCES', 'Convert balances'),
+        ('ARCHIVE_TRADES', 'Archive trades'),
+        ('ARCHIVE_ORDERS', 'Archive orders'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+')
+    # Цена (в единицах цены ордера), по которой балансы конвертируются в USD
+    price = models.PositiveIntegerField()
+    stage = models.CharField(max_length=16, choices=STAGE_CHOICES, default='CANCEL_ORDERS')
+    orders_cancelled = models.PositiveIntegerField(default=0)
+    balances_converted = models.PositiveIntegerField(default=0)
+    trades_archived = models.PositiveIntegerField(default=0)
+    orders_archived = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+
+def _fill_legs(buyer, seller, base, quote, quantity, total_price):
+    """Изменения балансов от сделки: (пользователь, инструмент, сумма)"""
+    return [
+        (buyer, base, quantity),
+        (buyer, quote, -total_price),
+        (seller, base, -quantity),
+        (seller, quote, total_price),
+    ]
+
+
 class OrderBook:
+    @staticmethod
+    def active_orders(ticker, direction):
+        """Активные лимитные ордера одной стороны стакана в порядке приоритета"""
+        orders = Order.objects.active_limit().filter(
+            ticker=ticker,
+            direction=direction
+        )
+        if direction == 'BUY':
+            return orders.order_by('-price', 'created_at')
+        return orders.order_by('price', 'created_at')
+
+    @staticmethod
+    def build_order_book(bids, asks):
+        """Агрегирует ордера по ценовым уровням"""
+        return {
+            'bid_levels': OrderBook._aggregate_levels(bids),
+            'ask_levels': OrderBook._aggregate_levels(asks),
+        }
+
+    @staticmethod
+    def _aggregate_levels(orders):
+        """Суммирует остатки ордеров, уже упорядоченных по приоритету цены"""
+        levels = []
+        for order in orders:
+            if levels and levels[-1]['price'] == order.price:
+                levels[-1]['qty'] += order.remaining_quantity
+            else:
+                levels.append({'price': order.price, 'qty': order.remaining_quantity})
+        return levels
+
     @staticmethod
     def get_order_book(ticker):
         """Получает актуальный стакан заявок"""
-        active_orders = Order.objects.filter(
-            ticker=ticker,
-            status__in=['NEW', 'PARTIALLY_EXECUTED'],
-            order_type='LIMIT'
+        return OrderBook.build_order_book(
+            OrderBook.active_orders(ticker, 'BUY'),
+            OrderBook.active_orders(ticker, 'SELL')
         )
 
-        bids = active_orders.filter(direction='BUY').order_by('-price', 'created_at')
-        asks = active_orders.filter(direction='SELL').order_by('price', 'created_at')
+    @staticmethod
+    def _levels(ticker, direction, depth):
+        """Выборка лучших depth ценовых уровней одной стороны: (цена, объём)"""
+        levels = (
+            Order.objects.active_limit()
+            .filter(ticker=ticker, direction=direction)
+            .values('price')
+            .annotate(qty=models.Sum(models.F('qty') - models.F('filled')))
+            .order_by('-price' if direction == 'BUY' else 'price')
+            .values_list('price', 'qty')
+        )
+        return levels[:depth]
 
-        bid_levels = {}
-        ask_levels = {}
+    @staticmethod
+    def top_levels(ticker, direction, depth):
+        """
+        Лучшие depth ценовых уровней одной стороны стакана: [(цена, объём)].
+        Агрегируется в БД по индексу стакана, без чтения всех ордеров.
+        """
+        return list(OrderBook._levels(ticker, direction, depth))
 
-        for order in bids:
-            price = float(order.price)  # Преобразуем в float для корректного сравнения
-            if price in bid_levels:
-                bid_levels[price] += float(order.remaining_quantity)
-            else:
-                bid_levels[price] = float(order.remaining_quantity)
+    @staticmethod
+    def top_levels_many(tickers, depth):
+        """
+        Лучшие depth уровней стаканов нескольких тикеров одним запросом:
+        {ticker: {'bid_levels': [...], 'ask_levels': [...]}}. Стороны
+        стаканов - подзапросы с LIMIT, объединённые UNION ALL: каждый
+        останавливается на depth уровнях индекса стакана. Django не
+        разрешает срезы в union() на SQLite, поэтому SQL собирается здесь.
+        """
+        books = {ticker: {'bid_levels': [], 'ask_levels': []} for ticker in tickers}
+        if not tickers:
+            return books
+        parts, params = [], []
+        for ticker in tickers:
+            for direction in ('BUY', 'SELL'):
+                levels = OrderBook._levels(ticker, direction, depth)
+                sql, level_params = levels.query.get_compiler(using=levels.db).as_sql()
+                parts.append(f'SELECT %s, %s, price, qty FROM ({sql}) AS side_{len(parts)}')
+                params += [ticker, direction, *level_params]
+
+        sides = {'BUY': 'bid_levels', 'SELL': 'ask_levels'}
+        with connections[levels.db].cursor() as cursor:
+            cursor.execute(' UNION ALL '.join(parts), params)
+            for ticker, direction, price, qty in cursor.fetchall():
+                books[ticker][sides[direction]].append({'price': price, 'qty': qty})
+        return books
 
-        for order in asks:
-            price = float(order.price)  # Преобразуем в float для корректного сравнения
-            if price in ask_levels:
-                ask_levels[price] += float(order.remaining_quantity)
-            else:
-                ask_levels[price] = float(order.remaining_quantity)
+    @staticmethod
+    async def aget_order_book(ticker):
+        """Асинхронная версия get_order_book"""
+        bids = [order async for order in OrderBook.active_orders(ticker, 'BUY')]
+        asks = [order async for order in OrderBook.active_orders(ticker, 'SELL')]
+        return OrderBook.build_order_book(bids, asks)
 
-        # Преобразуем обратно в Decimal для возврата
-        return {
-            'bid_levels': [{'price': Decimal(str(price)), 'qty': Decimal(str(qty))} 
-                          for price, qty in sorted(bid_levels.items(), reverse=True)],
-            'ask_levels': [{'price': Decimal(str(price)), 'qty': Decimal(str(qty))} 
-                          for price, qty in sorted(ask_levels.items())]
-        }
+    @staticmethod
+    def execute(order):
+        """
+        Исполняет только что созданный ордер, а затем стоп-ордера,
+        активированные его сделками, включая каскад: в порядке активации,
+        внутри одной сделки - в порядке цен активации (см. exchange.triggers).
+        Возвращает текст ошибки, если ордер отменён, иначе None.
+        """
+        activated = deque()
+        detail = OrderBook._execute(order, activated)
+        while activated:
+            stop_order = OrderBook._activate(*activated.popleft())
+            if stop_order is not None:
+                OrderBook._execute(stop_order, activated)
+        return detail
+
+    @staticmethod
+    def _activate(order_id, stop_type):
+        """
+        Превращает стоп-ордер в рыночный или лимитный. Условный UPDATE
+        пропускает отменённые и уже активированные стопы: тогда None.
+        """
+        order_type = STOP_ORDER_TYPES[stop_type]
+        activated = Order.objects.filter(
+            id=order_id, status='NEW', order_type=stop_type
+        ).not_expired().update(order_type=order_type, updated_at=timezone.now())
+        if not activated:
+            return None
+        order = Order.objects.select_related('user').get(id=order_id)
+        if order_type == 'LIMIT':
+            # UPDATE не вызывает сигналы, а ордер может встать в стакан
+            versions.bump_book(order.ticker)
+        return order
 
     @staticmethod
-    def match_orders(new_order):
-        """Сопоставляет ордера и создает транзакции"""
+    def _execute(order, activated):
+        """Исполняет один ордер; стопы, пересечённые его сделками, добавляются в activated"""
+        if order.order_type in STOP_ORDER_TYPES:
+            # Стоп ждёт в книге стопов; если последняя цена уже пересекла
+            # цену активации, он активируется сразу
+            stops = triggers.get_book(order.ticker)
+            stops.add(order)
+            activated.extend(stops.pop_crossed())
+            return None
+
+        try:
+            OrderBook.match_orders(order, activated)
+
+            # Отмена рыночного ордера при недостаточной ликвидности
+            if order.price is None and order.status != 'EXECUTED':
+                order.status = 'CANCELLED'
+                order.save()
+                return "Not enough liquidity for market order"
+
+        except Exception as e:
+            order.status = 'CANCELLED'
+            order.save()
+            return str(e)
+
+        return None
+
+    @staticmethod
+    def match_orders(new_order, activated=None):
+        """
+        Сопоставляет ордера и создает транзакции. Если передан activated,
+        в него добавляются стоп-ордера, пересечённые ценами сделок.
+        """
         if new_order.order_type == 'LIMIT':
-            return OrderBook._match_limit_order(new_order)
+            return OrderBook._match_limit_order(new_order, activated)
         else:
-            return OrderBook._match_market_order(new_order)
+            return OrderBook._match_market_order(new_order, activated)
 
     @staticmethod
-    def _match_limit_order(order):
+    def _match_limit_order(order, activated=None):
         """Сопоставляет лимитный ордер"""
         opposite_direction = 'SELL' if order.direction == 'BUY' else 'BUY'
         
-        matching_orders = Order.objects.filter(
+        matching_orders = Order.objects.active_limit().filter(
             ticker=order.ticker,
-            direction=opposite_direction,
-            status__in=['NEW', 'PARTIALLY_EXECUTED'],
-            order_type='LIMIT'
+            direction=opposite_direction
         )
 
         if order.direction == 'BUY':
@@ -249,27 +779,34 @@ class OrderBook:
         else:
             matching_orders = matching_orders.filter(price__gte=order.price).order_by('-price', 'created_at')
 
-        return OrderBook._process_matching(order, matching_orders)
+        return OrderBook._process_matching(order, matching_orders, activated)
 
     @staticmethod
-    def _match_market_order(order):
+    def _match_market_order(order, activated=None):
         """Сопоставляет рыночный ордер"""
         opposite_direction = 'SELL' if order.direction == 'BUY' else 'BUY'
         
-        matching_orders = Order.objects.filter(
+        matching_orders = Order.objects.active_limit().filter(
             ticker=order.ticker,
-            direction=opposite_direction,
-            status__in=['NEW', 'PARTIALLY_EXECUTED'],
-            order_type='LIMIT'
+            direction=opposite_direction
         ).order_by('price' if order.direction == 'BUY' else '-price', 'created_at')
 
-        return OrderBook._process_matching(order, matching_orders)
+        return OrderBook._process_matching(order, matching_orders, activated)
 
     @staticmethod
-    def _process_matching(taker_order, matching_orders):
+    def _process_matching(taker_order, matching_orders, activated=None):
         """Обрабатывает сопоставление ордеров и создает транзакции"""
         transactions = []
         remaining_quantity = taker_order.qty - taker_order.filled
+        profile = metrics.MatchProfile(taker_order.ticker)
+        swept_prices = set()
+        instruments = None
+        stops = None
+        deferred = DeferredSettlement() if settlement.deferred_enabled() else None
+
+        # Поиск контрагентов: выполняем запрос явно, чтобы замерить его отдельно
+        with profile.phase('find'):
+            matching_orders = list(matching_orders)
 
         for maker_order in matching_orders:
             if remaining_quantity <= 0:
@@ -277,40 +814,69 @@ class OrderBook:
 
             match_quantity = min(remaining_quantity, maker_order.remaining_quantity)
             match_price = maker_order.price
-
-            transaction = Transaction.objects.create(
-                ticker=taker_order.ticker,
-                amount=match_quantity,
-                price=match_price
-            )
-            transactions.append(transaction)
-
-            # Обновляем количество исполненных ордеров
-            maker_order.filled += match_quantity
-            taker_order.filled += match_quantity
-            remaining_quantity -= match_quantity
-
-            # Обновляем статусы
-            for order in [maker_order, taker_order]:
-                if order.filled == order.qty:
-                    order.status = 'EXECUTED'
-                elif order.filled > 0:
-                    order.status = 'PARTIALLY_EXECUTED'
-
-            maker_order.save()
-            taker_order.save()
-
-            # Обновляем балансы
-            if taker_order.direction == 'BUY':
-                buyer, seller = taker_order.user, maker_order.user
-            else:
-                buyer, seller = maker_order.user, taker_order.user
-
-            # Обновляем балансы с учетом сделки
-            total_price = match_quantity * match_price
-            buyer.update_balance(taker_order.ticker, match_quantity)
-            buyer.update_balance('USD', -total_price)
-            seller.update_balance(taker_order.ticker, -match_quantity)
-            seller.update_balance('USD', total_price)
+            swept_prices.add(match_price)
+
+            with profile.phase('persist'):
+                transaction = Transaction.objects.create(
+                    ticker=taker_order.ticker,
+                    amount=match_quantity,
+                    price=match_price
+                )
+                transactions.append(transaction)
+
+                # Обновляем количество исполненных ордеров
+                maker_order.filled += match_quantity
+                taker_order.filled += match_quantity
+                remaining_quantity -= match_quantity
+
+                # Обновляем статусы
+                for order in [maker_order, taker_order]:
+                    if order.filled == order.qty:
+                        order.status = 'EXECUTED'
+                    elif order.filled > 0:
+                        order.status = 'PARTIALLY_EXECUTED'
+
+                maker_order.save()
+                taker_order.save()
+
+            with profile.phase('settle'):
+                if instruments is None:
+                    instruments = Instrument.objects.in_bulk(
+                        [taker_order.ticker, 'USD'], field_name='ticker'
+                    )
+                base, quote = instruments[taker_order.ticker], instruments['USD']
+
+                # Обновляем балансы
+                if taker_order.direction == 'BUY':
+                    buyer, seller = taker_order.user, maker_order.user
+                else:
+                    buyer, seller = maker_order.user, taker_order.user
+
+                # Обновляем балансы с учетом сделки (в минимальных единицах)
+                quantity = match_quantity * base.unit
+                total_price = match_quantity * match_price * quote.unit
+                legs = _fill_legs(buyer, seller, base, quote, quantity, total_price)
+                if deferred is not None:
+                    deferred.settle(legs, transaction.id)
+                else:
+                    for user, instrument, amount in legs:
+                        user.update_balance(instrument, amount, kind=None)
+                    # Журнал сделки - одним INSERT
+                    LedgerEntry.objects.bulk_create([
+                        LedgerEntry(user=user, instrument=instrument, amount=amount,
+                                    kind='FILL', trade_id=transaction.id)
+                        for user, instrument, amount in legs
+                    ])
+
+            # Стопы, пересечённые ценой этой сделки
+            if activated is not None:
+                with profile.phase('triggers'):
+                    if stops is None:
+                        stops = triggers.get_book(taker_order.ticker)
+                    activated.extend(stops.pop_crossed(match_price))
+
+        profile.fills = len(transactions)
+        profile.levels = len(swept_prices)
+        profile.finish()
 
         return transactions
@@ -0,0 +1,46 @@
+"""
+Быстрая сериализация ответов API в JSON.
+
+dumps() кодирует данные сразу в bytes через orjson (он в requirements.txt);
+без него - стандартный json с кодировщиком DRF. Формат в обоих случаях
+совпадает с JSONRenderer: компактный, без экранирования не-ASCII символов,
+UUID и даты в виде строк (UTC с суффиксом Z), Decimal - число. datetime
+выводится как есть, а не как у DateTimeField сериализатора, поэтому время
+сделок, отдаваемых без сериализатора, форматируется заранее
+(serializers.transaction_rows).
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # запасной вариант без orjson - кодировщик DRF
+    orjson = None
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    # Типы, которых нет в orjson (Decimal, ленивые строки), - как в DRF
+    _default = JSONEncoder().default
+
+    def dumps(data):
+        return orjson.dumps(data, default=_default, option=_OPTIONS)
+else:
+    _encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(data):
+        return _encoder.encode(data).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на основе dumps(). Запрос с отступами
+    (Accept: application/json; indent=4) обрабатывается как раньше.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
@@ -0,0 +1,124 @@
+"""
+OpenAPI-схема API, сгенерированная заранее.
+
+Схема строится командой `python manage.py generate_schema` (при сборке или
+деплое) и сохраняется в EXCHANGE_SCHEMA_PATH. SchemaView отдаёт этот файл
+(или 503, если его нет: на запросе схема не строится), а страницы Swagger
+UI и ReDoc используют шаблоны и статику drf_yasg, загружая схему с
+SchemaView. Сам drf_yasg (генератор, инспекторы) импортируется
+только при генерации схемы, поэтому не замедляет запуск воркеров.
+"""
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.shortcuts import render
+from django.urls import reverse
+from django.views import View
+
+logger = logging.getLogger(__name__)
+
+TITLE = "Flashik Exchange API"
+VERSION = 'v1'
+
+
+def generate_schema():
+    """Строит схему через drf_yasg и возвращает её в виде JSON (bytes)"""
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    info = openapi.Info(
+        title=TITLE,
+        default_version=VERSION,
+        description="Документация API для проекта Flashik Exchange",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="contact@example.com"),
+        license=openapi.License(name="BSD License"),
+    )
+    schema = OpenAPISchemaGenerator(info).get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def write_schema(path=None):
+    """
+    Генерирует схему и атомарно записывает её в файл: через временный файл
+    с уникальным именем в том же каталоге и os.replace, поэтому
+    одновременные запуски не пишут в один временный файл, а воркеры не
+    прочитают недописанную схему
+    """
+    path = str(path or settings.EXCHANGE_SCHEMA_PATH)
+    content = generate_schema()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    output = tempfile.NamedTemporaryFile(dir=directory, prefix='.openapi-', delete=False)
+    try:
+        with output:
+            output.write(content)
+        os.replace(output.name, path)
+    except BaseException:
+        os.unlink(output.name)
+        raise
+    return path, len(content)
+
+
+# (mtime файла, содержимое): файл перечитывается только после перегенерации
+_loaded = (None, None)
+
+
+def load_schema():
+    """
+    Содержимое файла схемы или None, если схема не сгенерирована: строить
+    её на запросе слишком долго, это делает generate_schema при деплое
+    """
+    global _loaded
+    path = str(settings.EXCHANGE_SCHEMA_PATH)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if _loaded[0] != mtime:
+            with open(path, 'rb') as schema_file:
+                _loaded = (mtime, schema_file.read())
+    except FileNotFoundError:
+        logger.warning('OpenAPI schema %s not found, run `manage.py generate_schema`', path)
+        return None
+    return _loaded[1]
+
+
+class SchemaView(View):
+    """Готовая OpenAPI-схема из файла"""
+
+    def get(self, request):
+        schema = load_schema()
+        if schema is None:
+            return JsonResponse(
+                {"detail": "OpenAPI schema is not generated"},
+                status=503
+            )
+        return HttpResponse(schema, content_type='application/json')
+
+
+class SwaggerUIView(View):
+    """Swagger UI на шаблоне drf_yasg"""
+
+    def get(self, request):
+        return render(request, 'drf-yasg/swagger-ui.html', {
+            'title': TITLE,
+            'version': VERSION,
+            'swagger_settings': json.dumps({'url': reverse('schema-json')}),
+            'oauth2_config': '{}',
+            'USE_SESSION_AUTH': False,
+        })
+
+
+class RedocView(View):
+    """ReDoc на шаблоне drf_yasg"""
+
+    def get(self, request):
+        return render(request, 'drf-yasg/redoc.html', {
+            'title': TITLE,
+            'version': VERSION,
+            'redoc_settings': json.dumps({'url': reverse('schema-json')}),
+        })
@@ -1,5 +1,11 @@
+from django.utils import timezone
 from rest_framework import serializers
-from .models import User, Instrument, Order, Transaction
+from .models import User, Instrument, Order, Transaction, DelistingJob
+
+
+def validate_future(value):
+    if value <= timezone.now():
+        raise serializers.ValidationError('Expiry time must be in the future')
 
 # Схема для регистрации нового пользователя
 class NewUserSerializer(serializers.Serializer):
@@ -24,17 +30,40 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = ['ticker', 'amount', 'price', 'timestamp']
 
 
+def transaction_rows(trades):
+    """
+    Строки сделок (словари tape.recent_trades) в формате TransactionSerializer
+    без создания экземпляров модели. Время форматирует поле сериализатора:
+    рендерер вывел бы datetime как есть, без перевода в текущий часовой пояс
+    и формата DATETIME_FORMAT
+    """
+    fields = TransactionSerializer.Meta.fields
+    timestamp = TransactionSerializer().fields['timestamp'].to_representation
+    return [
+        {**{field: trade[field] for field in fields}, 'timestamp': timestamp(trade['timestamp'])}
+        for trade in trades
+    ]
+
+
 class LimitOrderBodySerializer(serializers.Serializer):
     direction = serializers.ChoiceField(choices=['BUY', 'SELL'])
     ticker = serializers.CharField()
     qty = serializers.IntegerField(min_value=1)
     price = serializers.IntegerField(min_value=1)
+    # Стоп-лимитный ордер: встаёт в стакан, когда цена сделки дойдёт до trigger_price
+    trigger_price = serializers.IntegerField(min_value=1, required=False)
+    # Ордер отменяется, если не исполнен до expires_at
+    expires_at = serializers.DateTimeField(required=False, validators=[validate_future])
 
 
 class MarketOrderBodySerializer(serializers.Serializer):
     direction = serializers.ChoiceField(choices=['BUY', 'SELL'])
     ticker = serializers.CharField()
     qty = serializers.IntegerField(min_value=1)
+    # Стоп-рыночный ордер: исполняется, когда цена сделки дойдёт до trigger_price
+    trigger_price = serializers.IntegerField(min_value=1, required=False)
+    # Срок ожидания активации стоп-рыночного ордера
+    expires_at = serializers.DateTimeField(required=False, validators=[validate_future])
 
 
 class LimitOrderSerializer(serializers.ModelSerializer):
@@ -54,6 +83,9 @@ class LimitOrderSerializer(serializers.ModelSerializer):
             'qty': body['qty'],
             'price': body['price']
         }
+        for optional in ('trigger_price', 'expires_at'):
+            if body.get(optional) is not None:
+                ret['body'][optional] = body[optional]
         return ret
 
 
@@ -72,6 +104,9 @@ class MarketOrderSerializer(serializers.ModelSerializer):
             'ticker': body['ticker'],
             'qty': body['qty']
         }
+        for optional in ('trigger_price', 'expires_at'):
+            if body.get(optional) is not None:
+                ret['body'][optional] = body[optional]
         return ret
 
 
@@ -90,5 +125,84 @@ class WithdrawSerializer(serializers.Serializer):
     amount = serializers.IntegerField(min_value=1)
 
 
+class BalanceHistoryQuerySerializer(serializers.Serializer):
+    ticker = serializers.CharField(required=False)
+    # Записи не позже момента until; первая запись ответа - баланс на until
+    until = serializers.DateTimeField(required=False)
+    # Страница: записи с id меньше before (id последней записи предыдущей страницы)
+    before = serializers.IntegerField(min_value=1, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class OrderBooksQuerySerializer(serializers.Serializer):
+    MAX_TICKERS = 100
+
+    # Тикеры через запятую; по умолчанию - все активные инструменты
+    tickers = serializers.CharField(required=False)
+    depth = serializers.IntegerField(min_value=1, max_value=1000, default=10)
+
+    def validate_tickers(self, value):
+        tickers = list(dict.fromkeys(ticker.strip() for ticker in value.split(',') if ticker.strip()))
+        if not tickers:
+            raise serializers.ValidationError('At least one ticker is required')
+        if len(tickers) > self.MAX_TICKERS:
+            raise serializers.ValidationError(f'At most {self.MAX_TICKERS} tickers are allowed')
+        return tickers
+
+
+class TradePeriodQuerySerializer(serializers.Serializer):
+    # Период [since, until); по умолчанию - вся лента тикера
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if 'since' in data and 'until' in data and data['since'] >= data['until']:
+            raise serializers.ValidationError('since must be earlier than until')
+        return data
+
+
+class TransactionHistoryQuerySerializer(TradePeriodQuerySerializer):
+    # Последние limit сделок периода
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class AnalyticsQuerySerializer(TradePeriodQuerySerializer):
+    # Интервал реализованной волатильности, секунды
+    interval = serializers.IntegerField(min_value=1, max_value=86400, default=60)
+    # Ширина ценового уровня профиля объёма
+    price_step = serializers.IntegerField(min_value=1, default=1)
+
+
+class AdminAnalyticsQuerySerializer(AnalyticsQuerySerializer):
+    # Пользователей в PnL (с наибольшим PnL)
+    users = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class BulkBalanceSerializer(serializers.Serializer):
+    # Строки проверяются построчно в exchange.bulk_balance, чтобы ошибка
+    # в одной операции не отклоняла весь пакет
+    operations = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False
+    )
+
+
+class DelistQuerySerializer(serializers.Serializer):
+    # Цена конвертации балансов в USD; по умолчанию - цена последней сделки
+    price = serializers.IntegerField(min_value=1, required=False)
+
+
+class DelistingJobSerializer(serializers.ModelSerializer):
+    ticker = serializers.CharField(source='instrument.ticker')
+
+    class Meta:
+        model = DelistingJob
+        fields = [
+            'id', 'ticker', 'price', 'stage', 'orders_cancelled',
+            'balances_converted', 'trades_archived', 'orders_archived',
+            'error', 'created_at', 'updated_at', 'finished_at',
+        ]
+
+
 class OkSerializer(serializers.Serializer):
     success = serializers.BooleanField(default=True)
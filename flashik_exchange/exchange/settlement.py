@@ -0,0 +1,97 @@
+"""
+Отложенный расчёт сделок (EXCHANGE_DEFERRED_SETTLEMENT = True).
+
+Обычно балансы участников обновляются внутри запроса на каждую сделку:
+восемь запросов к Balance на сделку, и на горячих тикерах это большая
+часть времени записи. В режиме отложенного расчёта сопоставление
+записывает четыре изменения балансов сделки в таблицу PendingSettlement
+одним INSERT (см. models.DeferredSettlement), а процесс
+`python manage.py run_settlement` применяет их порциями: изменения одного
+пользователя по одному инструменту суммируются, и на порцию выполняются
+один upsert, прибавляющий суммы к балансам в SQL
+(bulk_balance.increment_balances), и одна вставка в журнал балансов
+(LedgerEntry).
+
+Гарантии достаточности средств не ослабляются: доступный баланс (проверки
+при создании ордера, при сделке и при выводе, ответ /balance) считается
+как применённый баланс плюс ожидающие изменения, и каждое изменение
+проверено против него на момент записи, поэтому в минус не уходит именно
+доступный баланс. Применённый баланс (Balance.amount) может быть временно
+отрицательным: вывод или списание меняют его сразу, а покрывающее их
+ожидающее зачисление применяется позже (применено 0, ожидает +100, вывод
+100 - применено -100, пока воркер не применит +100). Когда очередь
+пользователя применена, применённый баланс равен доступному и не
+отрицателен. Поэтому при включённом режиме Balance.amount нельзя читать
+как остаток без PendingSettlement, а остаток в выписке журнала между
+такими моментами тоже может быть отрицательным.
+
+Перед выключением режима дождитесь, пока воркер применит все записи:
+без режима ожидающие изменения не учитываются.
+"""
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_DELAY = 0.05
+
+
+def deferred_enabled():
+    return settings.EXCHANGE_DEFERRED_SETTLEMENT
+
+
+def settle_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Применяет не более batch_size самых старых изменений одной транзакцией.
+    Возвращает (число изменений, время создания самого старого из них).
+    """
+    from .bulk_balance import increment_balances
+    from .models import LedgerEntry, PendingSettlement
+
+    with transaction.atomic():
+        rows = list(
+            PendingSettlement.objects.order_by('id')
+            .values_list('id', 'user_id', 'instrument_id', 'amount', 'trade_id', 'created_at')[:batch_size]
+        )
+        if not rows:
+            return 0, None
+
+        net = defaultdict(int)
+        for _, user_id, instrument_id, amount, _, _ in rows:
+            net[user_id, instrument_id] += amount
+        # Суммы прибавляются в SQL: чтение балансов и запись посчитанных
+        # значений потеряли бы изменения, сделанные между ними
+        increment_balances(net)
+        # Журнал - по изменению на сторону сделки, без свёртки
+        LedgerEntry.objects.bulk_create([
+            LedgerEntry(user_id=user_id, instrument_id=instrument_id, amount=amount,
+                        kind='FILL', trade_id=trade_id)
+            for _, user_id, instrument_id, amount, trade_id, _ in rows
+        ])
+        PendingSettlement.objects.filter(id__in=[row[0] for row in rows]).delete()
+        # Доступный баланс (применённый + ожидающий) не изменился: версии
+        # балансов для ETag не сбрасываем
+    return len(rows), rows[0][5]
+
+
+def run(batch_size=DEFAULT_BATCH_SIZE, max_delay=DEFAULT_MAX_DELAY, stop=lambda: False):
+    """
+    Основной цикл воркера; работает, пока stop() возвращает False.
+    Полная порция применяется сразу, неполная - не реже раза в max_delay
+    секунд.
+    """
+    while not stop():
+        settled, oldest = settle_batch(batch_size)
+        if settled:
+            logger.info(
+                'Settled %d balance changes, lag %.3f s',
+                settled, (timezone.now() - oldest).total_seconds()
+            )
+        if settled < batch_size:
+            time.sleep(max_delay)
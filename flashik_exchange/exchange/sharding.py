@@ -0,0 +1,209 @@
+"""
+Шардирование сопоставления ордеров по тикерам.
+
+Тикеры распределяются между процессами-шардами консистентным хешированием,
+а назначение сохраняется в Instrument.shard, поэтому переживает перезапуск
+и не меняется при изменении числа шардов. Каждый шард - отдельный процесс
+(`python manage.py run_matching_shards`), который слушает Unix-сокет и
+исполняет ордера своих тикеров строго по одному. Веб-воркер создаёт ордер
+и передаёт его идентификатор шарду-владельцу, получая в ответ результат
+сопоставления.
+
+Протокол: JSON-сообщение с 4-байтным префиксом длины (big-endian) в обе
+стороны, одно соединение на запрос.
+"""
+import bisect
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+_LENGTH = struct.Struct('>I')
+
+# Число виртуальных узлов на шард: сглаживает распределение тикеров
+RING_REPLICAS = 64
+
+
+class ShardUnavailable(Exception):
+    pass
+
+
+def sharding_enabled():
+    return settings.EXCHANGE_MATCHING_SHARDS > 0
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами"""
+
+    def __init__(self, shards, replicas=RING_REPLICAS):
+        points = sorted(
+            (_hash(f'shard-{shard}-{replica}'), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, ticker):
+        index = bisect.bisect(self._keys, _hash(ticker)) % len(self._keys)
+        return self._shards[index]
+
+
+_rings = {}
+
+
+def ring_shard(ticker):
+    """Шард тикера по кольцу при текущем числе шардов"""
+    shards = settings.EXCHANGE_MATCHING_SHARDS
+    ring = _rings.get(shards)
+    if ring is None:
+        ring = _rings[shards] = HashRing(shards)
+    return ring.shard_for(ticker)
+
+
+def owner_shard(instrument):
+    """Шард-владелец инструмента; назначает и сохраняет его при отсутствии"""
+    if instrument.shard is None or instrument.shard >= settings.EXCHANGE_MATCHING_SHARDS:
+        instrument.shard = ring_shard(instrument.ticker)
+        instrument.save(update_fields=['shard'])
+    return instrument.shard
+
+
+def socket_path(shard):
+    return os.path.join(settings.EXCHANGE_SHARD_SOCKET_DIR, f'shard-{shard}.sock')
+
+
+def _send(sock, payload):
+    data = json.dumps(payload).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _receive(sock):
+    header = _read_exactly(sock, _LENGTH.size)
+    return json.loads(_read_exactly(sock, _LENGTH.unpack(header)[0]))
+
+
+def _read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('Connection closed by peer')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def submit_order(shard, order):
+    """
+    Передаёт сохранённый ордер шарду-владельцу и ждёт результат.
+    Возвращает словарь {'detail': текст ошибки или None, 'profile': [...]}.
+    Профили сопоставления из ответа записываются в метрики этого процесса:
+    метрики шарда никто не собирает.
+    """
+    from . import metrics
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(settings.EXCHANGE_SHARD_TIMEOUT)
+            sock.connect(socket_path(shard))
+            _send(sock, {'order_id': str(order.id)})
+            reply = _receive(sock)
+    except (OSError, ConnectionError, ValueError) as e:
+        raise ShardUnavailable(f'Matching shard {shard} is unavailable: {e}') from e
+    for profile in reply['profile']:
+        metrics.observe(profile)
+    return reply
+
+
+def execute_order(order_id):
+    """Исполняет ордер внутри процесса шарда"""
+    from . import metrics
+    from .models import Instrument, Order, OrderBook
+
+    with transaction.atomic():
+        order = Order.objects.select_for_update(of=('self',)).select_related('user').get(id=order_id)
+        if order.status != 'NEW' or order.filled:
+            # Веб-воркер не дождался шарда и отменил ордер (cancel_unmatched)
+            return {'detail': 'Order was cancelled before matching', 'profile': []}
+        if not Instrument.objects.filter(ticker=order.ticker, status='ACTIVE').exists():
+            # Торги остановлены (делистинг), пока ордер шёл к шарду: в
+            # стакан он не встаёт
+            order.status = 'CANCELLED'
+            order.save(update_fields=['status', 'updated_at'])
+            return {'detail': 'Trading is halted', 'profile': []}
+        with metrics.profiling() as reports:
+            detail = OrderBook.execute(order)
+    return {
+        'detail': detail,
+        'profile': [report.as_dict() for report in reports],
+    }
+
+
+def cancel_unmatched(order_id):
+    """
+    Отменяет ордер, если его ещё не исполняли: после обрыва связи с шардом
+    неизвестно, успел ли он зафиксировать сделки, поэтому отмена - условный
+    UPDATE, а не save() устаревшего объекта. True, если ордер отменён.
+    """
+    from . import triggers, versions
+    from .models import STOP_ORDER_TYPES, Order
+
+    with transaction.atomic():
+        order = Order.objects.filter(id=order_id).values('ticker', 'order_type').first()
+        cancelled = Order.objects.filter(
+            id=order_id, status='NEW', filled=0
+        ).update(status='CANCELLED', updated_at=timezone.now())
+        if cancelled:
+            # UPDATE не вызывает сигналы
+            versions.bump_book(order['ticker'])
+            if order['order_type'] in STOP_ORDER_TYPES:
+                versions.bump_stops(order['ticker'], triggers.removed(order_id))
+    return bool(cancelled)
+
+
+class _ShardRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        close_old_connections()
+        order_id = None
+        try:
+            request = _receive(self.request)
+            order_id = request['order_id']
+            reply = execute_order(order_id)
+        except Exception as e:
+            # Ордер уже зафиксирован веб-воркером: без отмены он остался бы
+            # в стакане несопоставленным, хотя клиент получает ошибку. Если
+            # не удастся и отмена, воркер получит обрыв связи и отменит сам.
+            if order_id is not None:
+                cancel_unmatched(order_id)
+            reply = {'detail': str(e), 'profile': []}
+        _send(self.request, reply)
+
+
+class ShardServer(socketserver.UnixStreamServer):
+    """Однопоточный сервер шарда: ордера исполняются строго по очереди"""
+
+    request_queue_size = 128
+
+    def __init__(self, shard):
+        self.shard = shard
+        path = socket_path(shard)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _ShardRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
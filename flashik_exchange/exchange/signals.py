@@ -0,0 +1,42 @@
+"""
+Сброс версий данных (см. versions.py) при изменении моделей.
+
+Массовые операции, обходящие save() (bulk_create, update), увеличивают
+версии сами. Обработчики post_delete для Order и Balance намеренно не
+подключены: они отключили бы быстрое удаление в архивации, а удаление
+активных ордеров и балансов происходит только каскадом от Instrument и User.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import auth, triggers, versions
+from .models import ACTIVE_ORDER_STATUSES, STOP_ORDER_TYPES, Balance, Instrument, Order, User
+
+
+@receiver(post_save, sender=Instrument)
+@receiver(post_delete, sender=Instrument)
+def instrument_changed(sender, instance, **kwargs):
+    versions.bump_instruments()
+    versions.bump_book(instance.ticker)
+
+
+@receiver(post_save, sender=Order)
+def order_changed(sender, instance, created, **kwargs):
+    # Рыночные ордера в стакане не стоят
+    if instance.order_type == 'LIMIT':
+        versions.bump_book(instance.ticker)
+    elif instance.order_type in STOP_ORDER_TYPES:
+        if created:
+            versions.bump_stops(instance.ticker, triggers.added(instance))
+        elif instance.status not in ACTIVE_ORDER_STATUSES:
+            versions.bump_stops(instance.ticker, triggers.removed(instance.id))
+
+
+@receiver(post_save, sender=Balance)
+def balance_changed(sender, instance, **kwargs):
+    versions.bump_balances([instance.user_id])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    auth.forget(instance.api_key)
@@ -0,0 +1,256 @@
+"""
+Лента сделок с разбиением по дням.
+
+Живая часть ленты - таблица Transaction, в неё пишутся сделки открытого
+периода. Закрытые дни команда `archive_transactions` выгружает в сжатые
+NDJSON-файлы, по одному на день и тикер:
+
+    <EXCHANGE_TRADE_ARCHIVE_DIR>/2025-03-09/AAPL.ndjson.gz
+
+и удаляет выгруженные строки из таблицы. Небольшой индекс index.json
+хранит для каждого дня и тикера число сделок и границы по времени, поэтому
+чтение истории открывает только нужные файлы. Функции чтения этого модуля
+прозрачно объединяют архив и живую таблицу.
+
+Архивировать могут одновременно несколько процессов (команда по
+расписанию и делистинг): запись файлов дня и чтение-изменение-запись
+индекса выполняются под блокировкой файла index.lock (fcntl.lockf) и
+threading.Lock для потоков одного процесса, а файлы пишутся через
+временные файлы с уникальными именами и os.replace.
+"""
+import fcntl
+import gzip
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Transaction
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+FIELDS = ('id', 'ticker', 'amount', 'price', 'timestamp')
+
+# Сделок в ответе recent_trades по умолчанию
+DEFAULT_LIMIT = 100
+
+
+def archive_dir():
+    return str(settings.EXCHANGE_TRADE_ARCHIVE_DIR)
+
+
+# Блокировка архиваторов - потоков этого процесса (fcntl.lockf их не
+# различает)
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _archive_lock():
+    """Исключает одновременную запись архива другими процессами и потоками"""
+    os.makedirs(archive_dir(), exist_ok=True)
+    with _thread_lock, open(os.path.join(archive_dir(), LOCK_FILE), 'a+b') as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+
+def _read_index(path):
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+# ((путь, inode, mtime, размер), индекс): индекс перечитывается, только
+# когда файл заменён
+_loaded_index = (None, None)
+
+
+def load_index():
+    """Индекс архива; результат общий для вызовов и не должен изменяться"""
+    global _loaded_index
+    path = os.path.join(archive_dir(), INDEX_FILE)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {'days': {}}
+    key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _loaded_index[0] != key:
+        _loaded_index = (key, _read_index(path))
+    return _loaded_index[1]
+
+
+def _save_index(index):
+    path = os.path.join(archive_dir(), INDEX_FILE)
+    _atomic_write(path, json.dumps(index, indent=1, sort_keys=True).encode())
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}-')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            output.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def _decode(row):
+    row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return row
+
+
+def _read_file(relative_path):
+    with gzip.open(os.path.join(archive_dir(), relative_path), 'rt') as archive:
+        return [_decode(json.loads(line)) for line in archive]
+
+
+def _write_file(relative_path, rows):
+    lines = ''.join(
+        json.dumps({**row, 'timestamp': row['timestamp'].isoformat()}) + '\n'
+        for row in rows
+    )
+    _atomic_write(
+        os.path.join(archive_dir(), relative_path),
+        gzip.compress(lines.encode(), compresslevel=6)
+    )
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def _archived_entries(ticker, since=None, until=None):
+    """Записи индекса архивных дней тикера, пересекающихся с периодом"""
+    days = load_index()['days']
+    for day in sorted(days):
+        entry = days[day].get(ticker)
+        if entry is None:
+            continue
+        if since is not None and datetime.fromisoformat(entry['last']) < since:
+            continue
+        if until is not None and datetime.fromisoformat(entry['first']) >= until:
+            continue
+        yield entry
+
+
+def archived_rows(ticker, since=None, until=None):
+    """Оценка сверху числа архивных сделок тикера за период (по индексу)"""
+    return sum(entry['rows'] for entry in _archived_entries(ticker, since, until))
+
+
+def _in_period(row, since, until):
+    return (since is None or row['timestamp'] >= since) and (until is None or row['timestamp'] < until)
+
+
+def archived_trades(ticker, since=None, until=None):
+    """Сделки тикера из архива в хронологическом порядке"""
+    for entry in _archived_entries(ticker, since, until):
+        for row in _read_file(entry['file']):
+            if _in_period(row, since, until):
+                yield row
+
+
+def live_trades(ticker, since=None, until=None):
+    """Сделки тикера из живой таблицы"""
+    trades = Transaction.objects.filter(ticker=ticker)
+    if since is not None:
+        trades = trades.filter(timestamp__gte=since)
+    if until is not None:
+        trades = trades.filter(timestamp__lt=until)
+    return trades.order_by('timestamp', 'id')
+
+
+def recent_trades(ticker, since=None, until=None, limit=DEFAULT_LIMIT):
+    """
+    Последние limit сделок тикера за период [since, until) в хронологическом
+    порядке, словари с полями FIELDS. Живая таблица читается с LIMIT, а
+    архивные дни - от последнего к первому и только пока сделок не хватает:
+    файлы дней вне периода и дней старше нужных не открываются.
+    """
+    newest = list(live_trades(ticker, since, until).reverse().values(*FIELDS)[:limit])
+    for entry in reversed(list(_archived_entries(ticker, since, until))):
+        if len(newest) >= limit:
+            break
+        rows = [row for row in _read_file(entry['file']) if _in_period(row, since, until)]
+        newest += reversed(rows[len(newest) - limit:])
+    newest.reverse()
+    return newest
+
+
+def archive_transactions(before=None, ticker=None, chunk_size=5000, progress=None):
+    """
+    Выгружает сделки в архив по дням и удаляет их из живой таблицы.
+
+    before - первый неархивируемый день (по умолчанию сегодняшний, UTC),
+    ticker - архивировать только указанный тикер. Повторный запуск после
+    сбоя безопасен: уже записанные в файл сделки не дублируются.
+    Возвращает число перенесённых сделок.
+    """
+    if before is None:
+        before = timezone.now().astimezone(dt_timezone.utc).date()
+    trades = Transaction.objects.all()
+    if ticker is not None:
+        trades = trades.filter(ticker=ticker)
+
+    moved = 0
+    while True:
+        first = trades.filter(timestamp__lt=_day_bounds(before)[0]).order_by('timestamp').first()
+        if first is None:
+            return moved
+        day = first.timestamp.astimezone(dt_timezone.utc).date()
+        moved += _archive_day(trades, day, chunk_size)
+        if progress is not None:
+            progress(day, moved)
+
+
+def _archive_day(trades, day, chunk_size):
+    start, end = _day_bounds(day)
+    day_trades = trades.filter(timestamp__gte=start, timestamp__lt=end)
+    key = day.isoformat()
+
+    by_ticker = {}
+    for row in day_trades.order_by('timestamp', 'id').values(*FIELDS).iterator(chunk_size=chunk_size):
+        by_ticker.setdefault(row['ticker'], []).append(row)
+
+    ids = [row['id'] for rows in by_ticker.values() for row in rows]
+
+    # Индекс читается под блокировкой: записи другого архиватора, успевшего
+    # выгрузить этот день, объединяются, а не перезаписываются
+    with _archive_lock():
+        index_path = os.path.join(archive_dir(), INDEX_FILE)
+        index = _read_index(index_path) if os.path.exists(index_path) else {'days': {}}
+        day_entry = index['days'].setdefault(key, {})
+        for ticker, rows in by_ticker.items():
+            relative_path = f'{key}/{ticker}.ndjson.gz'
+            if ticker in day_entry:
+                # Файл уже есть (повторный запуск, поздние сделки или другой
+                # архиватор): объединяем
+                existing = _read_file(relative_path)
+                known = {row['id'] for row in existing}
+                rows = existing + [row for row in rows if row['id'] not in known]
+                rows.sort(key=lambda row: (row['timestamp'], row['id']))
+            _write_file(relative_path, rows)
+            day_entry[ticker] = {
+                'file': relative_path,
+                'rows': len(rows),
+                'first': rows[0]['timestamp'].isoformat(),
+                'last': rows[-1]['timestamp'].isoformat(),
+            }
+        _save_index(index)
+
+    # Удаляем выгруженное порциями, чтобы не держать длинную блокировку
+    for offset in range(0, len(ids), chunk_size):
+        with transaction.atomic():
+            Transaction.objects.filter(id__in=ids[offset:offset + chunk_size]).delete()
+    return len(ids)
@@ -1,3 +1,868 @@
-from django.test import TestCase
+"""
+Тесты биржи: бюджеты SQL-запросов эндпоинтов и поведение фоновых
+механизмов (в конце файла).
 
-# Create your tests here.
+Бюджеты SQL-запросов эндпоинтов.
+
+Каждый маршрут exchange/urls.py вызывается на синтетических данных
+(seed_dataset) дважды: на исходном наборе и после того, как данные других
+пользователей выросли в GROWTH раз. Для запроса считаются:
+
+- queries - SQL-запросы (без SAVEPOINT/RELEASE: в продакшене на их месте
+  BEGIN/COMMIT);
+- rows - строки, прочитанные SELECT, и строки, изменённые INSERT/UPDATE/DELETE;
+- steps - работа SQLite в сотнях инструкций виртуальной машины: растёт,
+  если запрос просматривает таблицу, даже когда возвращает мало строк.
+
+queries и rows не должны превышать бюджет из BUDGETS. С ростом данных
+queries не должно меняться вовсе (N+1), а rows и steps - расти (O(n)
+просмотры), кроме маршрутов, отмеченных grows: их ответ по смыслу содержит
+все данные тикера. Маршрут без бюджета роняет тест.
+
+Бюджеты - текущие значения: если изменение их превышает, нужно либо
+исправить запросы, либо осознанно поднять бюджет в таблице.
+"""
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from typing import Callable
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.urls import URLPattern
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import (
+    analytics, delisting, expiry, ledger, metrics, renderers, settlement, sharding, tape, triggers,
+    urls
+)
+from .models import (
+    ArchivedOrder, Balance, BalanceCheckpoint, DelistingJob, Instrument, LedgerEntry, Order,
+    PendingSettlement, Transaction, User
+)
+from .serializers import TransactionSerializer
+
+# Во сколько раз растут данные других пользователей между замерами
+GROWTH = 4
+
+SMALL_DATASET = {'users': 200, 'orders': 2000, 'trades': 2000, 'tickers': 3}
+
+# Допустимый рост steps при росте данных в GROWTH раз: поиск по индексу
+# растёт логарифмически, просмотр таблицы - линейно
+MAX_STEPS_GROWTH = 1.5
+
+# Инструкций виртуальной машины SQLite на один шаг steps
+STEP_INSTRUCTIONS = 100
+
+TICKER = 'SAAA'
+
+
+@dataclass
+class Budget:
+    route: str
+    method: str
+    # Путь (без /api/v1/) и тело запроса по фикстуре Fixture
+    path: Callable
+    body: Callable = None
+    auth: str = 'trader'
+    queries: int = 0
+    rows: int = 0
+    # Ответ агрегирует все заявки или сделки тикера, rows или steps растут
+    # вместе с ними
+    grows: bool = False
+
+
+BUDGETS = [
+    Budget('register', 'post', lambda f: 'public/register', lambda f: {'name': 'budget'},
+           auth=None, queries=1, rows=1),
+    Budget('instrument_list', 'get', lambda f: 'public/instrument', auth=None, queries=1, rows=5),
+    Budget('orderbook', 'get', lambda f: f'public/orderbook/{TICKER}', auth=None,
+           queries=3, rows=1000, grows=True),
+    # Объём уровня - сумма всех заявок на нём: steps растут вместе со стаканом
+    Budget('orderbooks', 'get', lambda f: 'public/orderbooks?depth=10', auth=None,
+           queries=2, rows=65, grows=True),
+    # Последние 100 сделок (limit по умолчанию) - по индексу, с конца
+    Budget('transactions', 'get', lambda f: f'public/transactions/{TICKER}', auth=None,
+           queries=1, rows=100),
+    Budget('analytics', 'get', lambda f: f'public/analytics/{TICKER}', auth=None,
+           queries=3, rows=1000, grows=True),
+    Budget('balance', 'get', lambda f: 'balance', queries=2, rows=3),
+    Budget('account_orderbooks', 'get', lambda f: f'orderbooks?tickers={TICKER}&depth=10',
+           queries=4, rows=24, grows=True),
+    Budget('balance_history', 'get', lambda f: 'balance/history?limit=20', queries=6, rows=5),
+    Budget('deposit', 'post', lambda f: 'balance/deposit', lambda f: {'ticker': 'USD', 'amount': 100},
+           queries=5, rows=4),
+    Budget('withdraw', 'post', lambda f: 'balance/withdraw', lambda f: {'ticker': 'USD', 'amount': 10},
+           queries=5, rows=4),
+    Budget('order', 'get', lambda f: 'order', queries=3, rows=3),
+    # Лимитный ордер далеко от стакана: становится в стакан без сделок
+    Budget('order', 'post', lambda f: 'order',
+           lambda f: {'ticker': TICKER, 'direction': 'BUY', 'qty': 1, 'price': 1},
+           queries=6, rows=5),
+    Budget('order_detail', 'get', lambda f: f'order/{f.order.id}', queries=2, rows=2),
+    Budget('order_detail', 'delete', lambda f: f'order/{f.order.id}', queries=3, rows=3),
+    Budget('admin_instrument', 'post', lambda f: 'admin/instrument',
+           lambda f: {'ticker': 'BDGT', 'name': 'Budget'}, auth='admin', queries=3, rows=1),
+    Budget('admin_instrument_detail', 'delete', lambda f: f'admin/instrument/{f.instrument.ticker}',
+           auth='admin', queries=3, rows=3),
+    Budget('admin_delisting_job', 'get', lambda f: f'admin/delisting/{f.job.id}',
+           auth='admin', queries=2, rows=2),
+    Budget('admin_balance_bulk', 'post', lambda f: 'admin/balance/bulk',
+           lambda f: {'operations': [{'user_id': str(f.trader.id), 'ticker': 'USD', 'amount': 5}]},
+           auth='admin', queries=6, rows=9),
+    Budget('admin_analytics', 'get', lambda f: f'admin/analytics/{TICKER}', auth='admin',
+           queries=5, rows=2000, grows=True),
+    # Гейджи глубины стакана агрегируют все активные лимитные заявки
+    Budget('metrics', 'get', lambda f: 'metrics', auth='admin', queries=2, rows=7, grows=True),
+]
+
+
+class Fixture:
+    """Пользователь, от имени которого идут запросы, и его данные"""
+
+    def __init__(self):
+        self.trader = User.objects.create(name='trader')
+        self.admin = User.objects.create(name='budget-admin', role='ADMIN')
+        self.trader.update_balance('USD', 1000000, kind='DEPOSIT')
+        self.trader.update_balance(TICKER, 100, kind='DEPOSIT')
+        # Ордера далеко от стакана: не участвуют в сделках seed_dataset
+        self.order = Order.objects.create(
+            user=self.trader, ticker=TICKER, order_type='LIMIT', direction='BUY', qty=1, price=1
+        )
+        Order.objects.create(
+            user=self.trader, ticker=TICKER, order_type='LIMIT', direction='SELL', qty=1, price=10 ** 9
+        )
+        self.instrument = Instrument.objects.create(ticker='BDGTX', name='Delisted')
+        self.job = DelistingJob.objects.create(instrument=self.instrument, price=1)
+
+
+class QueryCounter:
+    """Считает запросы, строки и шаги SQLite внутри блока with"""
+
+    def __init__(self):
+        self.queries = self.rows = self.steps = 0
+        self._counting = False
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        if connection.vendor == 'sqlite':
+            connection.connection.set_progress_handler(self._step, STEP_INSTRUCTIONS)
+        self._counting = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self._counting = False
+        if connection.vendor == 'sqlite':
+            connection.connection.set_progress_handler(None, 0)
+        self._wrapper.__exit__(*exc_info)
+
+    def _step(self):
+        if self._counting:
+            self.steps += 1
+        # Ненулевой ответ прервал бы запрос
+        return 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')):
+            return execute(sql, params, many, context)
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if many or not sql.lstrip().upper().startswith('SELECT'):
+            self.rows += max(context['cursor'].rowcount, 0)
+        else:
+            # Число строк результата: тот же запрос, посчитанный отдельным
+            # курсором, чтобы не трогать непрочитанный результат
+            self._counting = False
+            cursor = connection.create_cursor()
+            try:
+                cursor.execute(f'SELECT COUNT(*) FROM ({sql}) AS counted', params)
+                self.rows += cursor.fetchone()[0]
+            finally:
+                cursor.close()
+                self._counting = True
+        return result
+
+
+@override_settings(EXCHANGE_RATE_LIMITS={}, EXCHANGE_BOOK_SNAPSHOT='')
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_dataset', seed=1, stdout=StringIO(), **SMALL_DATASET)
+        cls.fixture = Fixture()
+
+    def _request(self, budget):
+        fixture = self.fixture
+        headers = {}
+        if budget.auth is not None:
+            user = getattr(fixture, budget.auth)
+            headers['HTTP_AUTHORIZATION'] = f'TOKEN {user.api_key}'
+        path = '/api/v1/' + budget.path(fixture)
+        method = getattr(self.client, budget.method)
+        if budget.body is None:
+            return method(path, **headers)
+        return method(path, data=budget.body(fixture), content_type='application/json', **headers)
+
+    def _measure(self, budget):
+        """Замер одного запроса; изменения данных откатываются"""
+        with transaction.atomic():
+            with QueryCounter() as counter:
+                response = self._request(budget)
+            transaction.set_rollback(True)
+        self.assertLess(
+            response.status_code, 300,
+            f'{budget.method.upper()} {budget.route}: {response.status_code} {response.content[:200]}'
+        )
+        return counter
+
+    def _grow(self):
+        """Добавляет данные других пользователей: в GROWTH раз больше исходных"""
+        extra = {key: value * (GROWTH - 1) for key, value in SMALL_DATASET.items() if key != 'tickers'}
+        call_command(
+            'seed_dataset', seed=2, tickers=SMALL_DATASET['tickers'], stdout=StringIO(), **extra
+        )
+
+    def test_every_route_has_budget(self):
+        budgeted = {(budget.route, budget.method) for budget in BUDGETS}
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue
+            view = pattern.callback.view_class
+            for method in view.http_method_names:
+                if method in ('head', 'options') or not hasattr(view, method):
+                    continue
+                with self.subTest(route=pattern.name, method=method):
+                    self.assertIn((pattern.name, method), budgeted, 'Добавьте маршрут в BUDGETS')
+
+    def test_query_budgets(self):
+        small = {(budget.route, budget.method): self._measure(budget) for budget in BUDGETS}
+        self._grow()
+        for budget in BUDGETS:
+            key = (budget.route, budget.method)
+            before, after = small[key], self._measure(budget)
+            with self.subTest(route=budget.route, method=budget.method):
+                self.assertLessEqual(after.queries, budget.queries, 'queries превышает бюджет')
+                self.assertEqual(after.queries, before.queries, 'queries растёт с объёмом данных')
+                if budget.grows:
+                    continue
+                self.assertLessEqual(after.rows, budget.rows, 'rows превышает бюджет')
+                self.assertEqual(after.rows, before.rows, 'rows растёт с объёмом данных')
+                if before.steps:
+                    self.assertLessEqual(
+                        after.steps, before.steps * MAX_STEPS_GROWTH + 1,
+                        'steps растёт с объёмом данных'
+                    )
+
+
+# Поведение
+
+
+@override_settings(
+    EXCHANGE_RATE_LIMITS={}, EXCHANGE_BOOK_SNAPSHOT='', EXCHANGE_MATCHING_SHARDS=0,
+    EXCHANGE_DEFERRED_SETTLEMENT=False,
+)
+class ExchangeTestCase(TestCase):
+    """Инструмент TEST и запросы к API от имени пользователей"""
+
+    def setUp(self):
+        # Версии ETag, изменения стопов и ключи идемпотентности - в кэше,
+        # книги стопов - в памяти процесса
+        cache.clear()
+        triggers._books.clear()
+        Instrument.objects.create(ticker='TEST', name='Test')
+
+    def user(self, name, usd=0, test=0, role='USER'):
+        user = User.objects.create(name=name, role=role)
+        if usd:
+            user.update_balance('USD', usd, kind='DEPOSIT')
+        if test:
+            user.update_balance('TEST', test, kind='DEPOSIT')
+        return user
+
+    def request(self, method, path, user=None, data=None, **headers):
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'TOKEN {user.api_key}'
+        method = getattr(self.client, method)
+        if data is None:
+            return method('/api/v1/' + path, **headers)
+        return method('/api/v1/' + path, data=data, content_type='application/json', **headers)
+
+    def order(self, user, **body):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.request('post', 'order', user, {'ticker': 'TEST', **body})
+
+
+class ExpiryTest(ExchangeTestCase):
+    def test_expired_order_is_hidden_then_cancelled(self):
+        maker = self.user('maker', test=10)
+        expired = Order.objects.create(
+            user=maker, ticker='TEST', order_type='LIMIT', direction='SELL', qty=1, price=100,
+            expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        live = Order.objects.create(
+            user=maker, ticker='TEST', order_type='LIMIT', direction='SELL', qty=2, price=101,
+            expires_at=timezone.now() + timedelta(seconds=30),
+        )
+
+        # До свипера истёкший ордер не виден в стакане и не исполняется
+        book = self.request('get', 'public/orderbook/TEST').json()
+        self.assertEqual(book['ask_levels'], [{'price': 101, 'qty': 2}])
+        taker = self.user('taker', usd=1000)
+        self.assertEqual(self.order(taker, direction='BUY', qty=1, price=101).status_code, 200)
+        self.assertEqual(list(Transaction.objects.values_list('price', flat=True)), [101])
+
+        queue = expiry.ExpiryQueue()
+        self.assertEqual(queue.load(), 2)
+        due = queue.pop_due(time.time(), 100)
+        self.assertEqual([entry[1] for entry in due], [expired.id.int])
+        self.assertEqual(expiry.cancel_expired(due), 1)
+        expired.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((expired.status, live.status), ('CANCELLED', 'PARTIALLY_EXECUTED'))
+        # Не истёкший ордер остаётся в куче до своего срока
+        self.assertEqual(queue.pop_due(time.time(), 100), [])
+        self.assertEqual(len(queue), 1)
+
+    def _timed_order(self, user, expires_in, created_ago=timedelta()):
+        order = Order.objects.create(
+            user=user, ticker='TEST', order_type='LIMIT', direction='SELL', qty=1, price=100,
+            expires_at=timezone.now() + expires_in,
+        )
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - created_ago)
+        return order
+
+    def test_poll_finds_orders_by_deadline_not_creation_time(self):
+        maker = self.user('maker', test=10)
+        queue = expiry.ExpiryQueue()
+        far = self._timed_order(maker, timedelta(hours=1))
+        self.assertEqual(queue.load(), 0)
+
+        # Транзакция ордера зафиксирована намного позже его created_at, а
+        # его окно уже просмотрено
+        late = self._timed_order(maker, timedelta(seconds=-1), created_ago=timedelta(minutes=10))
+        self.assertEqual(queue.poll(), 1)
+        due = queue.pop_due(time.time(), 100)
+        self.assertEqual([entry[1] for entry in due], [late.id.int])
+        self.assertEqual(expiry.cancel_expired(due), 1)
+        self.assertEqual(queue.poll(), 0)
+
+        # Дальний срок попадает в кучу, когда входит в окно LOOKAHEAD
+        later = timezone.now() + timedelta(minutes=59, seconds=30)
+        with mock.patch.object(expiry.timezone, 'now', return_value=later):
+            self.assertEqual(queue.poll(), 1)
+        self.assertEqual(queue.next_deadline(), far.expires_at.timestamp())
+
+
+class SettlementTest(ExchangeTestCase):
+    @override_settings(EXCHANGE_DEFERRED_SETTLEMENT=True)
+    def test_pending_changes_are_netted_and_journaled(self):
+        maker = self.user('maker', test=10)
+        taker = self.user('taker', usd=1000)
+        for price in (100, 101, 102):
+            self.order(maker, direction='SELL', qty=2, price=price)
+        self.assertEqual(self.order(taker, direction='BUY', qty=6, price=102).status_code, 200)
+
+        # Четыре изменения на сделку, применённые балансы не тронуты
+        self.assertEqual(PendingSettlement.objects.count(), 12)
+        self.assertEqual(Balance.objects.get(user=taker, instrument__ticker='USD').amount, 1000)
+        # Доступный баланс учитывает ожидающие изменения
+        self.assertEqual(self.request('get', 'balance', taker).json(), {'USD': 394, 'TEST': 6})
+        self.assertEqual(maker.get_balance('USD'), 606)
+
+        settled, oldest = settlement.settle_batch()
+        self.assertEqual(settled, 12)
+        self.assertIsNotNone(oldest)
+        self.assertFalse(PendingSettlement.objects.exists())
+        balances = {
+            f'{name}:{ticker}': amount
+            for name, ticker, amount in Balance.objects.filter(user__in=[maker, taker])
+            .values_list('user__name', 'instrument__ticker', 'amount')
+        }
+        self.assertEqual(balances, {
+            'maker:TEST': 4, 'maker:USD': 606, 'taker:USD': 394, 'taker:TEST': 6,
+        })
+        # Журнал - по записи на сторону сделки, без свёртки
+        fills = LedgerEntry.objects.filter(kind='FILL')
+        self.assertEqual(fills.count(), 12)
+        for user in (maker, taker):
+            for balance in Balance.objects.filter(user=user):
+                journaled = LedgerEntry.objects.filter(
+                    user=user, instrument=balance.instrument
+                ).aggregate(total=Sum('amount'))['total']
+                self.assertEqual(journaled, balance.amount)
+        self.assertEqual(settlement.settle_batch(), (0, None))
+
+
+class LedgerTest(ExchangeTestCase):
+    def test_balance_at_across_checkpoint(self):
+        user = self.user('holder')
+        start = datetime(2025, 3, 1, tzinfo=dt_timezone.utc)
+        usd = Instrument.objects.get(ticker='USD')
+        amounts = [100, -30, 50, 5, -20, 7]
+        for minute, amount in enumerate(amounts):
+            LedgerEntry.objects.create(
+                user=user, instrument=usd, amount=amount, kind='ADJUSTMENT',
+                created_at=start + timedelta(minutes=minute),
+            )
+        # Точки после четырёх записей и в конце запуска; запись после них - хвост
+        self.assertEqual(ledger.create_checkpoints(every=4), 2)
+        LedgerEntry.objects.create(
+            user=user, instrument=usd, amount=1000, kind='ADJUSTMENT',
+            created_at=start + timedelta(minutes=10),
+        )
+
+        for minute in range(-1, 12):
+            moment = start + timedelta(minutes=minute, seconds=30)
+            expected = sum(amounts[:minute + 1]) + (1000 if minute >= 10 else 0)
+            with self.subTest(minute=minute):
+                self.assertEqual(ledger.balance_at(user, 'USD', moment), expected)
+
+        history = ledger.history(user, ticker='USD', limit=3)
+        self.assertEqual([entry['balance'] for entry in history], [1112, 112, 105])
+
+    def test_checkpoints_stop_before_recent_entries(self):
+        user = self.user('holder')
+        usd = Instrument.objects.get(ticker='USD')
+        now = timezone.now()
+        old = now - ledger.CHECKPOINT_LAG - timedelta(minutes=1)
+        # Свежая запись: записи с меньшими id ещё могли быть не зафиксированы
+        for created_at, amount in ((old, 100), (now, 20), (old, 3)):
+            LedgerEntry.objects.create(
+                user=user, instrument=usd, amount=amount, kind='ADJUSTMENT', created_at=created_at,
+            )
+        self.assertEqual(ledger.create_checkpoints(), 1)
+        self.assertEqual(BalanceCheckpoint.objects.get().amount, 100)
+
+        later = now + ledger.CHECKPOINT_LAG + timedelta(seconds=1)
+        with mock.patch.object(ledger.timezone, 'now', return_value=later):
+            self.assertEqual(ledger.create_checkpoints(), 1)
+        self.assertEqual(
+            BalanceCheckpoint.objects.order_by('-entry_id').values_list('amount', flat=True).first(), 123
+        )
+
+
+class DelistingTest(ExchangeTestCase):
+    def test_interrupted_job_resumes_without_double_credit(self):
+        holders = [self.user(f'holder{i}', usd=10, test=i + 1) for i in range(5)]
+        resting = self.order(holders[0], direction='SELL', qty=1, price=500).json()['order_id']
+        admin = self.user('admin', role='ADMIN')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.request('delete', 'admin/instrument/TEST?price=3', admin)
+        job = DelistingJob.objects.get(id=response.json()['job_id'])
+
+        # Процесс прерван после первой порции конвертации
+        reports = []
+
+        def interrupt(job):
+            reports.append(job.stage)
+            if job.stage == 'CONVERT_BALANCES' and job.balances_converted:
+                raise KeyboardInterrupt
+
+        with tempfile.TemporaryDirectory() as archive, \
+                override_settings(EXCHANGE_TRADE_ARCHIVE_DIR=archive):
+            with mock.patch.object(delisting, '_report', interrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    delisting.run_job(job, chunk_size=2)
+            job.refresh_from_db()
+            self.assertEqual((job.stage, job.balances_converted), ('CONVERT_BALANCES', 2))
+
+            self.assertTrue(delisting.run_job(job, chunk_size=2))
+        job.refresh_from_db()
+        self.assertEqual(job.stage, 'DONE')
+        self.assertEqual(job.balances_converted, 5)
+        self.assertEqual(Instrument.objects.get(ticker='TEST').status, 'DELISTED')
+        self.assertEqual(ArchivedOrder.objects.get(id=resting).status, 'CANCELLED')
+        self.assertFalse(Balance.objects.filter(instrument__ticker='TEST').exists())
+        # Каждый держатель получил ровно количество * цену
+        for i, holder in enumerate(holders):
+            self.assertEqual(holder.get_balance('USD'), 10 + (i + 1) * 3)
+            journaled = LedgerEntry.objects.filter(
+                user=holder, instrument__ticker='USD'
+            ).aggregate(total=Sum('amount'))['total']
+            self.assertEqual(journaled, 10 + (i + 1) * 3)
+
+    def _start(self, price=3):
+        admin = self.user('admin', role='ADMIN')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.request('delete', f'admin/instrument/TEST?price={price}', admin)
+        return DelistingJob.objects.get(id=response.json()['job_id'])
+
+    def test_transient_database_error_leaves_job_resumable(self):
+        holder = self.user('holder', test=2)
+        job = self._start()
+        locked = OperationalError('database is locked')
+        with mock.patch.object(delisting, 'increment_balances', side_effect=locked):
+            self.assertFalse(delisting.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.stage, 'CONVERT_BALANCES')
+
+        with tempfile.TemporaryDirectory() as archive, \
+                override_settings(EXCHANGE_TRADE_ARCHIVE_DIR=archive):
+            self.assertTrue(delisting.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.stage, 'DONE')
+        self.assertEqual(holder.get_balance('USD'), 6)
+
+    def test_order_resting_after_cancel_stage_is_cancelled_before_archiving(self):
+        maker = self.user('maker', test=1)
+        job = self._start()
+        # Ордер, зафиксированный после этапа отмены
+        late = []
+
+        def place_late_order(job, chunk_size):
+            late.append(Order.objects.create(
+                user=maker, ticker='TEST', order_type='LIMIT', direction='SELL', qty=1, price=5,
+            ))
+            return True
+
+        stage = (place_late_order, 'CONVERT_BALANCES')
+        with tempfile.TemporaryDirectory() as archive, \
+                override_settings(EXCHANGE_TRADE_ARCHIVE_DIR=archive), \
+                mock.patch.dict(delisting.STAGES, AWAIT_SETTLEMENT=stage):
+            self.assertTrue(delisting.run_job(job))
+        job.refresh_from_db()
+        self.assertEqual((job.stage, job.orders_cancelled), ('DONE', 1))
+        self.assertFalse(Order.objects.filter(ticker='TEST').exists())
+        self.assertEqual(ArchivedOrder.objects.get(id=late[0].id).status, 'CANCELLED')
+
+    def test_shard_rejects_orders_of_halted_instrument(self):
+        trader = self.user('trader', test=1)
+        order = Order.objects.create(
+            user=trader, ticker='TEST', order_type='LIMIT', direction='SELL', qty=1, price=5,
+        )
+        self._start()
+        self.assertEqual(sharding.execute_order(order.id)['detail'], 'Trading is halted')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'CANCELLED')
+
+
+class MarketOrderTest(ExchangeTestCase):
+    def test_market_order_without_liquidity_is_rejected(self):
+        buyer = self.user('buyer', usd=1000)
+        seller = self.user('seller', test=5)
+        # Стакан тикера пуст (исполненные ордера ушли в архив)
+        response = self.order(buyer, direction='BUY', qty=1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'No liquidity for a market order'})
+        self.assertEqual(self.order(seller, direction='SELL', qty=1).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_market_buy_is_estimated_at_best_ask(self):
+        seller = self.user('seller', test=5)
+        self.order(seller, direction='SELL', qty=2, price=100)
+        self.assertEqual(self.order(self.user('poor', usd=99), direction='BUY', qty=1).status_code, 400)
+        buyer = self.user('buyer', usd=100)
+        self.assertEqual(self.order(buyer, direction='BUY', qty=1).status_code, 200)
+        self.assertEqual(buyer.get_balance('TEST'), 1)
+
+
+class StopOrderTest(ExchangeTestCase):
+    def test_cascade_activates_in_trigger_order(self):
+        maker = self.user('maker', test=100)
+        stopper = self.user('stopper', usd=10000)
+        taker = self.user('taker', usd=10000)
+        for price in range(101, 106):
+            self.order(maker, direction='SELL', qty=10, price=price)
+        self.order(taker, direction='BUY', qty=1, price=101)
+
+        # Стоп-лимит на 102 исполняется до 103 и активирует стоп-рыночный на 103
+        market = self.order(stopper, direction='BUY', qty=15, trigger_price=103).json()['order_id']
+        limit = self.order(stopper, direction='BUY', qty=5, price=104, trigger_price=102).json()['order_id']
+        cancelled = self.order(stopper, direction='BUY', qty=1, trigger_price=104).json()['order_id']
+        self.assertEqual(self.request('delete', f'order/{cancelled}', stopper).status_code, 200)
+        self.assertEqual(self.order(taker, direction='BUY', qty=15, price=102).status_code, 200)
+
+        orders = {
+            str(order_id): state for order_id, *state in Order.objects.filter(
+                id__in=[market, limit, cancelled]
+            ).values_list('id', 'order_type', 'status', 'filled')
+        }
+        self.assertEqual(orders[limit], ['LIMIT', 'EXECUTED', 5])
+        self.assertEqual(orders[market], ['MARKET', 'EXECUTED', 15])
+        self.assertEqual(orders[cancelled], ['STOP_MARKET', 'CANCELLED', 0])
+        prices = list(Transaction.objects.order_by('id').values_list('price', flat=True))
+        self.assertEqual(prices, [101, 101, 102, 102, 103, 103, 104])
+
+    def test_stop_popped_by_rolled_back_transaction_fires_later(self):
+        maker = self.user('maker', test=10)
+        stopper = self.user('stopper', usd=1000)
+        taker = self.user('taker', usd=1000)
+        self.order(maker, direction='SELL', qty=10, price=101)
+        stop = self.order(stopper, direction='BUY', qty=1, trigger_price=101).json()['order_id']
+
+        # Транзакция, снявшая стоп, откатывается
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            popped = triggers.get_book('TEST').pop_crossed(101)
+            self.assertEqual([order_id for order_id, _ in popped], [stop])
+            raise RuntimeError
+
+        self.order(taker, direction='BUY', qty=1, price=101)
+        order = Order.objects.get(id=stop)
+        self.assertEqual((order.order_type, order.status, order.filled), ('MARKET', 'EXECUTED', 1))
+
+
+class ShardFailoverTest(ExchangeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sockets = tempfile.TemporaryDirectory()
+        self.addCleanup(self.sockets.cleanup)
+
+    def test_unreachable_shard_cancels_order(self):
+        trader = self.user('trader', usd=1000)
+        with override_settings(EXCHANGE_MATCHING_SHARDS=1, EXCHANGE_SHARD_SOCKET_DIR=self.sockets.name):
+            response = self.order(trader, direction='BUY', qty=1, price=10)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(Order.objects.get(user=trader).status, 'CANCELLED')
+
+    def test_lost_reply_keeps_executed_order(self):
+        maker = self.user('maker', test=5)
+        taker = self.user('taker', usd=1000)
+        self.order(maker, direction='SELL', qty=1, price=10)
+
+        def execute_then_drop(shard, order):
+            # Шард исполнил ордер, но ответ не дошёл
+            sharding.execute_order(order.id)
+            raise sharding.ShardUnavailable('Matching shard 0 is unavailable: timed out')
+
+        with override_settings(EXCHANGE_MATCHING_SHARDS=1, EXCHANGE_SHARD_SOCKET_DIR=self.sockets.name), \
+                mock.patch.object(sharding, 'submit_order', execute_then_drop):
+            response = self.order(taker, direction='BUY', qty=1, price=10)
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(id=response.json()['order_id'])
+        self.assertEqual((order.status, order.filled), ('EXECUTED', 1))
+        self.assertEqual(taker.get_balance('TEST'), 1)
+
+
+    def test_shard_profiles_reach_worker_metrics(self):
+        profile = {
+            'ticker': 'TEST', 'fills': 2, 'levels_swept': 1,
+            'phases_ms': {'find': 0.05, 'persist': 0.2, 'settle': 0.1, 'triggers': 0.0, 'total': 0.4},
+        }
+
+        def fills_count():
+            line = f'{metrics.MATCH_FILLS.name}_count{{ticker="TEST"}} '
+            rows = [row for row in metrics.MATCH_FILLS.collect() if row.startswith(line)]
+            return int(rows[0].removeprefix(line)) if rows else 0
+
+        with override_settings(EXCHANGE_MATCHING_SHARDS=1, EXCHANGE_SHARD_SOCKET_DIR=self.sockets.name), \
+                mock.patch.object(sharding, 'execute_order', return_value={'detail': None, 'profile': [profile]}):
+            # Шард - другой процесс: его гистограммы веб-воркеру не видны
+            server = sharding.ShardServer(0)
+            self.addCleanup(server.server_close)
+            thread = threading.Thread(target=server.handle_request)
+            thread.start()
+            before = fills_count()
+            reply = sharding.submit_order(0, Order(ticker='TEST'))
+            thread.join()
+        self.assertEqual(reply['profile'], [profile])
+        self.assertEqual(fills_count(), before + 1)
+
+
+class IdempotencyTest(ExchangeTestCase):
+    def test_retry_is_replayed_once(self):
+        user = self.user('user')
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'deposit-1'}
+        body = {'ticker': 'USD', 'amount': 5}
+        first = self.request('post', 'balance/deposit', user, body, **headers)
+        retry = self.request('post', 'balance/deposit', user, body, **headers)
+        self.assertEqual((first.status_code, retry.status_code), (200, 200))
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(user.get_balance('USD'), 5)
+
+        changed = self.request('post', 'balance/deposit', user, {**body, 'amount': 6}, **headers)
+        self.assertEqual(changed.status_code, 422)
+        # Ключ другого пользователя - другой запрос
+        other = self.user('other')
+        self.request('post', 'balance/deposit', other, body, **headers)
+        self.assertEqual(other.get_balance('USD'), 5)
+
+    def test_server_error_is_not_stored(self):
+        user = self.user('user')
+        headers = {'HTTP_IDEMPOTENCY_KEY': 'deposit-2'}
+        body = {'ticker': 'USD', 'amount': 5}
+        with mock.patch.object(User, 'update_balance', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.request('post', 'balance/deposit', user, body, **headers)
+        response = self.request('post', 'balance/deposit', user, body, **headers)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(user.get_balance('USD'), 5)
+
+
+class ThrottlingTest(ExchangeTestCase):
+    @override_settings(EXCHANGE_RATE_LIMITS={'public': {'ANON': '2/m', 'USER': None, 'ADMIN': None}})
+    def test_anonymous_clients_are_limited_by_ip(self):
+        statuses = [
+            self.request('get', 'public/instrument', REMOTE_ADDR='198.51.100.7').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+        limited = self.request('get', 'public/instrument', REMOTE_ADDR='198.51.100.7')
+        self.assertGreater(int(limited['Retry-After']), 0)
+        # Другой IP - своя корзина
+        self.assertEqual(self.request('get', 'public/instrument', REMOTE_ADDR='198.51.100.8').status_code, 200)
+
+
+class ETagTest(ExchangeTestCase):
+    def test_not_modified_until_data_changes(self):
+        first = self.request('get', 'public/instrument')
+        etag = first['ETag']
+        cached = self.request('get', 'public/instrument', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Instrument.objects.create(ticker='NEW', name='New')
+        changed = self.request('get', 'public/instrument', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertIn('NEW', [instrument['ticker'] for instrument in changed.json()])
+
+    def test_balance_etag_follows_deposits(self):
+        user = self.user('user', usd=1)
+        etag = self.request('get', 'balance', user)['ETag']
+        self.assertEqual(self.request('get', 'balance', user, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.request('post', 'balance/deposit', user, {'ticker': 'USD', 'amount': 1})
+        response = self.request('get', 'balance', user, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()), (200, {'USD': 2}))
+
+
+class TapeArchiveTest(ExchangeTestCase):
+    def setUp(self):
+        super().setUp()
+        archive = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.cleanup)
+        self.enterContext(override_settings(EXCHANGE_TRADE_ARCHIVE_DIR=archive.name))
+
+    def _trade(self, ticker, price, timestamp):
+        trade = Transaction.objects.create(ticker=ticker, amount=1, price=price)
+        Transaction.objects.filter(id=trade.id).update(timestamp=timestamp)
+
+    def test_archive_round_trip(self):
+        now = timezone.now()
+        for days in (3, 2, 1, 0):
+            self._trade('TEST', 100 + days, now - timedelta(days=days))
+            self._trade('OTHER', 200 + days, now - timedelta(days=days))
+        before = self.request('get', 'public/transactions/TEST').json()
+
+        moved = tape.archive_transactions()
+        self.assertEqual(moved, 6)
+        self.assertEqual(Transaction.objects.count(), 2)
+        # Повторный запуск ничего не дублирует
+        self.assertEqual(tape.archive_transactions(), 0)
+        self.assertEqual(self.request('get', 'public/transactions/TEST').json(), before)
+        self.assertEqual([trade['price'] for trade in before], [103, 102, 101, 100])
+
+        # Окно и limit: открываются только нужные дни
+        with mock.patch.object(tape, '_read_file', wraps=tape._read_file) as read:
+            trades = tape.recent_trades('TEST', until=now - timedelta(days=1, hours=12), limit=1)
+        self.assertEqual([trade['price'] for trade in trades], [102])
+        self.assertEqual(read.call_count, 1)
+
+    def test_concurrent_archivers_keep_each_others_days(self):
+        now = timezone.now()
+        for days in (2, 1):
+            self._trade('TEST', 100 + days, now - timedelta(days=days))
+            self._trade('OTHER', 200 + days, now - timedelta(days=days))
+        lock = tape._archive_lock
+        interleaved = []
+
+        @contextmanager
+        def other_archiver_first():
+            # Другой архиватор выгружает OTHER, пока этот ждёт блокировку
+            if not interleaved:
+                interleaved.append(None)
+                interleaved[0] = tape.archive_transactions(ticker='OTHER')
+            with lock():
+                yield
+
+        with mock.patch.object(tape, '_archive_lock', other_archiver_first):
+            self.assertEqual(tape.archive_transactions(ticker='TEST'), 2)
+        self.assertEqual(interleaved, [2])
+        self.assertFalse(Transaction.objects.exists())
+
+        index = tape.load_index()
+        self.assertIs(tape.load_index(), index)
+        self.assertEqual(
+            {day: sorted(entry) for day, entry in index['days'].items()},
+            {day: ['OTHER', 'TEST'] for day in index['days']},
+        )
+        self.assertEqual(len(index['days']), 2)
+        self.assertEqual([trade['price'] for trade in tape.recent_trades('OTHER')], [202, 201])
+        self.assertEqual([trade['price'] for trade in tape.recent_trades('TEST')], [102, 101])
+        # Временные файлы не остаются
+        for _, _, files in os.walk(tape.archive_dir()):
+            self.assertFalse([name for name in files if name.startswith('.')])
+
+    def test_timestamps_formatted_like_serializer(self):
+        timestamp = datetime(2025, 3, 1, 12, 0, 0, 123456, tzinfo=dt_timezone.utc)
+        self._trade('TEST', 100, timestamp)
+        expected = '2025-03-01T15:00:00.123456+03:00'
+        # Время - как у DateTimeField (в текущем часовом поясе, с
+        # микросекундами) при любом кодировщике, живое и из архива
+        drf = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        for archived in (False, True):
+            if archived:
+                tape.archive_transactions()
+            for dumps in (renderers.dumps, lambda data: drf.encode(data).encode()):
+                with self.subTest(archived=archived), mock.patch.object(renderers, 'dumps', dumps), \
+                        timezone.override('Europe/Moscow'):
+                    if not archived:
+                        serialized = TransactionSerializer(Transaction.objects.get()).data
+                        self.assertEqual(serialized['timestamp'], expected)
+                    trades = self.request('get', 'public/transactions/TEST').json()
+                    self.assertEqual(trades[0]['timestamp'], expected)
+
+
+class AnalyticsTest(ExchangeTestCase):
+    def _trade(self, price, amount, seconds, buyer, seller):
+        trade = Transaction.objects.create(ticker='TEST', amount=amount, price=price)
+        timestamp = datetime(2025, 3, 1, tzinfo=dt_timezone.utc) + timedelta(seconds=seconds)
+        Transaction.objects.filter(id=trade.id).update(timestamp=timestamp)
+        test = Instrument.objects.get(ticker='TEST')
+        for user, sign in ((buyer, 1), (seller, -1)):
+            LedgerEntry.objects.create(
+                user=user, instrument=test, amount=sign * amount, kind='FILL', trade_id=trade.id,
+            )
+
+    def test_numpy_and_python_backends_agree(self):
+        buyer, seller = self.user('buyer'), self.user('seller')
+        for price, amount, seconds in ((100, 2, 0), (104, 1, 30), (110, 3, 70), (99, 4, 150)):
+            self._trade(price, amount, seconds, buyer, seller)
+
+        results = {}
+        for backend, np in (('numpy', analytics.np), ('python', None)):
+            with mock.patch.object(analytics, 'np', np):
+                results[backend] = analytics.analyze('TEST', interval=60, price_step=5, pnl_users=10)
+        self.assertIsNotNone(analytics.np, 'numpy из requirements.txt не установлен')
+        # Логарифмы numpy и math расходятся в последних знаках
+        realized = [result['volatility'].pop('realized') for result in results.values()]
+        self.assertAlmostEqual(*realized, places=12)
+        self.assertEqual(results['numpy'], results['python'])
+
+        result = results['python']
+        self.assertEqual(
+            {key: result[key] for key in ('trades', 'volume', 'open', 'high', 'low', 'close')},
+            {'trades': 4, 'volume': 10, 'open': 100, 'high': 110, 'low': 99, 'close': 99},
+        )
+        self.assertEqual(result['vwap'], 1030 / 10)
+        self.assertEqual(result['volatility']['intervals'], 3)
+        self.assertEqual(
+            [(level['price'], level['volume']) for level in result['volume_profile']],
+            [(95, 4), (100, 3), (110, 3)],
+        )
+        self.assertEqual(
+            [(row['user_id'], row['pnl']) for row in result['pnl']['top']],
+            [(str(seller.id), 40.0), (str(buyer.id), -40.0)],
+        )
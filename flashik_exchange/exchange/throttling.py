@@ -0,0 +1,136 @@
+"""
+Ограничение частоты запросов: token bucket в памяти процесса.
+
+Лимиты задаются в settings.EXCHANGE_RATE_LIMITS по областям (атрибут
+throttle_scope у view) и ролям:
+
+    EXCHANGE_RATE_LIMITS = {
+        'orders': {'ANON': '5/s', 'USER': '20/s', 'ADMIN': None},
+    }
+
+Лимит 'N/период' (период s, m, h, d) даёт корзину ёмкостью N токенов,
+которая пополняется равномерно: N запросов за период с допустимым
+всплеском до N. None - без ограничения; область, которой нет в настройке,
+не ограничивается.
+
+Клиент определяется по API ключу, если ключ уже проходил аутентификацию в
+этом процессе (см. auth.py), иначе - по IP с лимитом роли ANON, поэтому
+проверка не обращается ни к БД, ни к кэшу. Корзины живут в памяти каждого
+процесса: при N воркерах суммарный лимит клиента до N раз выше.
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .auth import cached_identity, get_api_key
+from .lru import ExpiringLRU
+
+ANON_ROLE = 'ANON'
+MAX_BUCKETS = 100000
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'20/s' -> (20, 20.0): ёмкость и скорость пополнения в токенах в секунду"""
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / _PERIODS[period[0]]
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, capacity):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, capacity, rate):
+        """Забирает токен. Возвращает (разрешено, остаток, секунд до токена)"""
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, int(self.tokens), 0.0
+        return False, 0, (1 - self.tokens) / rate
+
+
+class RateLimit:
+    """Результат проверки: значения для заголовков X-RateLimit-*"""
+
+    __slots__ = ('allowed', 'limit', 'remaining', 'retry_after')
+
+    def __init__(self, allowed, limit, remaining, retry_after):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+    def apply_headers(self, response):
+        response['X-RateLimit-Limit'] = str(self.limit)
+        response['X-RateLimit-Remaining'] = str(self.remaining)
+        if not self.allowed:
+            response['Retry-After'] = str(math.ceil(self.retry_after))
+        return response
+
+
+_buckets = ExpiringLRU(MAX_BUCKETS)
+# get_ident() учитывает настройку DRF NUM_PROXIES
+_ident = BaseThrottle()
+
+
+def check_rate(scope, api_key, ip):
+    """Проверка лимита области для клиента; None, если лимита нет"""
+    limits = settings.EXCHANGE_RATE_LIMITS.get(scope)
+    if limits is None:
+        return None
+
+    identity = cached_identity(api_key)
+    if identity is not None:
+        role, client = identity[1], f'key:{api_key}'
+    else:
+        role, client = ANON_ROLE, f'ip:{ip}'
+    rate = parse_rate(limits.get(role))
+    if rate is None:
+        return None
+
+    capacity, refill = rate
+    bucket = _buckets.get_or_create((scope, client), lambda: TokenBucket(capacity))
+    with _buckets.lock:
+        allowed, remaining, retry_after = bucket.consume(capacity, refill)
+    return RateLimit(allowed, capacity, remaining, retry_after)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle DRF по throttle_scope view; заголовки добавляет RateLimitHeadersMiddleware"""
+
+    def allow_request(self, request, view):
+        self.result = check_request(request, getattr(view, 'throttle_scope', None))
+        return self.result is None or self.result.allowed
+
+    def wait(self):
+        return self.result.retry_after
+
+
+def check_request(request, scope):
+    """
+    Проверяет лимит области для запроса (Django или DRF). Результат
+    сохраняется в request.rate_limit для RateLimitHeadersMiddleware.
+    """
+    if scope is None:
+        return None
+    django_request = getattr(request, '_request', request)
+    result = check_rate(
+        scope, get_api_key(django_request), _ident.get_ident(django_request)
+    )
+    if result is not None:
+        django_request.rate_limit = result
+    return result
+
@@ -0,0 +1,199 @@
+"""
+Книга стоп-ордеров: ожидающие стоп-ордера тикера, упорядоченные по цене
+активации.
+
+Стоп на покупку активируется, когда цена сделки поднимается до цены
+активации или выше, стоп на продажу - когда опускается до неё или ниже.
+Поэтому стопы на покупку хранятся по возрастанию цены активации, стопы на
+продажу - по убыванию, и после каждой сделки из начала списков снимаются
+ровно пересечённые ценой стопы (поиск бинарный, без перебора всех стопов).
+
+Книга живёт в памяти процесса и строится из БД при первом обращении.
+Новый или отменённый стоп увеличивает версию стопов тикера и сохраняет
+изменение под новой версией (см. versions.bump_stops), и книга с
+предыдущей версией применяет недостающие изменения, не перечитывая стопы.
+Целиком из БД книга перестраивается, только если изменений не хватает
+(разрыв больше MAX_CHANGES версий, изменение вытеснено из кэша или
+записано без описания, как при делистинге) или когда транзакция, снявшая
+стопы, не была зафиксирована: снятие ждёт фиксации в очереди on_commit
+соединения, а откат транзакции или точки сохранения убирает его оттуда.
+Снятый стоп активируется условным UPDATE (см. OrderBook._activate), так
+что отменённый или уже активированный другим процессом стоп пропускается.
+"""
+import bisect
+import functools
+import threading
+from operator import itemgetter
+
+from django.db import transaction
+
+from . import versions
+
+_price = itemgetter(0)
+
+# Изменения книги, сохраняемые вместе с версией стопов
+ADD, REMOVE = 'add', 'remove'
+
+# Наибольший разрыв версий, который догоняется изменениями, а не перестроением
+MAX_CHANGES = 100
+
+
+def added(order):
+    """Изменение: новый ожидающий стоп-ордер"""
+    return (ADD, order.direction, order.trigger_price, order.created_at, str(order.id), order.order_type)
+
+
+def removed(order_id):
+    """Изменение: стоп-ордер больше не ожидает активации (отменён)"""
+    return (REMOVE, str(order_id))
+
+
+class TriggerBook:
+    def __init__(self, ticker, version):
+        self.ticker = ticker
+        self.version = version
+        # (цена активации, created_at, id, тип): по возрастанию цены
+        self.buy = []
+        # (-цена активации, created_at, id, тип): по убыванию цены
+        self.sell = []
+        self.last_price = None
+        # id -> (buy или sell, элемент списка)
+        self.entries = {}
+        # Снятия стопов, чьи транзакции ещё не зафиксированы
+        self.uncommitted = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.buy) + len(self.sell)
+
+    def _insert(self, direction, trigger_price, created_at, order_id, order_type):
+        # Повторное добавление (свой стоп вернулся изменением) пропускается
+        if order_id in self.entries:
+            return
+        if direction == 'BUY':
+            side, entry = self.buy, (trigger_price, created_at, order_id, order_type)
+        else:
+            side, entry = self.sell, (-trigger_price, created_at, order_id, order_type)
+        bisect.insort(side, entry)
+        self.entries[order_id] = (side, entry)
+
+    def _remove(self, order_id):
+        side, entry = self.entries.pop(order_id, (None, None))
+        if side is not None:
+            del side[bisect.bisect_left(side, entry)]
+
+    def add(self, order):
+        """Добавляет ожидающий стоп-ордер"""
+        with self.lock:
+            self._insert(*added(order)[1:])
+
+    def apply(self, version, changes, new_version):
+        """
+        Применяет изменения версий (version, new_version], если книга
+        всё ещё в версии version
+        """
+        with self.lock:
+            if self.version != version:
+                return
+            for kind, *change in changes:
+                if kind == ADD:
+                    self._insert(*change)
+                else:
+                    self._remove(*change)
+            self.version = new_version
+
+    def pop_crossed(self, price=None):
+        """
+        Запоминает цену последней сделки и снимает стопы, пересечённые ею.
+        Без price проверяет уже известную последнюю цену (для нового стопа).
+        Возвращает [(id, тип)]: покупки по возрастанию цены активации,
+        затем продажи по убыванию, при равной цене - в порядке создания.
+        """
+        with self.lock:
+            if price is None:
+                price = self.last_price
+                if price is None:
+                    return []
+            self.last_price = price
+            buy_end = bisect.bisect_right(self.buy, price, key=_price)
+            sell_end = bisect.bisect_right(self.sell, -price, key=_price)
+            if not buy_end and not sell_end:
+                return []
+            crossed = self.buy[:buy_end] + self.sell[:sell_end]
+            del self.buy[:buy_end]
+            del self.sell[:sell_end]
+            for _, _, order_id, _ in crossed:
+                del self.entries[order_id]
+
+            # При откате транзакции снятые стопы нужно вернуть: книга будет
+            # перестроена из БД (см. rolled_back)
+            pop = _Pop(self)
+            self.uncommitted.append(pop)
+        transaction.on_commit(pop.callback)
+        return [(order_id, order_type) for _, _, order_id, order_type in crossed]
+
+    def _committed(self, pop):
+        with self.lock:
+            self.uncommitted.remove(pop)
+
+    def rolled_back(self):
+        """
+        True, если транзакция, снявшая стопы, откатилась: снятие не
+        зафиксировано, а его callback пропал из очереди on_commit
+        """
+        with self.lock:
+            return any(not pop.pending() for pop in self.uncommitted)
+
+
+class _Pop:
+    """Снятие стопов, ожидающее фиксации транзакции"""
+
+    def __init__(self, book):
+        self.connection = transaction.get_connection()
+        self.callback = functools.partial(book._committed, self)
+
+    def pending(self):
+        return any(func is self.callback for _, func, _ in self.connection.run_on_commit)
+
+
+_books = {}
+
+
+def _load(ticker, version):
+    from .models import Order, Transaction
+
+    book = TriggerBook(ticker, version)
+    pending = Order.objects.pending_stops().filter(ticker=ticker).values_list(
+        'direction', 'trigger_price', 'created_at', 'id', 'order_type'
+    )
+    for direction, trigger_price, created_at, order_id, order_type in pending:
+        book._insert(direction, trigger_price, created_at, str(order_id), order_type)
+    book.last_price = (
+        Transaction.objects.filter(ticker=ticker)
+        .order_by('-timestamp', '-id')
+        .values_list('price', flat=True)
+        .first()
+    )
+    return book
+
+
+def get_book(ticker):
+    """
+    Книга стоп-ордеров тикера: догнанная до текущей версии изменениями или,
+    если их не хватает, перестроенная из БД
+    """
+    version = versions.stops_version(ticker)
+    book = _books.get(ticker)
+    if book is not None and book.rolled_back():
+        book = None
+    if book is not None and book.version != version:
+        since, changes = book.version, None
+        if 0 < version - since <= MAX_CHANGES:
+            changes = versions.stops_changes(ticker, since, version)
+        if changes is None:
+            book = None
+        else:
+            book.apply(since, changes, version)
+    if book is None:
+        book = _books[ticker] = _load(ticker, version)
+    return book
@@ -1,10 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     RegisterView, InstrumentListView, OrderbookView, TransactionHistoryView,
     BalanceView, DepositView, WithdrawView, OrderView, OrderDetailView,
-    AdminInstrumentView, AdminInstrumentDetailView
+    AdminInstrumentView, AdminInstrumentDetailView, MetricsView,
+    AdminBulkBalanceView, BalanceHistoryView, AdminDelistingJobView,
+    OrderbooksView, AccountOrderbooksView, AnalyticsView, AdminAnalyticsView
 )
 
+if settings.EXCHANGE_ASYNC_READS:
+    from .async_views import (
+        AsyncInstrumentListView as InstrumentListView,
+        AsyncOrderbookView as OrderbookView,
+        AsyncTransactionHistoryView as TransactionHistoryView,
+        AsyncBalanceView as BalanceView,
+    )
+
 urlpatterns = [
     path('public/register', RegisterView.as_view(), name='register'),
     path(
@@ -17,16 +28,36 @@ urlpatterns = [
         OrderbookView.as_view(), 
         name='orderbook'
     ),
+    path(
+        'public/orderbooks', 
+        OrderbooksView.as_view(), 
+        name='orderbooks'
+    ),
     path(
         'public/transactions/<str:ticker>', 
         TransactionHistoryView.as_view(), 
         name='transactions'
     ),
+    path(
+        'public/analytics/<str:ticker>', 
+        AnalyticsView.as_view(), 
+        name='analytics'
+    ),
     path(
         'balance', 
         BalanceView.as_view(), 
         name='balance'
     ),
+    path(
+        'orderbooks', 
+        AccountOrderbooksView.as_view(), 
+        name='account_orderbooks'
+    ),
+    path(
+        'balance/history', 
+        BalanceHistoryView.as_view(), 
+        name='balance_history'
+    ),
     path(
         'balance/deposit', 
         DepositView.as_view(), 
@@ -57,4 +88,24 @@ urlpatterns = [
         AdminInstrumentDetailView.as_view(), 
         name='admin_instrument_detail'
     ),
+    path(
+        'admin/delisting/<int:job_id>', 
+        AdminDelistingJobView.as_view(), 
+        name='admin_delisting_job'
+    ),
+    path(
+        'admin/balance/bulk', 
+        AdminBulkBalanceView.as_view(), 
+        name='admin_balance_bulk'
+    ),
+    path(
+        'admin/analytics/<str:ticker>', 
+        AdminAnalyticsView.as_view(), 
+        name='admin_analytics'
+    ),
+    path(
+        'metrics', 
+        MetricsView.as_view(), 
+        name='metrics'
+    ),
 ]
@@ -0,0 +1,183 @@
+"""
+Версии данных для условных GET-запросов (ETag).
+
+Для часто опрашиваемых эндпоинтов в кэше хранятся счётчики версий:
+реестр инструментов, стакан тикера и балансы пользователя. Изменение
+данных увеличивает счётчик после коммита транзакции (см. signals.py),
+а эндпоинт сравнивает If-None-Match клиента с текущей версией и при
+совпадении отвечает 304, не обращаясь к БД.
+
+Версия читается до чтения данных: если данные изменились между этими
+шагами, клиент получит новые данные со старым ETag и при следующем
+запросе просто загрузит их ещё раз. Обратная ситуация (старые данные с
+новым ETag) невозможна, только если данные читаются из основной базы:
+версия увеличивается после коммита в неё, а реплика может отставать.
+Поэтому эндпоинты с ETag закреплены за основной базой (read_your_writes).
+
+Так же версионируются ожидающие стоп-ордера тикера: по версии стопов
+процессы узнают, что книгу стоп-ордеров в памяти пора обновить, а
+изменения, сохранённые под каждой версией, позволяют не перестраивать её
+(см. triggers.py). При включённых снимках стаканов изменение стакана ещё и
+публикует его снимок в разделяемую память (см. book_snapshot.py).
+
+При нескольких процессах (gunicorn, шарды сопоставления) в CACHES должен
+быть настроен общий для них кэш, иначе процессы не видят версии друг друга
+и отвечают 304 на устаревшие данные (предупреждение exchange.W001).
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers
+)
+
+from . import book_snapshot
+
+_PREFIX = 'exchange:version:'
+
+# Сколько секунд хранятся изменения стопов: книга, отставшая дольше,
+# перестраивается из БД
+STOPS_CHANGE_TIMEOUT = 3600
+
+
+def _initial():
+    # Начальная версия - текущее время в наносекундах: если ключ пропал
+    # из кэша, новая версия не совпадёт ни с одним выданным ранее ETag
+    return time.time_ns()
+
+
+def _stamp(name):
+    key = _PREFIX + name
+    version = cache.get(key)
+    if version is None:
+        version = _initial()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+async def _astamp(name):
+    key = _PREFIX + name
+    version = await cache.aget(key)
+    if version is None:
+        version = _initial()
+        await cache.aadd(key, version, None)
+        version = await cache.aget(key, version)
+    return version
+
+
+def _bump(names):
+    def bump():
+        for name in names:
+            try:
+                cache.incr(_PREFIX + name)
+            except ValueError:
+                # Версии нет в кэше: читатель создаст новую
+                pass
+    # Читатель не должен увидеть новую версию раньше новых данных
+    transaction.on_commit(bump)
+
+
+def _book(ticker):
+    return f'book:{ticker}'
+
+
+def _balance(user_id):
+    return f'balance:{user_id}'
+
+
+def _stops(ticker):
+    return f'stops:{ticker}'
+
+
+def instruments_etag():
+    return f'"i{_stamp("instruments")}"'
+
+
+async def ainstruments_etag():
+    return f'"i{await _astamp("instruments")}"'
+
+
+def book_etag(ticker):
+    return f'"b{_stamp(_book(ticker))}"'
+
+
+async def abook_etag(ticker):
+    return f'"b{await _astamp(_book(ticker))}"'
+
+
+def balance_etag(user_id):
+    return f'"u{_stamp(_balance(user_id))}"'
+
+
+async def abalance_etag(user_id):
+    return f'"u{await _astamp(_balance(user_id))}"'
+
+
+def stops_version(ticker):
+    return _stamp(_stops(ticker))
+
+
+def bump_instruments():
+    _bump(['instruments'])
+
+
+def bump_book(ticker):
+    _bump([_book(ticker)])
+    if book_snapshot.enabled():
+        book_snapshot.publish_on_commit(ticker)
+
+
+def bump_balances(user_ids):
+    _bump([_balance(user_id) for user_id in user_ids])
+
+
+def bump_stops(ticker, change=None):
+    """
+    Увеличивает версию стопов тикера. change - изменение книги стопов
+    (triggers.added/removed), которое сохраняется под новой версией: по нему
+    процессы обновляют книгу, не перестраивая её. Без change книги
+    перестраиваются из БД.
+    """
+    name = _stops(ticker)
+
+    def bump():
+        try:
+            version = cache.incr(_PREFIX + name)
+        except ValueError:
+            return
+        if change is not None:
+            cache.set(f'{_PREFIX}{name}:{version}', change, STOPS_CHANGE_TIMEOUT)
+    transaction.on_commit(bump)
+
+
+def stops_changes(ticker, version, new_version):
+    """
+    Изменения стопов тикера версий (version, new_version] по порядку или
+    None, если какого-то из них нет
+    """
+    keys = [f'{_PREFIX}{_stops(ticker)}:{number}' for number in range(version + 1, new_version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) != len(keys):
+        return None
+    return [changes[key] for key in keys]
+
+
+def not_modified(request, etag):
+    """Ответ 304, если у клиента уже есть версия etag, иначе None"""
+    if etag is None:
+        return None
+    return get_conditional_response(request, etag=etag)
+
+
+def set_etag(response, etag, private=False):
+    """Добавляет ETag к успешному ответу; клиент должен перепроверять его"""
+    if response.status_code == 200:
+        response['ETag'] = etag
+        if private:
+            patch_cache_control(response, no_cache=True, private=True)
+            patch_vary_headers(response, ['Authorization'])
+        else:
+            patch_cache_control(response, no_cache=True)
+    return response
@@ -1,15 +1,30 @@
+from itertools import chain
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from drf_yasg.utils import swagger_auto_schema
-from drf_yasg import openapi
+from django.conf import settings
 from django.db import transaction
+from django.http import HttpResponse
 from .serializers import (
     NewUserSerializer, UserSerializer, InstrumentSerializer,
     DepositSerializer, WithdrawSerializer, LimitOrderSerializer,
-    MarketOrderSerializer, TransactionSerializer, CreateOrderResponseSerializer
+    MarketOrderSerializer, CreateOrderResponseSerializer,
+    BulkBalanceSerializer, LimitOrderBodySerializer, MarketOrderBodySerializer,
+    BalanceHistoryQuerySerializer, DelistQuerySerializer, DelistingJobSerializer,
+    OrderBooksQuerySerializer, AnalyticsQuerySerializer, AdminAnalyticsQuerySerializer,
+    TransactionHistoryQuerySerializer, transaction_rows
+)
+from .models import (
+    User, Instrument, Order, ArchivedOrder, Balance, OrderBook, DelistingJob
+)
+from . import (
+    analytics, auth, book_snapshot, delisting, ledger, metrics, sharding, tape, versions
 )
-from .models import User, Instrument, Order, Transaction, Balance, OrderBook
+from .auth import get_api_key
+from .bulk_balance import apply_balance_deltas
+from .db_router import read_your_writes
+from .idempotency import idempotent
 from django.core.exceptions import ValidationError
 
 # Вспомогательная функция для аутентификации
@@ -18,18 +33,43 @@ def get_authenticated_user(request):
     Аутентифицирует пользователя по API ключу из заголовка Authorization.
     Формат заголовка: TOKEN <api_key>
     """
-    auth_header = request.headers.get('Authorization')
-    if auth_header and auth_header.startswith("TOKEN "):
-        api_key = auth_header.split()[1]
-        try:
-            return User.objects.get(api_key=api_key)
-        except User.DoesNotExist:
-            return None
-    return None
+    api_key = get_api_key(request)
+    if api_key is None:
+        return None
+    try:
+        user = User.objects.get(api_key=api_key)
+    except User.DoesNotExist:
+        return None
+    auth.remember(api_key, user)
+    return user
+
+def get_order_books(tickers, depth):
+    """
+    Лучшие depth уровней стаканов tickers (None - всех активных
+    инструментов): из снимков в разделяемой памяти, если они покрывают
+    запрос, иначе одним запросом к БД. Instrument.DoesNotExist - тикер не
+    найден.
+    """
+    checked = tickers is None
+    if checked:
+        tickers = list(Instrument.objects.filter(status='ACTIVE').values_list('ticker', flat=True))
+    if book_snapshot.enabled():
+        # Опубликованный снимок означает, что инструмент существует
+        books = book_snapshot.read_many(tickers, depth)
+        if books is not None:
+            return books
+    if not checked:
+        found = set(Instrument.objects.filter(ticker__in=tickers).values_list('ticker', flat=True))
+        missing = [ticker for ticker in tickers if ticker not in found]
+        if missing:
+            raise Instrument.DoesNotExist(f"Instrument not found: {', '.join(missing)}")
+    return OrderBook.top_levels_many(tickers, depth)
 
 # 1. Регистрация пользователя
 class RegisterView(APIView):
     """Регистрация нового пользователя и создание начального баланса"""
+
+    throttle_scope = 'public'
     
     def post(self, request):
         serializer = NewUserSerializer(data=request.data)
@@ -42,21 +82,52 @@ class RegisterView(APIView):
 # 2. Список доступных инструментов (public)
 class InstrumentListView(APIView):
     """Публичный эндпоинт для получения списка доступных инструментов"""
-    
+
+    throttle_scope = 'public'
+
+    # ETag: данные читаются из основной базы (см. versions.py)
+    @read_your_writes
     def get(self, request):
-        instruments = Instrument.objects.all()
+        etag = versions.instruments_etag()
+        not_modified = versions.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        instruments = Instrument.objects.filter(status='ACTIVE')
         serializer = InstrumentSerializer(instruments, many=True)
-        return Response(serializer.data)
+        return versions.set_etag(Response(serializer.data), etag)
 
 # 3. Получение ордербука по инструменту
 class OrderbookView(APIView):
     """Получение актуального ордербука по указанному инструменту"""
-    
+
+    throttle_scope = 'public'
+
+    # ETag: данные читаются из основной базы (см. versions.py)
+    @read_your_writes
     def get(self, request, ticker):
+        if book_snapshot.enabled():
+            # Снимок из разделяемой памяти, без обращения к БД
+            snapshot = book_snapshot.read(ticker)
+            if snapshot is None and Instrument.objects.filter(ticker=ticker).exists():
+                book_snapshot.publish(ticker)
+                snapshot = book_snapshot.read(ticker)
+            if snapshot is not None:
+                etag, orderbook = snapshot
+                not_modified = versions.not_modified(request, etag)
+                if not_modified is not None:
+                    return not_modified
+                return versions.set_etag(Response(orderbook), etag)
+
+        etag = versions.book_etag(ticker)
+        not_modified = versions.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+
         try:
             Instrument.objects.get(ticker=ticker)
             orderbook = OrderBook.get_order_book(ticker)
-            return Response(orderbook)
+            return versions.set_etag(Response(orderbook), etag)
         except Instrument.DoesNotExist:
             return Response(
                 {"detail": "Instrument not found"},
@@ -68,31 +139,56 @@ class OrderbookView(APIView):
 
 class TransactionHistoryView(APIView):
     """История сделок по инструменту"""
+
+    throttle_scope = 'public'
     
     def get(self, request, ticker):
-        transactions = Transaction.objects.filter(ticker=ticker)
-        serializer = TransactionSerializer(transactions, many=True)
-        return Response(serializer.data)
+        """Параметры: since, until (ISO 8601), limit (до 1000) - последние сделки периода"""
+        serializer = TransactionHistoryQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        params = serializer.validated_data
+        # Архивные дни и живая таблица в одной ленте. Строки уже содержат
+        # готовые значения, поэтому экземпляры модели не создаются
+        transactions = tape.recent_trades(
+            ticker, since=params.get('since'), until=params.get('until'), limit=params['limit']
+        )
+        return Response(transaction_rows(transactions))
 
 # 5. Получение баланса (требуется авторизация)
 class BalanceView(APIView):
     """Получение баланса пользователя по всем активам"""
+
+    throttle_scope = 'balance'
     
+    @read_your_writes
     def get(self, request):
+        # Неизменившийся баланс отдаём по известному ключу, без запроса к БД
+        identity = auth.cached_identity(get_api_key(request))
+        if identity is not None:
+            not_modified = versions.not_modified(request, versions.balance_etag(identity[0]))
+            if not_modified is not None:
+                return not_modified
+
         user = get_authenticated_user(request)
         if user is None:
             return Response(
                 {"detail": "Неверный или отсутствующий API ключ"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        
+
+        etag = versions.balance_etag(user.id)
         balances = Balance.get_user_balances(user)
-        return Response(balances)
+        return versions.set_etag(Response(balances), etag, private=True)
 
 # 6. Депозит (обновление баланса)
 class DepositView(APIView):
     """Пополнение баланса пользователя"""
+
+    throttle_scope = 'balance'
     
+    @read_your_writes
+    @idempotent
     def post(self, request):
         user = get_authenticated_user(request)
         if user is None:
@@ -107,7 +203,13 @@ class DepositView(APIView):
             amount = serializer.validated_data['amount']
             
             try:
-                user.update_balance(ticker, amount)
+                instrument = Instrument.objects.get(ticker=ticker)
+                if instrument.status != 'ACTIVE':
+                    return Response(
+                        {"detail": "Instrument is being delisted"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                user.update_balance(instrument, instrument.to_minor(amount), kind='DEPOSIT')
                 return Response({"success": True})
             except Instrument.DoesNotExist:
                 return Response(
@@ -125,7 +227,11 @@ class DepositView(APIView):
 # 7. Снятие средств (вывод)
 class WithdrawView(APIView):
     """Вывод средств с баланса пользователя"""
+
+    throttle_scope = 'balance'
     
+    @read_your_writes
+    @idempotent
     def post(self, request):
         user = get_authenticated_user(request)
         if user is None:
@@ -140,7 +246,13 @@ class WithdrawView(APIView):
             amount = serializer.validated_data['amount']
             
             try:
-                user.update_balance(ticker, -amount)
+                instrument = Instrument.objects.get(ticker=ticker)
+                if instrument.status != 'ACTIVE':
+                    return Response(
+                        {"detail": "Instrument is being delisted"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                user.update_balance(instrument, -instrument.to_minor(amount), kind='WITHDRAWAL')
                 return Response({"success": True})
             except Instrument.DoesNotExist:
                 return Response(
@@ -158,7 +270,11 @@ class WithdrawView(APIView):
 # 8. Создание ордера и список ордеров (требуется авторизация)
 class OrderView(APIView):
     """Создание новых ордеров и получение списка ордеров пользователя"""
+
+    throttle_scope = 'orders'
     
+    @read_your_writes
+    @idempotent
     def post(self, request):
         """
         Создание нового ордера (лимитного или рыночного).
@@ -172,7 +288,22 @@ class OrderView(APIView):
             )
 
         data = request.data.copy()
-        
+        order_type = "LIMIT" if 'price' in data else "MARKET"
+
+        # Стоп-ордер или ордер со сроком: проверяем тело целиком
+        expires_at = None
+        if 'trigger_price' in data or 'expires_at' in data:
+            body_serializer = (
+                LimitOrderBodySerializer(data=data)
+                if order_type == "LIMIT"
+                else MarketOrderBodySerializer(data=data)
+            )
+            if not body_serializer.is_valid():
+                return Response(body_serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            expires_at = body_serializer.validated_data.get('expires_at')
+            if 'trigger_price' in data:
+                order_type = f"STOP_{order_type}"
+
         # Проверка существования инструмента
         try:
             instrument = Instrument.objects.get(ticker=data['ticker'])
@@ -181,19 +312,42 @@ class OrderView(APIView):
                 {"detail": "Instrument not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        if instrument.status != 'ACTIVE':
+            return Response(
+                {"detail": "Trading is halted"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
         # Проверка баланса для SELL ордеров
         if data['direction'] == 'SELL':
-            if user.get_balance(data['ticker']) < data['qty']:
+            if user.get_balance(data['ticker']) < instrument.to_minor(data['qty']):
                 return Response(
                     {"detail": "Insufficient balance"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
         # Проверка баланса USD для BUY лимитных ордеров
-        price = data.get('price', Order.objects.filter(ticker=data['ticker'], direction='BUY').order_by('-price').first().price)
+        # (стоп-рыночный ордер оцениваем по цене активации, рыночный - по
+        # лучшей встречной заявке в стакане)
+        price = data.get('price', data.get('trigger_price'))
+        if price is None:
+            opposite = 'SELL' if data['direction'] == 'BUY' else 'BUY'
+            price = (
+                Order.objects.active_limit()
+                .filter(ticker=data['ticker'], direction=opposite)
+                .order_by('price' if opposite == 'SELL' else '-price')
+                .values_list('price', flat=True)
+                .first()
+            )
+            if price is None:
+                # Исполненные ордера уходят в архив: пустой стакан - не 500
+                return Response(
+                    {"detail": "No liquidity for a market order"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         if data['direction'] == 'BUY':
-            required_balance = data['qty'] * price
+            usd = Instrument.objects.get(ticker='USD')
+            required_balance = usd.to_minor(data['qty'] * price)
             if user.get_balance('USD') < required_balance:
                 return Response(
                     {"detail": "Insufficient USD balance"},
@@ -201,43 +355,60 @@ class OrderView(APIView):
                 )
 
         # Создание и исполнение ордера
-        with transaction.atomic():
-            order_data = {
-                'user': user,
-                'ticker': data['ticker'],
-                'direction': data['direction'],
-                'qty': data['qty'],
-                'price': data.get('price'),
-                'order_type': "LIMIT" if 'price' in data else "MARKET"
-            }
+        order_data = {
+            'user': user,
+            'ticker': data['ticker'],
+            'direction': data['direction'],
+            'qty': data['qty'],
+            'price': data.get('price'),
+            'trigger_price': data.get('trigger_price'),
+            'expires_at': expires_at,
+            'order_type': order_type
+        }
 
+        if sharding.sharding_enabled():
+            # Сопоставлением тикера владеет отдельный процесс-шард
             order = Order.objects.create(**order_data)
-
             try:
-                transactions = OrderBook.match_orders(order)
-                
-                # Отмена рыночного ордера при недостаточной ликвидности
-                if order.price is None and order.status != 'EXECUTED':
-                    order.status = 'CANCELLED'
-                    order.save()
+                result = sharding.submit_order(sharding.owner_shard(instrument), order)
+            except sharding.ShardUnavailable as e:
+                # Шард мог зафиксировать сделки до обрыва связи или таймаута:
+                # отменяем ордер, только если его никто не исполнял
+                if sharding.cancel_unmatched(order.id):
                     return Response(
-                        {"detail": "Not enough liquidity for market order"},
-                        status=status.HTTP_400_BAD_REQUEST
+                        {"detail": str(e)},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
                     )
+                # Шард исполнил ордер, но ответ потерян: состояние - в GET /order/{id}
+                result = {'detail': None, 'profile': []}
+            detail, profiles = result['detail'], result['profile']
+        else:
+            with transaction.atomic():
+                order = Order.objects.create(**order_data)
+                with metrics.profiling() as reports:
+                    detail = OrderBook.execute(order)
+            profiles = [report.as_dict() for report in reports]
 
-                return Response({
-                    "success": True,
-                    "order_id": str(order.id)
-                })
+        if detail is not None:
+            return Response(
+                {"detail": detail},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-            except Exception as e:
-                order.status = 'CANCELLED'
-                order.save()
-                return Response(
-                    {"detail": str(e)},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+        response_data = {
+            "success": True,
+            "order_id": str(order.id)
+        }
+        if not settings.EXCHANGE_PROFILING:
+            return Response(response_data)
+
+        # Режим профилирования: разбивка времени по фазам сопоставления
+        response_data["profile"] = profiles
+        response = Response(response_data)
+        response['Server-Timing'] = metrics.server_timing(profiles)
+        return response
 
+    @read_your_writes
     def get(self, request):
         """Получение списка всех ордеров пользователя"""
         user = get_authenticated_user(request)
@@ -247,7 +418,11 @@ class OrderView(APIView):
                 status=status.HTTP_401_UNAUTHORIZED
             )
             
-        orders = Order.objects.filter(user=user)
+        # Активные и архивные ордера хранятся в разных таблицах
+        orders = chain(
+            Order.objects.filter(user=user),
+            ArchivedOrder.objects.filter(user=user).order_by('created_at')
+        )
         response_data = []
         
         for order in orders:
@@ -266,7 +441,10 @@ class OrderView(APIView):
 
 class OrderDetailView(APIView):
     """Управление отдельным ордером: просмотр деталей и отмена"""
+
+    throttle_scope = 'orders'
     
+    @read_your_writes
     def get(self, request, order_id):
         """Получение детальной информации об ордере"""
         user = get_authenticated_user(request)
@@ -277,20 +455,23 @@ class OrderDetailView(APIView):
             )
             
         try:
-            order = Order.objects.get(id=order_id, user=user)
+            order = Order.objects.filter(id=order_id, user=user).first()
+            if order is None:
+                order = ArchivedOrder.objects.get(id=order_id, user=user)
             serializer = (
                 LimitOrderSerializer(order)
-                if order.order_type == 'LIMIT'
+                if order.price is not None
                 else MarketOrderSerializer(order)
             )
             return Response(serializer.data)
             
-        except Order.DoesNotExist:
+        except ArchivedOrder.DoesNotExist:
             return Response(
                 {"detail": "Order not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
+    @read_your_writes
     def delete(self, request, order_id):
         """Отмена ордера"""
         user = get_authenticated_user(request)
@@ -318,6 +499,7 @@ class OrderDetailView(APIView):
 class AdminInstrumentView(APIView):
     """Административный интерфейс для управления инструментами"""
     
+    @read_your_writes
     def post(self, request):
         """Добавление нового инструмента"""
         user = get_authenticated_user(request)
@@ -343,22 +525,267 @@ class AdminInstrumentView(APIView):
 class AdminInstrumentDetailView(APIView):
     """Административный интерфейс для управления отдельным инструментом"""
     
+    @read_your_writes
     def delete(self, request, ticker):
-        """Удаление инструмента"""
+        """
+        Делистинг инструмента: торги останавливаются сразу, а отмена
+        ордеров, конвертация балансов в USD и архивация выполняются в фоне
+        (exchange.delisting). Ответ 202 с id задания.
+        """
         user = get_authenticated_user(request)
         if user is None or user.role != 'ADMIN':
             return Response(
                 {"detail": "Доступ запрещён"},
                 status=status.HTTP_403_FORBIDDEN
             )
-            
+
         try:
-            instrument = Instrument.objects.get(ticker=ticker)
-            instrument.delete()
-            return Response({"success": True})
-            
+            instrument = Instrument.objects.exclude(status='DELISTED').get(ticker=ticker)
         except Instrument.DoesNotExist:
             return Response(
                 {"detail": "Instrument not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
+        if instrument.ticker == 'USD':
+            return Response(
+                {"detail": "USD cannot be delisted"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Повторный запрос возвращает уже поставленное задание
+        job = DelistingJob.objects.filter(
+            instrument=instrument, stage__in=delisting.UNFINISHED_STAGES
+        ).first()
+        if job is None:
+            serializer = DelistQuerySerializer(data=request.query_params)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            price = serializer.validated_data.get('price') or delisting.last_price(ticker)
+            if price is None:
+                return Response(
+                    {"detail": "No trades yet, settlement price is required"},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            job = delisting.start(instrument, price)
+        return Response(
+            {"success": True, "job_id": job.id},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+
+class AdminDelistingJobView(APIView):
+    """Состояние и прогресс задания делистинга"""
+
+    @read_your_writes
+    def get(self, request, job_id):
+        user = get_authenticated_user(request)
+        if user is None or user.role != 'ADMIN':
+            return Response(
+                {"detail": "Доступ запрещён"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            job = DelistingJob.objects.select_related('instrument').get(id=job_id)
+        except DelistingJob.DoesNotExist:
+            return Response(
+                {"detail": "Delisting job not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(DelistingJobSerializer(job).data)
+
+
+# 12. Метрики движка сопоставления (требуется роль ADMIN)
+
+
+class MetricsView(APIView):
+    """Метрики в текстовом формате Prometheus"""
+
+    def get(self, request):
+        user = get_authenticated_user(request)
+        if user is None or user.role != 'ADMIN':
+            return Response(
+                {"detail": "Доступ запрещён"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        return HttpResponse(
+            metrics.REGISTRY.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
+# 13. Админ: массовое начисление и списание балансов (требуется роль ADMIN)
+
+
+class AdminBulkBalanceView(APIView):
+    """Массовые начисления и списания балансов"""
+
+    @read_your_writes
+    def post(self, request):
+        """
+        Применяет список операций {"user_id", "ticker", "amount"}.
+        Положительный amount начисляет, отрицательный - списывает.
+        """
+        user = get_authenticated_user(request)
+        if user is None or user.role != 'ADMIN':
+            return Response(
+                {"detail": "Доступ запрещён"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = BulkBalanceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+
+        operations = (
+            (operation.get('user_id'), operation.get('ticker'), operation.get('amount'))
+            for operation in serializer.validated_data['operations']
+        )
+        result = apply_balance_deltas(operations)
+        return Response(result.as_dict())
+
+# 14. История баланса (требуется авторизация)
+
+
+class BalanceHistoryView(APIView):
+    """Выписка: изменения балансов пользователя с балансом после каждого"""
+
+    throttle_scope = 'balance'
+
+    @read_your_writes
+    def get(self, request):
+        """
+        Записи журнала балансов от новых к старым. Параметры: ticker,
+        until (ISO 8601), before (id записи), limit (до 1000).
+        """
+        user = get_authenticated_user(request)
+        if user is None:
+            return Response(
+                {"detail": "Неверный или отсутствующий API ключ"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        serializer = BalanceHistoryQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        params = serializer.validated_data
+        return Response(ledger.history(
+            user,
+            ticker=params.get('ticker'),
+            until=params.get('until'),
+            before=params.get('before'),
+            limit=params['limit'],
+        ))
+
+# 15. Стаканы нескольких инструментов одним запросом (public)
+
+
+class OrderbooksView(APIView):
+    """Лучшие уровни стаканов нескольких инструментов"""
+
+    throttle_scope = 'public'
+
+    def get(self, request):
+        """Параметры: tickers (через запятую, по умолчанию - все), depth (до 1000)"""
+        serializer = OrderBooksQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        params = serializer.validated_data
+        try:
+            books = get_order_books(params.get('tickers'), params['depth'])
+        except Instrument.DoesNotExist as e:
+            return Response({"detail": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'books': books})
+
+# 16. Стаканы и балансы пользователя одним запросом (требуется авторизация)
+
+
+class AccountOrderbooksView(APIView):
+    """Стаканы нескольких инструментов вместе с балансами пользователя"""
+
+    throttle_scope = 'balance'
+
+    @read_your_writes
+    def get(self, request):
+        """Параметры - как у OrderbooksView"""
+        user = get_authenticated_user(request)
+        if user is None:
+            return Response(
+                {"detail": "Неверный или отсутствующий API ключ"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        serializer = OrderBooksQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        params = serializer.validated_data
+        try:
+            books = get_order_books(params.get('tickers'), params['depth'])
+        except Instrument.DoesNotExist as e:
+            return Response({"detail": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'books': books,
+            'balances': Balance.get_user_balances(user),
+        })
+
+# 17. Аналитика ленты сделок (public)
+
+
+class AnalyticsView(APIView):
+    """VWAP, профиль объёма и реализованная волатильность тикера за период"""
+
+    throttle_scope = 'public'
+
+    def get(self, request, ticker):
+        """Параметры: since, until (ISO 8601), interval (секунды), price_step"""
+        serializer = AnalyticsQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        params = serializer.validated_data
+        try:
+            result = analytics.analyze(
+                ticker,
+                since=params.get('since'),
+                until=params.get('until'),
+                interval=params['interval'],
+                price_step=params['price_step'],
+            )
+        except Instrument.DoesNotExist:
+            return Response({"detail": "Instrument not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(result)
+
+# 18. Админ: аналитика ленты сделок с PnL пользователей (требуется роль ADMIN)
+
+
+class AdminAnalyticsView(APIView):
+    """Аналитика ленты сделок тикера вместе с PnL пользователей за период"""
+
+    def get(self, request, ticker):
+        """Параметры - как у AnalyticsView, users - сколько пользователей вернуть в PnL"""
+        user = get_authenticated_user(request)
+        if user is None or user.role != 'ADMIN':
+            return Response(
+                {"detail": "Доступ запрещён"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = AdminAnalyticsQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        params = serializer.validated_data
+        try:
+            result = analytics.analyze(
+                ticker,
+                since=params.get('since'),
+                until=params.get('until'),
+                interval=params['interval'],
+                price_step=params['price_step'],
+                pnl_users=params['users'],
+            )
+        except Instrument.DoesNotExist:
+            return Response({"detail": "Instrument not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(result)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'flashik_exchange.settings')
+# Под ASGI публичные эндпоинты чтения обслуживаются асинхронными view
+os.environ.setdefault('EXCHANGE_ASYNC_READS', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'exchange.middleware.ThresholdGZipMiddleware',
+    'exchange.middleware.RateLimitHeadersMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -83,6 +87,17 @@ DATABASES = {
     }
 }
 
+# Реплика для публичных чтений. Локально это копия основной базы,
+# которую поддерживает команда `python manage.py sync_replica`
+if os.environ.get('EXCHANGE_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['EXCHANGE_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['exchange.db_router.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -126,3 +141,75 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Exchange settings
+
+# Режим профилирования: ответ на создание ордера содержит разбивку времени
+# сопоставления по фазам (поле "profile" и заголовок Server-Timing)
+EXCHANGE_PROFILING = False
+
+# Асинхронные версии публичных эндпоинтов чтения и /balance.
+# Включается автоматически при запуске через asgi.py
+EXCHANGE_ASYNC_READS = os.environ.get('EXCHANGE_ASYNC_READS') == '1'
+
+# Время жизни (секунды) кэша публичных ответов в асинхронных эндпоинтах,
+# 0 - без кэширования
+EXCHANGE_PUBLIC_CACHE_TIMEOUT = 0
+
+# Число процессов-шардов сопоставления (`python manage.py run_matching_shards`).
+# 0 - ордера сопоставляются в процессе веб-воркера
+EXCHANGE_MATCHING_SHARDS = int(os.environ.get('EXCHANGE_MATCHING_SHARDS', '0'))
+
+# Каталог Unix-сокетов шардов и таймаут ожидания ответа шарда (секунды)
+EXCHANGE_SHARD_SOCKET_DIR = os.environ.get(
+    'EXCHANGE_SHARD_SOCKET_DIR',
+    os.path.join(tempfile.gettempdir(), 'flashik_exchange')
+)
+EXCHANGE_SHARD_TIMEOUT = 10
+
+# Каталог сжатого архива ленты сделок (`python manage.py archive_transactions`)
+EXCHANGE_TRADE_ARCHIVE_DIR = BASE_DIR / 'trade_archive'
+
+# Рендеринг ответов API: быстрый JSON (orjson, если установлен);
+# браузерный интерфейс DRF - только в режиме отладки
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'exchange.renderers.FastJSONRenderer',
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    ],
+    'DEFAULT_THROTTLE_CLASSES': ['exchange.throttling.TokenBucketThrottle'],
+    # Число доверенных прокси перед приложением: 0 - IP клиента берётся из
+    # REMOTE_ADDR, X-Forwarded-For игнорируется
+    'NUM_PROXIES': 0,
+}
+
+# Минимальный размер ответа (байты), начиная с которого он сжимается gzip
+EXCHANGE_GZIP_MIN_LENGTH = 1024
+
+# Лимиты частоты запросов (exchange/throttling.py): область -> роль -> 'N/период'.
+# ANON - клиенты без известного API ключа (лимит по IP), None - без лимита
+EXCHANGE_RATE_LIMITS = {
+    'public': {'ANON': '20/s', 'USER': '50/s', 'ADMIN': None},
+    'balance': {'ANON': '5/s', 'USER': '20/s', 'ADMIN': None},
+    'orders': {'ANON': '5/s', 'USER': '10/s', 'ADMIN': None},
+}
+
+# Время жизни (секунды) ответов идемпотентных запросов (заголовок
+# Idempotency-Key) в кэше default
+EXCHANGE_IDEMPOTENCY_TTL = 24 * 3600
+
+# Заранее сгенерированная OpenAPI-схема (`python manage.py generate_schema`)
+EXCHANGE_SCHEMA_PATH = BASE_DIR / 'openapi.json'
+
+# Отложенный расчёт сделок: изменения балансов от сделок копятся в таблице
+# PendingSettlement и применяются процессом `python manage.py run_settlement`
+EXCHANGE_DEFERRED_SETTLEMENT = os.environ.get('EXCHANGE_DEFERRED_SETTLEMENT') == '1'
+
+# Снимки стаканов в разделяемой памяти (exchange/book_snapshot.py): имя
+# сегмента multiprocessing.shared_memory, пустая строка - выключено.
+# Стакан в OrderbookView тогда ограничен DEPTH лучшими уровнями на сторону;
+# TICKERS - число слотов тикеров в сегменте
+EXCHANGE_BOOK_SNAPSHOT = os.environ.get('EXCHANGE_BOOK_SNAPSHOT', '')
+EXCHANGE_BOOK_SNAPSHOT_DEPTH = 50
+EXCHANGE_BOOK_SNAPSHOT_TICKERS = 1024
@@ -14,36 +14,26 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 from django.urls import path, include
 
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Flashik Exchange API",
-        default_version='v1',
-        description="Документация API для проекта Flashik Exchange",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@example.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from exchange.schema import RedocView, SchemaView, SwaggerUIView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('exchange.urls')),
+    path(
+        'swagger.json', 
+        SchemaView.as_view(),
+        name='schema-json'
+    ),
     path(
         'swagger/', 
-        schema_view.with_ui('swagger', cache_timeout=0),
+        SwaggerUIView.as_view(),
         name='schema-swagger-ui'
     ),
     path(
         'redoc/', 
-        schema_view.with_ui('redoc', cache_timeout=0),
+        RedocView.as_view(),
         name='schema-redoc'
     ),
 ]